@@ -7,6 +7,7 @@ using namespace std;
 const char* LogFileName = "simulation_log.txt";
 const char* StatsFilePrefix = "stats_";
 const char* QSP_prefix = "QSP_";
+const char* QSPSolverStatsPrefix = "solver_stats_";
 const char* OdeStatsFilePrefix = "odeStats_";
 const char* SnapShotDir = "/snapShots";
 const char* SaveStateDir = "/savedStates";
@@ -17,6 +18,7 @@ FileOutputHub::FileOutputHub(void)
 , _log()
 , _generalStats()
 , _lymph_blood_QSP()
+, _QSP_solver_stats()
 , _odeStatsT()
 , _odeStatsCancer()
 , _gridSnapshotFstream()
@@ -29,6 +31,7 @@ FileOutputHub::~FileOutputHub()
 {
 	_log.close();
 	_generalStats.close();
+	_QSP_solver_stats.close();
 	_odeStatsT.close();
 	_odeStatsCancer.close();
 }
@@ -82,6 +85,18 @@ void FileOutputHub::setup(long seed, string baseDirectory){
 ofstream& FileOutputHub::getStatsFstream(void){ 
 	return _generalStats; 
 }
+
+/*! QSP solver statistics, next to the QSP output. Only opened when
+	statistics are written, so that no empty file is left otherwise.
+*/
+ofstream& FileOutputHub::get_QSP_solver_stats_stream(void){
+	if (!_QSP_solver_stats.is_open())
+	{
+		string statsFileName = _outDirBase + "/" + QSPSolverStatsPrefix + to_string(_seed) + ".csv";
+		_QSP_solver_stats.open(statsFileName, ios::out | ios::app);
+	}
+	return _QSP_solver_stats;
+}
 /*! Create a new output file stream for grid snapshot and return the pointer
 	\param [in] time: used to time stamp the file name
 	\param [in] tag: goes to first part of file name 
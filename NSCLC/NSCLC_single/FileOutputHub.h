@@ -24,6 +24,8 @@ public:
 	ofstream& getStatsFstream(void);
 	//! get reference to QSP output file stream;
 	ofstream& get_lymph_blood_QSP_stream(void) { return _lymph_blood_QSP; };
+	//! get reference to QSP solver statistics file stream (opened on first use)
+	ofstream& get_QSP_solver_stats_stream(void);
 	//! get pointer to ode stats file stream (T cell)
 	ofstream& getTCellOdeStatsFstream(){ return _odeStatsT; };
 	//! get pointer to ode stats file stream (Cancer cell)
@@ -48,6 +50,8 @@ private:
 	ofstream _generalStats;
 	//! Lymph-Blood QSP ode
 	ofstream _lymph_blood_QSP;
+	//! Lymph-Blood QSP solver statistics
+	ofstream _QSP_solver_stats;
 	//! ode stats output stream for T cells
 	ofstream _odeStatsT;
 	//! ode stats output stream for cancer cells
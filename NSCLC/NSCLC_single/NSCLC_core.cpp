@@ -141,6 +141,7 @@ void NSCLC_Core::timeSlice(const long slice){
 
 	/* QSP time step */
 	_lymph.time_step(t0, dt);
+	write_QSP_solver_stats(slice + 1);
 	//std::cout << "RNG check (" << slice << ") QSP: " << rng.get_unif_01() << std::endl;
 	return;
 
@@ -167,6 +168,10 @@ void NSCLC_Core::write_QSP(unsigned long slice, bool header)const{
 	auto& stream = output_hub.get_lymph_blood_QSP_stream();
 	if (header){
 		stream << "time" << _lymph.getQSPHeaders() << std::endl;
+		if (_lymph.getSolverStats())
+		{
+			output_hub.get_QSP_solver_stats_stream() << "time" << _lymph.getSolverStatsHeaders() << std::endl;
+		}
 	}
 	else{
 		stream << slice << _lymph << std::endl;
@@ -174,6 +179,21 @@ void NSCLC_Core::write_QSP(unsigned long slice, bool header)const{
 	return;
 }
 
+/*! Solver statistics of the QSP time step ending at slice, if the QSP
+	class is generated with converter option use_solver_stats. Written
+	every time step, independent of the stats interval.
+*/
+void NSCLC_Core::write_QSP_solver_stats(unsigned long slice)const{
+	if (_lymph.getSolverStats())
+	{
+		auto& stream = output_hub.get_QSP_solver_stats_stream();
+		stream << slice;
+		_lymph.printSolverStats(stream);
+		stream << std::endl;
+	}
+	return;
+}
+
 void NSCLC_Core::writeOde(unsigned long slice){
 	_tumor.printCellOdeToFile(slice);
 }
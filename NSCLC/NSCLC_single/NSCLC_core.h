@@ -27,6 +27,8 @@ public:
 	void write_stats_slice(unsigned long slice) const;
 	//! write QSP content to file
 	void write_QSP(unsigned long slice, bool header)const;
+	//! write QSP solver statistics of the last time step to file
+	void write_QSP_solver_stats(unsigned long slice)const;
 	//! Write ODE stats of current time slice to ode stats file
 	virtual void writeOde(unsigned long slice);
 	//! Write grid snapshots of current time slice to file 
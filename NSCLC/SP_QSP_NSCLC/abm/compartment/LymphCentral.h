@@ -54,6 +54,12 @@ public:
 	std::string getQSPHeaders(void)const { return LymphBloodQSP::getHeader();};
 	//! write QSP variables 
 	friend std::ostream & operator<<(std::ostream &os, const LymphCentral& l);
+	//! QSP solver statistics collected (converter option use_solver_stats)
+	bool getSolverStats(void)const { return _QSP_model.getSystem()->getSolverStats(); };
+	//! QSP solver statistics headers
+	std::string getSolverStatsHeaders(void)const { return _QSP_model.getSystem()->getSolverStatsHeader(); };
+	//! write QSP solver statistics of the last time step
+	void printSolverStats(std::ostream &os)const { _QSP_model.getSystem()->printSolverStats(os); };
 
 private:
 
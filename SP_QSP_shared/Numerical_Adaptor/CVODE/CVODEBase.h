@@ -14,8 +14,10 @@
 
 
 
+#include <chrono>
 #include <cmath>
 #include <iostream>
+#include <string>
 #include <vector>
 
 typedef std::vector< double > state_type;
@@ -31,6 +33,19 @@ protected:
 	};
 
 public:
+	//! solver counters of one output interval (one call of simOdeStep)
+	enum SOLVER_STAT {
+		STAT_STEP,		// steps
+		STAT_RHS,		// f evaluations
+		STAT_RHS_JAC,	// f evaluations for difference quotient Jacobian
+		STAT_ROOT,		// g evaluations
+		STAT_JAC,		// Jacobian evaluations
+		STAT_LIN_SETUP,	// linear solver setups
+		STAT_ERR_FAIL,	// local error test failures
+		STAT_CONV_FAIL,	// nonlinear solver convergence failures
+		STAT_NUM
+	};
+
 	CVODEBase(); 
 	CVODEBase(const CVODEBase & c);
 	~CVODEBase();
@@ -57,6 +72,27 @@ public:
 
 	//! manually update solver variable values
 	void updateVar(void);
+	//! reset events to their initial state, to reuse the object for a new parameter set
+	void resetEvents(void);
+	//! number of output species (columns of operator<<)
+	unsigned int get_num_output(void) const { return _neq + _species_other.size(); };
+	//! output species value with original units (column i of operator<<)
+	double getOutputVal(int i) const { return getVarOriginalUnit(i); };
+
+	//! collect solver statistics in simOdeStep
+	void setSolverStats(bool on) { _stats_on = on; };
+	//! if solver statistics are collected
+	bool getSolverStats(void) const { return _stats_on; };
+	//! columns of printSolverStats: wall time, counters, firings of each event
+	std::string getSolverStatsHeader(void) const;
+	//! solver statistics of the last output interval, in the format of operator<<
+	void printSolverStats(std::ostream &os) const;
+	//! counter of the last output interval (SOLVER_STAT)
+	long int getSolverStat(int i) const { return _stats[i]; };
+	//! wall time of the last output interval (s)
+	double getWallTime(void) const { return _wall_time; };
+	//! firings of event i in the last output interval
+	long int getEventFired(int i) const { return _event_fired[i]; };
 
 
 protected:
@@ -65,6 +101,10 @@ protected:
 	void setupCVODE();
 	//! pure virtual. Pass rhs function and initial conditions to solver, instantiated in derived class
 	virtual void initSolver(realtype t0) = 0;
+	//! create matrix and linear solver and attach them to the solver (dense by default)
+	virtual void setupLinearSolver(void);
+	//! evaluate subexpressions of the rhs that are constant during integration
+	virtual void update_precomputed(void) {};
 	//! setup variables
 	virtual void setupVariables(void) = 0;
 	//! setup events 
@@ -83,6 +123,10 @@ protected:
 	void updateTriggerComponentConditionsOnRoot(int* rootsFound);
 	//! update trigger conditions at time t, without root 
 	void updateTriggerComponentConditionsOnValue(realtype t);
+	//! next time after t at which a time-only trigger component switches; false if none
+	virtual bool getNextTimeTrigger(realtype t, realtype& tNext) { return false; };
+	//! switch time-only trigger components scheduled at t
+	virtual void updateTimeTriggers(realtype t) {};
 	//! evaluate event triggers
 	bool evaluateAllEvents(realtype t);
 	//! resolve event assignments recursively
@@ -111,6 +155,10 @@ protected:
 	virtual realtype get_unit_conversion_nspvar(int i) const = 0;
 	//! check if a variable is allowed to become negative
 	virtual bool allow_negative(int i) const {return true;};
+	//! name of event i in solver statistics
+	virtual std::string getEventName(int i) const { return "event_" + std::to_string(i); };
+	//! add solver counters since the last reinitialization
+	void addSolverStats(void);
 
 
 	//! some functions defined by SBML interpretor
@@ -134,6 +182,8 @@ protected:
 	N_Vector _y;
 	//! number of rootfinding functions
 	int _nroot;
+	//! trigger component of each rootfinding function; empty: root i is component i
+	std::vector<int> _root_trigger;
 	//! number of events
 	int _nevent;
 
@@ -154,6 +204,17 @@ protected:
 	//! one event is triggered
 	std::vector<bool>  _event_triggered;
 
+	//! collect solver statistics. Serialization not needed.
+	bool _stats_on;
+	//! solver counters of the last output interval
+	std::vector<long int> _stats;
+	//! firings of each event in the last output interval
+	std::vector<long int> _event_fired;
+	//! wall time of the last output interval (s)
+	double _wall_time;
+	//! start of the last output interval
+	std::chrono::steady_clock::time_point _wall_start;
+
 
 private:
 	friend class boost::serialization::access;
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+'''
+Command line version of the sbml converter: convert SBML models to C++
+classes with a configuration saved from the GUI (converter_gui.py).
+
+### Usage
+
+python converter_cli.py -c <config.xml> -o <out_dir> <model> [<model> ...]
+
+1. Models are SBML files, or directories: all SBML files in a directory
+(other xml files, e.g. parameter files, are skipped).
+
+2. Output of each model is written to out_dir, in which {model} is replaced
+by the file name of the model without extension. With several models and
+no {model} in out_dir, output goes to "<out_dir>/<model>/".
+
+3. Options of the configuration can be overridden, e.g. to build variants:
+--set use_cse=1 --set use_jacobian=1 --set linear_solver=klu
+(one option per --set, so that options are not taken for models)
+
+4. Models are converted by n_worker processes. libsbml is only loaded in
+the conversion processes; no display is needed.
+
+5. Only changed files are written (see sbmlConverter.export_file), so a
+build system recompiles only what changed. <class_name>_manifest.xml
+records hashes of the model, configuration and exported files. Files of
+an earlier export that are no longer generated (e.g. <class_name>.py after
+turning use_python off) are removed if unchanged, otherwise reported.
+
+6. A configuration saved for one model is applied to all models: a model
+hash mismatch is reported, but not an error. SIds of extra variables and
+hybrid items must exist in each model.
+'''
+
+import sys
+import os
+import time
+import argparse
+import xml.etree.ElementTree as ET
+from multiprocessing import Pool
+
+from converter_config import ConverterConfig, LINEAR_SOLVERS
+
+MODEL_PLACEHOLDER = '{model}'
+
+# SBML files of inputs (files, or directories searched for .xml files)
+def find_models(inputs):
+    models = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for f in sorted(os.listdir(path)):
+                f = os.path.join(path, f)
+                if f.lower().endswith('.xml') and is_sbml(f):
+                    models.append(f)
+        else:
+            models.append(path)
+    return models
+
+# root element is <sbml>; only reads the beginning of the file
+def is_sbml(path):
+    try:
+        for event, elem in ET.iterparse(path, events=('start',)):
+            return elem.tag.split('}')[-1] == 'sbml'
+    except ET.ParseError:
+        return False
+    return False
+
+def model_name(model):
+    return os.path.splitext(os.path.basename(model))[0]
+
+# output directory of each model
+def output_dirs(models, out_dir):
+    if MODEL_PLACEHOLDER not in out_dir and len(models) > 1:
+        out_dir = os.path.join(out_dir, MODEL_PLACEHOLDER)
+    return [out_dir.replace(MODEL_PLACEHOLDER, model_name(m)) for m in models]
+
+# override configuration options: ["name=value", ...]
+def set_options(config, options):
+    for item in options:
+        key, sep, value = item.partition('=')
+        if not sep or not hasattr(config, key) or key == 'file_hash':
+            raise NameError('Unknown option: {}'.format(item))
+        current = getattr(config, key)
+        if isinstance(current, bool):
+            value = bool(int(value))
+        elif isinstance(current, set):
+            value = set(v for v in value.split(',') if v)
+        else:
+            value = type(current)(value)
+        if key == 'linear_solver' and value not in LINEAR_SOLVERS:
+            raise ValueError('Unknown linear solver: {} (one of {})'.format(
+                value, ', '.join(LINEAR_SOLVERS)))
+        setattr(config, key, value)
+    return
+
+# files of an earlier export not written any more (sbmlConverter.remove_stale_files)
+def stale_report(stale_files):
+    report = ''
+    for file_name, removed in stale_files:
+        if removed:
+            report += 'Removed {}: not generated with this configuration.\n'.format(file_name)
+        else:
+            report += 'Stale {}: not generated with this configuration; kept, as it was edited or exported without a manifest.\n'.format(file_name)
+    return report
+
+# convert one model; errors are returned, not raised
+# return: model, output directory, warnings, optimization report,
+# (files written, files exported), error (None if successful)
+def convert_model(job):
+    model, out_dir, config, class_name, name_space = job
+    warning = ''
+    try:
+        import libsbmlCvode as lc
+        converter = lc.sbmlConverter()
+        converter.load_model(model)
+        warning = converter.load_converter_config(config)
+        converter.update_model_with_configuration()
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        converter.export_model(out_dir, class_name, name_space)
+    except Exception as e:
+        return model, out_dir, warning, '', (0, 0), repr(e)
+    warning += stale_report(converter.stale_files)
+    n_written = sum(1 for f in converter.export_files if f[2])
+    return (model, out_dir, warning, converter.optimization_report,
+            (n_written, len(converter.export_files)), None)
+
+# print results as they come in; returns number of failed models
+def report_results(results, verbose=False):
+    n_fail = 0
+    for model, out_dir, warning, report, files, err in results:
+        if err is None:
+            print('{} -> {} ({} of {} files changed)'.format(model, out_dir, *files))
+        else:
+            n_fail += 1
+            print('{}: failed: {}'.format(model, err))
+        if warning:
+            print(warning.rstrip())
+        if report and verbose:
+            print(report.rstrip())
+        sys.stdout.flush()
+    return n_fail
+
+# convert all models with n_worker processes (None: all cores); returns number of failed models
+def convert_all(models, out_dir, config, class_name, name_space, n_worker=None, verbose=False):
+    jobs = [(m, d, config, class_name, name_space)
+            for m, d in zip(models, output_dirs(models, out_dir))]
+    n_worker = min(n_worker or os.cpu_count(), len(jobs))
+    if n_worker <= 1:
+        return report_results(map(convert_model, jobs), verbose)
+    with Pool(n_worker) as pool:
+        return report_results(pool.imap_unordered(convert_model, jobs), verbose)
+
+if (__name__ == '__main__'):
+
+    parser = argparse.ArgumentParser(description='Convert SBML models to C++ classes')
+    parser.add_argument('models', nargs='+', help='SBML files or directories')
+    parser.add_argument('-c', '--config', required=True, help='converter configuration (saved from the GUI)')
+    parser.add_argument('-o', '--out_dir', default='.', help='output directory; {model} is replaced by the model name')
+    parser.add_argument('--class_name', default='ODE_system')
+    parser.add_argument('--namespace', default='QSP_IO')
+    parser.add_argument('--set', action='append', default=[], metavar='OPTION=VALUE',
+                        help='override a configuration option, e.g. use_cse=1; repeat for several')
+    parser.add_argument('-j', '--n_worker', type=int, default=os.cpu_count())
+    parser.add_argument('-v', '--verbose', action='store_true', help='print optimization reports')
+    args = parser.parse_args()
+
+    config = ConverterConfig.load(args.config)
+    try:
+        set_options(config, args.set)
+    except (NameError, ValueError) as e:
+        parser.error(str(e))
+    models = find_models(args.models)
+    if not models:
+        parser.error('no SBML model found')
+
+    t0 = time.time()
+    n_fail = convert_all(models, args.out_dir, config, args.class_name, args.namespace,
+                         args.n_worker, args.verbose)
+    print('converted: {}, failed: {} ({:.1f} s)'.format(len(models) - n_fail, n_fail, time.time() - t0))
+    sys.exit(1 if n_fail else 0)
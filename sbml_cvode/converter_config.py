@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Converter configuration: options of sbmlConverter and their xml file
+(sbml_converter_config), shared by the GUI (converter_gui.py) and the
+command line converter (converter_cli.py).
+
+Only standard modules are imported here, so that configurations can be
+read without loading libsbml.
+"""
+
+import xml.etree.ElementTree as ET
+from xml.dom import minidom
+import hashlib
+
+CONFIG_ROOT = 'sbml_converter_config'
+
+# linear solvers of the analytic Jacobian (libsbmlCvode.LINEAR_SOLVERS)
+LINEAR_SOLVERS = ['auto', 'dense', 'band', 'klu']
+
+# boolean options: config tag and sbmlConverter attribute.
+# missing tags (older settings) are False
+BOOL_OPTIONS = [('use_cse', 'use_cse'),
+                ('use_jacobian', 'use_jacobian'),
+                ('use_constant_folding', 'use_constant_folding'),
+                ('use_python', 'use_python'),
+                ('use_batch', 'use_batch'),
+                ('use_root_pruning', 'use_root_pruning'),
+                ('use_solver_stats', 'use_solver_stats')]
+
+# MD5 of a model file, recorded in configurations
+def model_hash(model_path):
+    hasher = hashlib.md5()
+    with open(model_path, 'rb') as f:
+        hasher.update(f.read())
+    return hasher.hexdigest()
+
+# MD5 of text, e.g. generated files and configurations
+def content_hash(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+class ConverterConfig:
+    def __init__(self):
+        self.file_hash = ''
+        # simulation time and tolerance
+        self.sim_t_start = 0.0
+        self.sim_t_step = 0.0
+        self.sim_n_step = 0
+        self.tol_rel = 0.0
+        self.tol_abs = 0.0
+        self.convert_unit = True
+        # code generation options (BOOL_OPTIONS)
+        for tag, attr in BOOL_OPTIONS:
+            setattr(self, attr, False)
+        self.linear_solver = LINEAR_SOLVERS[0]
+        # extra adjustable variables (SIds)
+        self.use_tune_var = False
+        self.var_extra = set()
+        # hybrid model: ABM weight and hybrid items (SIds)
+        self.use_hybrid = False
+        self.hybrid_abm_weight = 0.0
+        self.hybrid_items = set()
+        return
+    # configuration file content
+    def to_xml(self):
+        config = ET.Element(CONFIG_ROOT)
+        # hash
+        file_hash = ET.SubElement(config, 'file_hash')
+        file_hash.text = self.file_hash
+        # simulation time
+        sim_t_start = ET.SubElement(config, 'sim_t_start')
+        sim_t_start.text = str(self.sim_t_start)
+        sim_t_step = ET.SubElement(config, 'sim_t_step')
+        sim_t_step.text = str(self.sim_t_step)
+        sim_n_step = ET.SubElement(config, 'sim_n_step')
+        sim_n_step.text = str(self.sim_n_step)
+        # tolerance
+        tol_rel = ET.SubElement(config, 'tol_rel')
+        tol_rel.text = str(self.tol_rel)
+        tol_abs = ET.SubElement(config, 'tol_abs')
+        tol_abs.text = str(self.tol_abs)
+        # unit_convert
+        convert_unit = ET.SubElement(config, 'unit_convert')
+        convert_unit.text = str(int(self.convert_unit))
+        # code generation options
+        for tag, attr in BOOL_OPTIONS:
+            e = ET.SubElement(config, tag)
+            e.text = str(int(getattr(self, attr)))
+            if tag == 'use_jacobian':
+                linear_solver = ET.SubElement(config, 'linear_solver')
+                linear_solver.text = self.linear_solver
+        # extra_var
+        extra_var = ET.SubElement(config, 'extra_var')
+        use_tune_var = ET.SubElement(extra_var, 'use_tune_var')
+        use_tune_var.text = str(int(self.use_tune_var))
+        extra_var_list = ET.SubElement(extra_var, 'extra_var_list')
+        for item in sorted(self.var_extra):
+            ET.SubElement(extra_var_list, item)
+        # hybrid
+        hybrid = ET.SubElement(config, 'hybrid')
+        use_hybrid_model = ET.SubElement(hybrid, 'use_hybrid_model')
+        use_hybrid_model.text = str(int(self.use_hybrid))
+        hybrid_weight = ET.SubElement(hybrid, 'hybrid_abm_weight')
+        hybrid_weight.text = str(self.hybrid_abm_weight)
+        hybrid_list = ET.SubElement(hybrid, 'hybrid_item_list')
+        for item in sorted(self.hybrid_items):
+            ET.SubElement(hybrid_list, item)
+        return minidom.parseString(ET.tostring(config, 'utf-8')).toprettyxml(indent=' '*4)
+    # read configuration file content
+    @classmethod
+    def from_xml(cls, xml_string):
+        c = cls()
+        config = ET.fromstring(xml_string)
+        if config.tag != CONFIG_ROOT:
+            raise NameError('Not a converter configuration: <{}>'.format(config.tag))
+        c.file_hash = config.find('file_hash').text or ''
+        # simulation
+        c.sim_t_start = float(config.find('sim_t_start').text)
+        c.sim_t_step = float(config.find('sim_t_step').text)
+        c.sim_n_step = int(float(config.find('sim_n_step').text))
+        # tolerance
+        c.tol_rel = float(config.find('tol_rel').text)
+        c.tol_abs = float(config.find('tol_abs').text)
+        c.convert_unit = bool(int(config.find('unit_convert').text))
+        # code generation options (not in older settings)
+        for tag, attr in BOOL_OPTIONS:
+            e = config.find(tag)
+            setattr(c, attr, e is not None and bool(int(e.text)))
+        linear_solver = config.find('linear_solver')
+        if linear_solver is not None and linear_solver.text in LINEAR_SOLVERS:
+            c.linear_solver = linear_solver.text
+        # extra_var
+        extra_var = config.find('extra_var')
+        c.use_tune_var = bool(int(extra_var.find('use_tune_var').text))
+        c.var_extra = set(child.tag for child in extra_var.find('extra_var_list'))
+        # hybrid
+        hybrid = config.find('hybrid')
+        c.use_hybrid = bool(int(hybrid.find('use_hybrid_model').text))
+        c.hybrid_abm_weight = float(hybrid.find('hybrid_abm_weight').text)
+        c.hybrid_items = set(child.tag for child in hybrid.find('hybrid_item_list'))
+        return c
+    @classmethod
+    def load(cls, config_file):
+        with open(config_file, 'r') as f:
+            return cls.from_xml(f.read())
+    def save(self, config_file):
+        with open(config_file, 'w') as f:
+            f.write(self.to_xml())
+        return
+    # SIds of extra variables and hybrid items which are not in the model
+    # of converter; messages, empty if all found
+    def check_model(self, converter):
+        message = ''
+        for key in sorted(self.var_extra):
+            if key not in converter.key2name:
+                message += 'SId {} not found in model variables\n'.format(key)
+        for key in sorted(self.hybrid_items):
+            if not converter.model.getElementBySId(key):
+                message += 'Hybrid items SId {} not found in model items\n'.format(key)
+        return message
+    # set options of converter; update_model_with_configuration() applies them
+    def apply(self, converter):
+        if self.hybrid_abm_weight > 1 or self.hybrid_abm_weight < 0:
+            raise NameError('abm weight out of range [0, 1]')
+        converter.sim_t_start = self.sim_t_start
+        converter.sim_t_step = self.sim_t_step
+        converter.sim_n_step = self.sim_n_step
+        converter.reltol = self.tol_rel
+        converter.abstol = self.tol_abs
+        converter.convert_unit = self.convert_unit
+        for tag, attr in BOOL_OPTIONS:
+            setattr(converter, attr, getattr(self, attr))
+        converter.linear_solver = self.linear_solver
+        # variable selection
+        converter.use_variable_finetune = self.use_tune_var
+        converter.variable_modifiable = set(self.var_extra) if self.use_tune_var else set()
+        # hybrid model
+        converter.use_hybrid = self.use_hybrid
+        if self.use_hybrid:
+            converter.hybrid_abm_weight = self.hybrid_abm_weight
+            converter.hybrid_elements = set(self.hybrid_items)
+        else:
+            converter.hybrid_abm_weight = 0
+            converter.hybrid_elements = set()
+        return
+    # options of converter, as a configuration
+    @classmethod
+    def from_converter(cls, converter):
+        c = cls()
+        c.file_hash = getattr(converter, 'model_hash', '')
+        c.sim_t_start = converter.sim_t_start
+        c.sim_t_step = converter.sim_t_step
+        c.sim_n_step = converter.sim_n_step
+        c.tol_rel = converter.reltol
+        c.tol_abs = converter.abstol
+        c.convert_unit = converter.convert_unit
+        for tag, attr in BOOL_OPTIONS:
+            setattr(c, attr, getattr(converter, attr))
+        c.linear_solver = converter.linear_solver
+        c.use_tune_var = converter.use_variable_finetune
+        c.var_extra = set(converter.variable_modifiable)
+        c.use_hybrid = converter.use_hybrid
+        c.hybrid_abm_weight = converter.hybrid_abm_weight
+        c.hybrid_items = set(converter.hybrid_elements)
+        return c
@@ -14,12 +14,9 @@ import tkinter.ttk as ttk
 from tkinter import filedialog as fd
 from tkinter import messagebox
 
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
-import hashlib
-
 from pathlib import Path
 import libsbmlCvode as lc
+from converter_config import ConverterConfig, model_hash
 import platform
 
 
@@ -229,6 +226,7 @@ class converter_gui:
         self.draw_window()
 
         self.processed = False
+        self.model_hash = ''
         self.var_config = None
         self.var_extra = set()
         self.hybrid_config = None
@@ -426,6 +424,57 @@ class converter_gui:
                                            background = BG_COLOR, highlightbackground = BG_COLOR, 
                                            command=self.check_math)
         self.check_math_button.grid(row=r, column=0, sticky='ew')
+        # common subexpression elimination in ODE right hand side
+        self.use_cse = tk.BooleanVar()
+        self.use_cse.set(False)
+        self.check_cse = tk.Checkbutton(frame, text='Optimize ODE rhs (CSE)', background = BG_COLOR, 
+                                        variable = self.use_cse, anchor='w',justify = 'l')
+        self.check_cse.grid(row=r, column=1, sticky='ew')
+        # analytic Jacobian and linear solver
+        r += 1
+        self.linear_solver = tk.StringVar(self.master)
+        self.linear_solver.set(lc.LINEAR_SOLVERS[0])
+        self.linear_solver_menu = tk.OptionMenu(frame, self.linear_solver, *lc.LINEAR_SOLVERS)
+        self.linear_solver_menu.config(bg = BG_COLOR)
+        self.linear_solver_menu.grid(row=r, column=0, sticky='ew')
+        self.use_jacobian = tk.BooleanVar()
+        self.use_jacobian.set(False)
+        self.check_jacobian = tk.Checkbutton(frame, text='Analytic Jacobian', background = BG_COLOR, 
+                                             variable = self.use_jacobian, anchor='w',justify = 'l')
+        self.check_jacobian.grid(row=r, column=1, sticky='ew')
+        # precompute invariant subexpressions of ODE rhs
+        r += 1
+        self.use_constant_folding = tk.BooleanVar()
+        self.use_constant_folding.set(False)
+        self.check_constant_folding = tk.Checkbutton(frame, text='Precompute invariant terms', background = BG_COLOR, 
+                                                     variable = self.use_constant_folding, anchor='w',justify = 'l')
+        self.check_constant_folding.grid(row=r, column=1, sticky='ew')
+        # NumPy module next to the cpp class
+        self.use_python = tk.BooleanVar()
+        self.use_python.set(False)
+        self.check_python = tk.Checkbutton(frame, text='Export NumPy module', background = BG_COLOR, 
+                                           variable = self.use_python, anchor='w',justify = 'l')
+        self.check_python.grid(row=r, column=0, sticky='ew')
+        # thread_local class parameters, for MolecularModelBatch
+        r += 1
+        self.use_batch = tk.BooleanVar()
+        self.use_batch.set(False)
+        self.check_batch = tk.Checkbutton(frame, text='Batch runner (thread_local parameters)', background = BG_COLOR, 
+                                          variable = self.use_batch, anchor='w',justify = 'l')
+        self.check_batch.grid(row=r, column=1, sticky='ew')
+        # root finding only on y-dependent trigger components
+        self.use_root_pruning = tk.BooleanVar()
+        self.use_root_pruning.set(False)
+        self.check_root_pruning = tk.Checkbutton(frame, text='Schedule time events', background = BG_COLOR, 
+                                                 variable = self.use_root_pruning, anchor='w',justify = 'l')
+        self.check_root_pruning.grid(row=r, column=0, sticky='ew')
+        # solver statistics of each output interval
+        r += 1
+        self.use_solver_stats = tk.BooleanVar()
+        self.use_solver_stats.set(False)
+        self.check_solver_stats = tk.Checkbutton(frame, text='Solver statistics', background = BG_COLOR, 
+                                                 variable = self.use_solver_stats, anchor='w',justify = 'l')
+        self.check_solver_stats.grid(row=r, column=0, sticky='ew')
         # fine tune variable
         r += 1
         self.tune_var_button = tk.Button(frame, text="Config variables", 
@@ -569,39 +618,13 @@ class converter_gui:
             self.process_model()
             self.processed = True
             # hash
-            hasher = hashlib.md5()
-            with open(self.sbml_file, 'rb') as f:
-                buf = f.read()
-                hasher.update(buf)
-            self.model_hash = hasher.hexdigest()
+            self.model_hash = model_hash(self.sbml_file)
             self.print_info('Model hash (MD5): {}\n'.format(self.model_hash), TEXT_TAG_INFO)
         return
     # parse sbml
     def process_model(self):
         try:
-            if self.hybrid_abm_weight.get() > 1 or self.hybrid_abm_weight.get() < 0:
-                self.print_info('abm weight out of range [0, 1]\n', TEXT_TAG_ERR)
-                return
-            self.converter.sim_t_start = self.sim_t_start.get()
-            self.converter.sim_t_step = self.sim_t_step.get()
-            self.converter.sim_n_step = self.sim_n_step.get()
-            self.converter.reltol = self.tol_rel.get()
-            self.converter.abstol = self.tol_abs.get()
-            self.converter.convert_unit = self.use_unit_convert.get()
-            #variable selection
-            select_variables = self.converter.use_variable_finetune = self.use_tune_var.get()
-            if select_variables:
-                self.converter.variable_modifiable = self.var_extra
-            else:
-                self.converter.variable_modifiable = set()
-            #hybrid model
-            use_hybrid = self.converter.use_hybrid = self.use_hybrid_model.get()
-            if use_hybrid:
-                self.converter.hybrid_abm_weight = self.hybrid_abm_weight.get()
-                self.converter.hybrid_elements = self.hybrid_items
-            else:
-                self.converter.hybrid_abm_weight = 0
-                self.converter.hybrid_elements  = set()
+            self.get_config().apply(self.converter)
             # update
             self.converter.update_model_with_configuration()
             self.reset_option_menu()
@@ -613,6 +636,14 @@ class converter_gui:
             message += 'relative tolerance: {}\n'.format(self.converter.reltol)
             message += 'absolute tolerance: {}\n'.format(self.converter.abstol)
             message +='Convert units: {}\n'.format(self.converter.convert_unit)
+            message +='Optimize ODE rhs (CSE): {}\n'.format(self.converter.use_cse)
+            message +='Analytic Jacobian: {} (linear solver: {})\n'.format(self.converter.use_jacobian,
+                                     self.converter.linear_solver)
+            message +='Precompute invariant terms: {}\n'.format(self.converter.use_constant_folding)
+            message +='Export NumPy module: {}\n'.format(self.converter.use_python)
+            message +='Batch runner: {}\n'.format(self.converter.use_batch)
+            message +='Schedule time events: {}\n'.format(self.converter.use_root_pruning)
+            message +='Solver statistics: {}\n'.format(self.converter.use_solver_stats)
             message +='Custom variable setting: {} ({})\n'.format(self.converter.use_variable_finetune,
                                                 len(self.var_extra))
             message +='Hybrid model: {} ({}, ABM weight = {})\n'.format(self.converter.use_hybrid,
@@ -695,106 +726,71 @@ class converter_gui:
             self.print_info(str(e)+'\n', TEXT_TAG_ERR)    
         return
     
-    # convert configurations to a etree
-    def config_to_xml(self):
-        config = ET.Element('sbml_converter_config')
-        # hash
-        file_hash = ET.SubElement(config, 'file_hash')
-        file_hash.text = self.model_hash
-        # simulation time
-        sim_t_start = ET.SubElement(config, 'sim_t_start')
-        sim_t_start.text = str(self.sim_t_start.get())
-
-        sim_t_step= ET.SubElement(config, 'sim_t_step')
-        sim_t_step.text = str(self.sim_t_step.get())
+    # configuration from the state of the interface
+    def get_config(self):
+        config = ConverterConfig()
+        config.file_hash = self.model_hash
+        config.sim_t_start = self.sim_t_start.get()
+        config.sim_t_step = self.sim_t_step.get()
+        config.sim_n_step = self.sim_n_step.get()
+        config.tol_rel = self.tol_rel.get()
+        config.tol_abs = self.tol_abs.get()
+        config.convert_unit = self.use_unit_convert.get()
+        config.use_cse = self.use_cse.get()
+        config.use_jacobian = self.use_jacobian.get()
+        config.linear_solver = self.linear_solver.get()
+        config.use_constant_folding = self.use_constant_folding.get()
+        config.use_python = self.use_python.get()
+        config.use_batch = self.use_batch.get()
+        config.use_root_pruning = self.use_root_pruning.get()
+        config.use_solver_stats = self.use_solver_stats.get()
+        config.use_tune_var = self.use_tune_var.get()
+        config.var_extra = self.var_extra
+        config.use_hybrid = self.use_hybrid_model.get()
+        config.hybrid_abm_weight = self.hybrid_abm_weight.get()
+        config.hybrid_items = self.hybrid_items
+        return config
 
-        sim_n_step= ET.SubElement(config, 'sim_n_step')
-        sim_n_step.text = str(self.sim_n_step.get())
-
-        # tol_rel
-        tol_rel = ET.SubElement(config, 'tol_rel')
-        tol_rel.text = str(self.tol_rel.get())
-        # tol_abs
-        tol_abs = ET.SubElement(config, 'tol_abs')
-        tol_abs.text = str(self.tol_abs.get())
-        # unit_convert
-        convert_unit = ET.SubElement(config, 'unit_convert')
-        convert_unit.text = str(int(self.use_unit_convert.get()))
-        # extra_var
-        extra_var = ET.SubElement(config, 'extra_var')
-        use_tune_var = ET.SubElement(extra_var, 'use_tune_var')
-        use_tune_var.text = str(int(self.use_tune_var.get()))
-        extra_var_list = ET.SubElement(extra_var, 'extra_var_list')
-        for item in self.var_extra:
-            ET.SubElement(extra_var_list, item)
-        hybrid = ET.SubElement(config, 'hybrid')
-        use_hybrid_model = ET.SubElement(hybrid, 'use_hybrid_model')
-        use_hybrid_model.text = str(int(self.use_hybrid_model.get()))
-        # hybrid_weight
-        hybrid_weight = ET.SubElement(hybrid, 'hybrid_abm_weight')
-        hybrid_weight.text = str(self.hybrid_abm_weight.get())    
-        # hybrid_item
-        hybrid_list = ET.SubElement(hybrid, 'hybrid_item_list')
-        for item in self.hybrid_items:
-            ET.SubElement(hybrid_list, item)
-        
-        xml_string = minidom.parseString(ET.tostring(config, 'utf-8')).toprettyxml(indent=' '*4)
-        return xml_string
-    
+    # convert configurations to xml
+    def config_to_xml(self):
+        return self.get_config().to_xml()
     
     # parse xml to get configurations
     def parse_xml_config(self, xml_string):
-        #tree = ET.parse(filename)
-        #root = tree.getroot()
-        config = ET.fromstring(xml_string)
+        config = ConverterConfig.from_xml(xml_string)
         # hash check:
-        file_hash_from_setting = config.find('file_hash').text
-        if self.model_hash != file_hash_from_setting:
+        if self.model_hash != config.file_hash:
             self.print_info('Hash mismatch. Configuration generated from a different SBML file.\n', TEXT_TAG_ERR)
         # simulation
-        sim_t_start = float(config.find('sim_t_start').text)
-        self.sim_t_start.set(sim_t_start)
-        sim_t_step = float(config.find('sim_t_step').text)
-        self.sim_t_step.set(sim_t_step)
-        sim_n_step = float(config.find('sim_n_step').text)
-        self.sim_n_step.set(sim_n_step)
-        # tol_rel
-        tol_rel = float(config.find('tol_rel').text)
-        self.tol_rel.set(tol_rel)
-        # tol_abs
-        tol_abs = float(config.find('tol_abs').text)
-        self.tol_abs.set(tol_abs)
-        # unit_convert
-        convert_unit = config.find('unit_convert').text
-        self.use_unit_convert.set(bool(int(convert_unit)))
+        self.sim_t_start.set(config.sim_t_start)
+        self.sim_t_step.set(config.sim_t_step)
+        self.sim_n_step.set(config.sim_n_step)
+        # tolerance
+        self.tol_rel.set(config.tol_rel)
+        self.tol_abs.set(config.tol_abs)
+        self.use_unit_convert.set(config.convert_unit)
+        # code generation options
+        self.use_cse.set(config.use_cse)
+        self.use_jacobian.set(config.use_jacobian)
+        self.linear_solver.set(config.linear_solver)
+        self.use_constant_folding.set(config.use_constant_folding)
+        self.use_python.set(config.use_python)
+        self.use_batch.set(config.use_batch)
+        self.use_root_pruning.set(config.use_root_pruning)
+        self.use_solver_stats.set(config.use_solver_stats)
         # extra_var
-        extra_var = config.find('extra_var')
-        use_tune_var = extra_var.find('use_tune_var')
-        self.use_tune_var.set(bool(int(use_tune_var.text)))
-        varlist_elem = extra_var.find('extra_var_list')
+        self.use_tune_var.set(config.use_tune_var)
         self.var_extra.clear()
-        for child in varlist_elem:
-            self.var_extra.add(child.tag)
-        hybrid = config.find('hybrid')
-        use_hybrid_model = hybrid.find('use_hybrid_model')
-        self.use_hybrid_model.set(bool(int(use_hybrid_model.text)))
-        # hybrid_weight
-        hybrid_weight = hybrid.find('hybrid_abm_weight')
-        self.hybrid_abm_weight.set(float(hybrid_weight.text))
-        # hybrid_item
+        self.var_extra.update(config.var_extra)
+        # hybrid
+        self.use_hybrid_model.set(config.use_hybrid)
+        self.hybrid_abm_weight.set(config.hybrid_abm_weight)
         self.hybrid_items.clear()
-        hybrid_list = hybrid.find('hybrid_item_list')
-        for child in hybrid_list:
-            self.hybrid_items.add(child.tag)
+        self.hybrid_items.update(config.hybrid_items)
         # test if SId is element of model
-        for key in self.var_extra:
-            if key not in self.converter.key2name:
-                self.print_info('SId {} not found in model variables\n'.format(key), TEXT_TAG_ERR)
-                return
-        for key in self.hybrid_items:
-            if not self.converter.model.getElementBySId(key):
-                self.print_info('Hybrid items SId {} not found in model items\n'.format(key), TEXT_TAG_ERR)
-                return
+        message = config.check_model(self.converter)
+        if message:
+            self.print_info(message, TEXT_TAG_ERR)
         return
 
     # select output location 
@@ -809,12 +805,14 @@ class converter_gui:
             self.converter.export_model(self.export_dir, self.export_class_name.get(), self.export_namespace.get())
             message = 'Exported "{}" to {}:\n'.format(self.export_class_name.get(),
              self.export_dir)
-            message += 'ODE_system.cpp\n'
-            message += 'ODE_system.h\n'
-            message += 'Param.h\n'
-            message += 'Param.cpp\n'
-            message += '{}_params.xml\n'.format(self.export_class_name.get())
+            for file_name, file_hash, written in self.converter.export_files:
+                message += file_name + ('\n' if written else ' (unchanged)\n')
+            for file_name, removed in self.converter.stale_files:
+                message += file_name + (' (removed, not generated)\n' if removed
+                                        else ' (stale: edited or exported without a manifest, kept)\n')
             self.print_info(message, TEXT_TAG_SYS)
+            if self.converter.optimization_report:
+                self.print_info(self.converter.optimization_report, TEXT_TAG_INFO)
         except Exception as e:
             self.print_info(str(e)+'\n', TEXT_TAG_ERR)
         return
@@ -944,7 +942,7 @@ def draw_window_rule(self):
         var_id = ar.getVariable()
         var_text = self.converter.variable_name_string(var_id)
         var_type = lc.TYPE_TO_STRING[key2name[key]['type']]
-        eq = self.converter.general_translator.mathToString(ar.getMath())
+        eq = self.converter.analysis.formula('rule', i)
         remark = self.converter.note_to_string(ar.getNotes())
         entry = (i, var_text, var_type, eq, remark)
         tree.insert('', 'end', key, text=var_window.SELECTION_NULL, values=entry)
@@ -1009,7 +1007,7 @@ def draw_window_init_assignment(self):
         var_id = key
         var_text = self.converter.variable_name_string(var_id)
         var_type = lc.TYPE_TO_STRING[key2name[key]['type']]
-        eq = self.converter.general_translator.mathToString(ia.getMath())
+        eq = self.converter.analysis.formula('ia', i)
         remark = self.converter.note_to_string(ia.getNotes())
         entry = (i, var_text, var_type, eq, remark)
         tree.insert('', 'end', key, text=var_window.SELECTION_NULL, values=entry)
@@ -1147,10 +1145,8 @@ def draw_window_reaction(self):
         r = model.getReaction(i)
         key = r.getId()
         idx =  '{}'.format(i + 1)
-        k = r.getKineticLaw()
-        ud = k.getDerivedUnitDefinition()
-        unit = self.converter.get_SI_str(ud)
-        eq = self.converter.general_translator.mathToString(k.getMath())
+        unit = self.converter.analysis.fluxUnitSI[i]
+        eq = self.converter.analysis.formula('reaction', i)
         remark = self.converter.note_to_string(r.getNotes())
         entry = (idx, unit, eq, remark)
         tree.insert('', 'end', key, text=rf_window.SELECTION_NULL, values=entry)
@@ -1378,8 +1374,7 @@ def draw_window_hybrid(self):
                     r = model.getReaction(i)
                     key = r.getId()
                     idx =  'ReactionFlux_{}'.format(i + 1)
-                    k = r.getKineticLaw()
-                    eq = self.converter.general_translator.mathToString(k.getMath())
+                    eq = self.converter.analysis.formula('reaction', i)
                     remark = self.converter.note_to_string(r.getNotes())
                     entry = (idx, eq, remark)
                     tree.insert('', 'end', key, text=hybrid_window.SELECTION_NULL, values=entry)
@@ -13,6 +13,7 @@ CVODEBase::CVODEBase()
 , _neq(0)
 , _y(NULL)
 , _nroot(0)
+, _root_trigger()
 , _nevent(0)
 , _delayEvents()
 , _A(NULL)
@@ -21,6 +22,11 @@ CVODEBase::CVODEBase()
 , _trigger_element_type()
 , _trigger_element_satisfied()
 , _event_triggered()
+, _stats_on(false)
+, _stats(STAT_NUM, 0)
+, _event_fired()
+, _wall_time(0)
+, _wall_start()
 {
 
 }
@@ -32,6 +38,7 @@ CVODEBase::CVODEBase(const CVODEBase & c)
 , _neq(c._neq)
 , _y(NULL)
 , _nroot(0)
+, _root_trigger()
 , _nevent(0)
 , _delayEvents()
 , _A(NULL)
@@ -40,6 +47,11 @@ CVODEBase::CVODEBase(const CVODEBase & c)
 , _trigger_element_type()
 , _trigger_element_satisfied()
 , _event_triggered()
+, _stats_on(c._stats_on)
+, _stats(STAT_NUM, 0)
+, _event_fired()
+, _wall_time(0)
+, _wall_start()
 {
 
 }
@@ -77,6 +89,15 @@ void CVODEBase::simOdeStep(double tStart, double tStep){
 	realtype tEnd = tStart + tStep;
 	realtype t1 = tEnd;
 
+	// solver statistics of this output interval
+	if (_stats_on)
+	{
+		_wall_start = std::chrono::steady_clock::now();
+		_wall_time = 0;
+		_stats.assign(STAT_NUM, 0);
+		_event_fired.assign(_nevent, 0);
+	}
+
 	//std::cout << "beginning: " << t << ", " << tEnd << std::endl;
 
 	// in case events need to be executed at the beginning
@@ -101,12 +122,26 @@ void CVODEBase::simOdeStep(double tStart, double tStep){
 			t1 = tNextDisc;
 			delayedExecution = true;
 		}
+		// trigger components depending only on time: stop at switching time
+		realtype tNextTrigger = 0;
+		bool timeTrigger = getNextTimeTrigger(t, tNextTrigger) && tNextTrigger <= t1;
+		if (timeTrigger)
+		{
+			delayedExecution = delayedExecution && tNextDisc == tNextTrigger;
+			t1 = tNextTrigger;
+		}
 		//std::cout << "cycle: " << t << ", " << t1 << std::endl;
 
 		resetSolver(t, t1);
 
 		flag = CVode(_cvode_mem, t1, _y, &t, CV_NORMAL);
 
+		// counters restart at each reinitialization
+		if (_stats_on && flag != CV_TOO_CLOSE)
+		{
+			addSolverStats();
+		}
+
 		if (flag == CV_TOO_CLOSE)
 		{	// just move forward in this case
 			t = t1;
@@ -115,6 +150,13 @@ void CVODEBase::simOdeStep(double tStart, double tStep){
 			check_flag(&flag, "CVode", 1);
 		}
 
+		// time-only trigger components switch at their scheduled time
+		bool timeSwitch = timeTrigger && t == t1;
+		if (timeSwitch)
+		{
+			updateTimeTriggers(t);
+		}
+
 		if (flag == CV_ROOT_RETURN)
 		{
 			int* rootsFound = new int[_nroot];
@@ -127,6 +169,10 @@ void CVODEBase::simOdeStep(double tStart, double tStep){
 			delete[] rootsFound;
 		}
 		else {
+			if (timeSwitch)
+			{
+				discontinuity = evaluateAllEvents(t);
+			}
 			/**/
 			if (delayedExecution) {
 				// update trigger components for non-persistent events
@@ -140,7 +186,7 @@ void CVODEBase::simOdeStep(double tStart, double tStep){
 				bool delay = eventExecution(eventToExecute, true, ttemp);
 				_delayEvents.pop_back();
 				//std::cout << "delay queue size: " << _delayEvents.size() << std::endl;
-				discontinuity = !delay;
+				discontinuity = discontinuity || !delay;
 			}
 		}
 
@@ -163,6 +209,11 @@ void CVODEBase::simOdeStep(double tStart, double tStep){
 		save_y();
 		update_y_other();
 	}
+	if (_stats_on)
+	{
+		_wall_time = std::chrono::duration<double>(
+			std::chrono::steady_clock::now() - _wall_start).count();
+	}
 	std::cout << std::flush;
 	std::cerr << std::flush;
 	//std::cout << "End of step:" << t << *this << std::endl;
@@ -187,6 +238,17 @@ void CVODEBase::updateVar(void)
 	update_y_other();
 }
 
+/*! Reset events to their initial state: trigger components,
+	event triggers and delayed events. Together with setting up
+	parameters and variables again, this allows reusing one object
+	(and its solver memory) for many parameter sets.
+*/
+void CVODEBase::resetEvents(void)
+{
+	_delayEvents.clear();
+	setupEvents();
+}
+
 /*! Setup the solver
 This Should be called only once during construction, when no
 prior allocation of memory block to solver has taken place.
@@ -237,17 +299,9 @@ void CVODEBase::setupCVODE(){
 		flag = CVodeSetUserData(_cvode_mem, this);
 		check_flag(&flag, "CVodeSVtolerances", 1);
 
-		/* Create dense SUNMatrix for use in linear solves */
-		_A = SUNDenseMatrix(_neq, _neq);
-		check_flag(&flag, "SUNDenseMatrix", 1);
-
-		/* Create dense SUNLinearSolver object for use by CVode */
-		_LS = SUNLinSol_Dense(_y, _A);
-		check_flag(&flag, "SUNLinSol_Dense", 1);
-
-		/* Call CVodeSetLinearSolver to attach the matrix and linear solver to CVode */
-		flag = CVodeSetLinearSolver(_cvode_mem, _LS, _A);
-		check_flag(&flag, "CVodeSetLinearSolver", 1);
+		/* matrix and linear solver; derived classes with an analytic
+		* Jacobian override this to choose a sparse or banded solver. */
+		setupLinearSolver();
 
 	}
 	catch (std::string s){
@@ -257,6 +311,25 @@ void CVODEBase::setupCVODE(){
 	//std::cout << "_neq: " << _neq << std::endl;
 }
 
+/*! dense matrix and linear solver; Jacobian by difference quotients
+*/
+void CVODEBase::setupLinearSolver(void){
+
+	int flag = 0;
+
+	/* Create dense SUNMatrix for use in linear solves */
+	_A = SUNDenseMatrix(_neq, _neq);
+	check_flag(&flag, "SUNDenseMatrix", 1);
+
+	/* Create dense SUNLinearSolver object for use by CVode */
+	_LS = SUNLinSol_Dense(_y, _A);
+	check_flag(&flag, "SUNLinSol_Dense", 1);
+
+	/* Call CVodeSetLinearSolver to attach the matrix and linear solver to CVode */
+	flag = CVodeSetLinearSolver(_cvode_mem, _LS, _A);
+	check_flag(&flag, "CVodeSetLinearSolver", 1);
+}
+
 /*! get the t of the next potential discontinuity in simulation.
 This can be:
 1. Delay of execution from variable-associated trigger condition
@@ -279,21 +352,23 @@ bool CVODEBase::getNexTimeDisc(realtype& t){
 /* update trigger conditions
 */
 void CVODEBase::updateTriggerComponentConditionsOnRoot(int* rootsFound) {
-	for (auto i = 0; i < _nroot; i++)
+	for (auto k = 0; k < _nroot; k++)
 	{
+		// trigger component of root function k
+		int i = _root_trigger.empty() ? k : _root_trigger[k];
 		if (isTransient(i))
 		{
-			if (rootsFound[i] != 0)
+			if (rootsFound[k] != 0)
 			{
 				_trigger_element_satisfied[i] = isTransientEq(i);
 			}
 		}
 		else {
-			if (rootsFound[i] == 1 && !_trigger_element_satisfied[i])
+			if (rootsFound[k] == 1 && !_trigger_element_satisfied[i])
 			{
 				_trigger_element_satisfied[i] = true;
 			}
-			else if (rootsFound[i] == -1 && _trigger_element_satisfied[i])
+			else if (rootsFound[k] == -1 && _trigger_element_satisfied[i])
 			{
 				_trigger_element_satisfied[i] = false;
 			}
@@ -303,7 +378,7 @@ void CVODEBase::updateTriggerComponentConditionsOnRoot(int* rootsFound) {
 }
 
 void CVODEBase::updateTriggerComponentConditionsOnValue(realtype t) {
-	for (auto i = 0; i < _nroot; i++)
+	for (size_t i = 0; i < _trigger_element_satisfied.size(); i++)
 	{
 		_trigger_element_satisfied[i] = triggerComponentEvaluate(i, t,
 			_trigger_element_satisfied[i]);
@@ -326,6 +401,10 @@ bool CVODEBase::evaluateAllEvents(realtype t) {
 		// only execute when evaluation result change from false to true
 		if (trigger && !_event_triggered[i])
 		{
+			if (_stats_on)
+			{
+				_event_fired[i]++;
+			}
 			realtype dt = 0;
 			bool setDelay = eventExecution(i, false, dt);
 			/**/
@@ -356,7 +435,7 @@ void CVODEBase::resetEventTriggers() {
 this is called after event evaluation.
 */
 void CVODEBase::resetTransient() {
-	for (auto i = 0; i < _nroot; i++)
+	for (size_t i = 0; i < _trigger_element_satisfied.size(); i++)
 	{
 		if (isTransientEq(i))
 		{
@@ -405,6 +484,60 @@ void CVODEBase::PrintFinalStats(void *cvode_mem)
 		nni, ncfn, netf, nge);
 }
 
+/*! add solver counters of the current segment to the statistics
+of this output interval. CVodeReInit (resetSolver) restarts the
+counters of the solver, so this is called once after each CVode call,
+before its return flag is checked.
+*/
+void CVODEBase::addSolverStats(void)
+{
+	long int n[STAT_NUM] = { 0 };
+
+	CVodeGetNumSteps(_cvode_mem, &n[STAT_STEP]);
+	CVodeGetNumRhsEvals(_cvode_mem, &n[STAT_RHS]);
+	CVodeGetNumLinRhsEvals(_cvode_mem, &n[STAT_RHS_JAC]);
+	CVodeGetNumGEvals(_cvode_mem, &n[STAT_ROOT]);
+	CVodeGetNumJacEvals(_cvode_mem, &n[STAT_JAC]);
+	CVodeGetNumLinSolvSetups(_cvode_mem, &n[STAT_LIN_SETUP]);
+	CVodeGetNumErrTestFails(_cvode_mem, &n[STAT_ERR_FAIL]);
+	CVodeGetNumNonlinSolvConvFails(_cvode_mem, &n[STAT_CONV_FAIL]);
+
+	for (auto i = 0; i < STAT_NUM; i++)
+	{
+		_stats[i] += n[i];
+	}
+	// up to here, if the solver fails later in this interval
+	_wall_time = std::chrono::duration<double>(
+		std::chrono::steady_clock::now() - _wall_start).count();
+}
+
+/*! columns of solver statistics, in the format of getHeader()
+*/
+std::string CVODEBase::getSolverStatsHeader(void) const
+{
+	std::string s = ",wall_time,n_step,n_f,n_f_jac,n_g,n_jac,n_lin_setup,n_err_fail,n_conv_fail";
+	for (auto i = 0; i < _nevent; i++)
+	{
+		s += ",fired_" + getEventName(i);
+	}
+	return s;
+}
+
+/*! solver statistics of the last output interval
+*/
+void CVODEBase::printSolverStats(std::ostream &os) const
+{
+	os << "," << _wall_time;
+	for (auto i = 0; i < STAT_NUM; i++)
+	{
+		os << "," << _stats[i];
+	}
+	for (auto i = 0; i < _nevent; i++)
+	{
+		os << "," << (i < (int)_event_fired.size() ? _event_fired[i] : 0);
+	}
+}
+
 double CVODEBase::getSpeciesVar(unsigned int idx, bool raw) const
 {
 	if (idx < _species_var.size()){
@@ -478,9 +611,14 @@ reset start time and initial condition.
 */
 void CVODEBase::resetSolver(realtype t0, realtype t1){
 	int flag = 0;
+	// parameters and non-species variables may have changed 
+	// since the last segment (events, external updates)
+	update_precomputed();
 	restore_y();
-	flag = CVodeSetStopTime(_cvode_mem, t1);
+	// reinit first: stop time must not be behind the current time of the
+	// solver, which is not the case when t0 goes back (object reused)
 	flag = CVodeReInit(_cvode_mem, t0, _y);
+	flag = CVodeSetStopTime(_cvode_mem, t1);
 	return;
 }
 /*! copy variable value from vector to serial
@@ -0,0 +1,272 @@
+#ifndef __MOLECULAR_MODEL_BATCH__
+#define __MOLECULAR_MODEL_BATCH__
+
+#include "MolecularModelCVode.h"
+
+#include <algorithm>
+#include <atomic>
+#include <fstream>
+#include <limits>
+#include <mutex>
+#include <sstream>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <type_traits>
+#include <vector>
+
+/*! Batch simulation of a virtual population.
+
+	Parameter sets are the rows of a parameter matrix in the format of
+	param_log.csv written by expBatchGen: first column experiment id,
+	then one column per varied parameter, named by its path in the
+	parameter file. Other parameters keep their values in the base
+	parameter set.
+
+	Each worker thread owns one parameter object and one model object,
+	which is reset for every sample: solver memory is allocated once per
+	thread. The ODE class must be generated with thread_local class
+	parameters (converter option use_batch).
+
+	Trajectories of all samples are written to one .npy file of shape
+	(1 + nr of output species, nr of samples, nr of time points): each
+	variable is contiguous (columnar), variable 0 is time. Variable names
+	are written to <output>.header, in the format of the csv header.
+	Failed samples are filled with NaN after the failure.
+
+	If the ODE class collects solver statistics (converter option
+	use_solver_stats), the statistics of every sample and output interval
+	are written to <output>.solver_stats.csv, first column experiment id,
+	including the interval in which a sample failed.
+*/
+
+//! true if T is generated with thread_local class parameters (use_batch)
+template <class T, class = void>
+struct has_thread_local_parameters : std::false_type {};
+template <class T>
+struct has_thread_local_parameters<T, decltype(void(T::thread_local_parameters))>
+	: std::integral_constant<bool, T::thread_local_parameters> {};
+
+template <class T, class P>
+class MolecularModelBatch {
+	static_assert(has_thread_local_parameters<T>::value,
+		"MolecularModelBatch: generate the ODE class with converter option use_batch, "
+		"otherwise threads share its class parameters");
+public:
+	MolecularModelBatch(const P& base) :_base(base), _paramIdx(), _sampleId(), _samples(){};
+	~MolecularModelBatch(){};
+	//! load parameter matrix
+	void readParamMatrix(std::string fileName);
+	//! simulate all samples: nrStep steps of tStep from tStart. Returns number of failed samples
+	int run(double tStart, double tStep, int nrStep, unsigned int nrThread, std::string outFile);
+	//! number of samples
+	size_t size(void) const { return _samples.size(); };
+
+private:
+	//! setup model for sample s and simulate. values[v][k]: variable v at time point k
+	//! stats: rows of solver statistics, if not NULL
+	bool simSample(MolecularModelCVode<T>& model, P& param, size_t s,
+		double tStart, double tStep, int nrStep, std::vector<std::vector<double> >& values,
+		std::ostream* stats = NULL);
+	//! write .npy header of a 3D double array; returns offset of data
+	static size_t writeNpyHeader(std::ostream& os, size_t n0, size_t n1, size_t n2);
+
+	//! base parameter set
+	P _base;
+	//! parameter index of each column of the parameter matrix
+	std::vector<int> _paramIdx;
+	//! experiment id of each sample
+	std::vector<std::string> _sampleId;
+	//! parameter values of each sample
+	std::vector<std::vector<double> > _samples;
+};
+
+template <class T, class P>
+void MolecularModelBatch<T, P>::readParamMatrix(std::string fileName){
+	std::ifstream f(fileName);
+	if (!f.good())
+	{
+		throw std::invalid_argument("Cannot open parameter matrix: " + fileName);
+	}
+	std::string line, item;
+	std::getline(f, line);
+	std::stringstream header(line);
+	// first column: experiment id
+	std::getline(header, item, ',');
+	_paramIdx.clear();
+	while (std::getline(header, item, ','))
+	{
+		item.erase(item.find_last_not_of(" \r\n") + 1);
+		int idx = _base.getIndex(item);
+		if (idx < 0)
+		{
+			throw std::invalid_argument("Parameter matrix: \"" + item + "\" not found");
+		}
+		_paramIdx.push_back(idx);
+	}
+	_sampleId.clear();
+	_samples.clear();
+	while (std::getline(f, line))
+	{
+		if (line.find_first_not_of(" \r\n") == std::string::npos)
+		{
+			continue;
+		}
+		std::stringstream row(line);
+		std::getline(row, item, ',');
+		_sampleId.push_back(item);
+		std::vector<double> v;
+		while (std::getline(row, item, ','))
+		{
+			v.push_back(std::stod(item));
+		}
+		if (v.size() != _paramIdx.size())
+		{
+			throw std::invalid_argument("Parameter matrix: wrong number of values, experiment "
+				+ _sampleId.back());
+		}
+		_samples.push_back(v);
+	}
+}
+
+template <class T, class P>
+int MolecularModelBatch<T, P>::run(double tStart, double tStep, int nrStep,
+	unsigned int nrThread, std::string outFile){
+
+	std::string names = "t" + T::getHeader();
+	size_t nVar = std::count(names.begin(), names.end(), ',') + 1;
+	size_t nSample = _samples.size();
+	size_t nTime = nrStep + 1;
+
+	std::ofstream fh(outFile + ".header", std::ios::trunc);
+	fh << names << std::endl;
+	fh.close();
+
+	// preallocate output; workers write disjoint blocks
+	size_t offset = 0;
+	{
+		std::ofstream fs(outFile, std::ios::binary | std::ios::trunc);
+		offset = writeNpyHeader(fs, nVar, nSample, nTime);
+		if (nSample)
+		{
+			fs.seekp(offset + nVar * nSample * nTime * sizeof(double) - 1);
+			fs.put(0);
+		}
+	}
+
+	std::atomic<size_t> next(0);
+	std::atomic<int> nrFailed(0);
+	// solver statistics; header written by the first worker
+	std::mutex statsMutex;
+	std::ofstream fstats;
+	auto worker = [&](){
+		P param(_base);
+		MolecularModelCVode<T> model;
+		std::fstream fs(outFile, std::ios::binary | std::ios::in | std::ios::out);
+		std::vector<std::vector<double> > values(nVar, std::vector<double>(nTime, 0));
+		bool stats = model.getSystem()->getSolverStats();
+		if (stats)
+		{
+			std::lock_guard<std::mutex> lock(statsMutex);
+			if (!fstats.is_open())
+			{
+				fstats.open(outFile + ".solver_stats.csv", std::ios::trunc);
+				fstats << "sample,t" << model.getSystem()->getSolverStatsHeader() << std::endl;
+			}
+		}
+		std::ostringstream statsRows;
+		for (size_t s = next++; s < nSample; s = next++)
+		{
+			statsRows.str("");
+			if (!simSample(model, param, s, tStart, tStep, nrStep, values, stats ? &statsRows : NULL))
+			{
+				std::cerr << "Experiment " << _sampleId[s] << " failed" << std::endl;
+				nrFailed++;
+			}
+			if (stats)
+			{
+				std::lock_guard<std::mutex> lock(statsMutex);
+				fstats << statsRows.str();
+			}
+			for (size_t v = 0; v < nVar; v++)
+			{
+				fs.seekp(offset + (v * nSample + s) * nTime * sizeof(double));
+				fs.write(reinterpret_cast<const char*>(values[v].data()), nTime * sizeof(double));
+			}
+		}
+	};
+
+	nrThread = std::max(1u, std::min<unsigned int>(nrThread, nSample));
+	std::vector<std::thread> threads;
+	for (unsigned int i = 0; i < nrThread; i++)
+	{
+		threads.push_back(std::thread(worker));
+	}
+	for (auto & th : threads)
+	{
+		th.join();
+	}
+	return nrFailed;
+}
+
+template <class T, class P>
+bool MolecularModelBatch<T, P>::simSample(MolecularModelCVode<T>& model, P& param, size_t s,
+	double tStart, double tStep, int nrStep, std::vector<std::vector<double> >& values,
+	std::ostream* stats){
+
+	for (size_t j = 0; j < _paramIdx.size(); j++)
+	{
+		param.setVal(_paramIdx[j], _samples[s][j]);
+	}
+	// reset: class parameters (this thread), variables, events
+	T::setup_class_parameters(param);
+	T* sys = model.getSystem();
+	sys->setup_instance_tolerance(param);
+	sys->setup_instance_varaibles(param);
+	sys->resetEvents();
+	sys->eval_init_assignment();
+
+	size_t nVar = values.size();
+	bool success = true;
+	double t = tStart;
+	for (int k = 0; k <= nrStep; k++)
+	{
+		if (k > 0)
+		{
+			bool solved = success;
+			success = success && model.solve(t, tStep);
+			t += tStep;
+			if (stats && solved)
+			{
+				*stats << _sampleId[s] << "," << t;
+				sys->printSolverStats(*stats);
+				*stats << "\n";
+			}
+		}
+		values[0][k] = t;
+		for (size_t v = 1; v < nVar; v++)
+		{
+			values[v][k] = success ? sys->getOutputVal(v - 1)
+				: std::numeric_limits<double>::quiet_NaN();
+		}
+	}
+	return success;
+}
+
+template <class T, class P>
+size_t MolecularModelBatch<T, P>::writeNpyHeader(std::ostream& os, size_t n0, size_t n1, size_t n2){
+	std::ostringstream dict;
+	dict << "{'descr': '<f8', 'fortran_order': False, 'shape': ("
+		<< n0 << ", " << n1 << ", " << n2 << "), }";
+	std::string h = dict.str();
+	// magic, version 1.0 and header length take 10 bytes; data aligned to 64 bytes
+	h.append((64 - (10 + h.size() + 1) % 64) % 64, ' ');
+	h += '\n';
+	os.write("\x93NUMPY\x01\x00", 8);
+	os.put(char(h.size() & 0xff));
+	os.put(char(h.size() >> 8));
+	os << h;
+	return 10 + h.size();
+}
+
+#endif
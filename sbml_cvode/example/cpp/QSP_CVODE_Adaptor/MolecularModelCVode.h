@@ -16,6 +16,7 @@ class MolecularModelCVode {
 public:
 	MolecularModelCVode() :_model(){};
 	~MolecularModelCVode(){};
+	//! simulate from tStart for tStep; false if the solver failed
 	bool solve(double tStart,  double tStep);
 	T* getSystem(void) { return & _model; };
 
@@ -36,9 +37,11 @@ template <class T> bool MolecularModelCVode < T >::solve(double tStart, double t
 	}
 	catch (std::string s){
 		std::cerr << s << std::endl;
+		return false;
 	}
 	catch (...) {
 		std::cerr << "Error solving ODE" << std::endl;
+		return false;
 	}
 	return true;
 }
@@ -2,6 +2,7 @@
 #include <iostream>
 #include <boost/property_tree/xml_parser.hpp>
 #include <boost/foreach.hpp>
+#include <algorithm>
 #include <iostream>
 
 namespace pt = boost::property_tree;
@@ -213,3 +214,26 @@ void ParamBase::writeParamsToXml(std::string outFileName){
 	pt::write_xml(outFileName, tree, std::locale(), settings);
 
 }
+
+/*!	find float type parameter by path in the parameter file.
+	\param [in] path: full path ("QSP.init_value.Parameter.k"), or path 
+	relative to the root element, '/' separated as in param_log.csv of
+	expBatchGen ("init_value/Parameter/k").
+	\return index of the parameter, -1 if not found
+*/
+int ParamBase::getIndex(std::string path) const{
+
+	std::replace(path.begin(), path.end(), '/', '.');
+	std::string suffix = "." + path;
+	size_t nrFloatParam = _paramFloat.size();
+	for (size_t i = 0; i < nrFloatParam; i++)
+	{
+		const std::string & p = _paramDesc[i][0];
+		if (p == path || (p.size() > suffix.size() 
+			&& p.compare(p.size() - suffix.size(), suffix.size(), suffix) == 0))
+		{
+			return int(i);
+		}
+	}
+	return -1;
+}
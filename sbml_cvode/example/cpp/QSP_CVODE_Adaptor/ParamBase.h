@@ -14,6 +14,10 @@ public:
 	void initializeParams(std::string inFileName);
 	//! export paramters to xml
 	void writeParamsToXml(std::string);
+	//! index of float type parameter from its path, '.' or '/' separated; -1 if not found
+	int getIndex(std::string path) const;
+	//! set parameter value (float)
+	inline void setVal(unsigned int n, double v) { _paramFloat[n] = v; };
 	//! get parameter value (float)
 
 protected:
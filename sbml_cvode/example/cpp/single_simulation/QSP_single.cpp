@@ -57,6 +57,15 @@ int main()
 	// header
 	fs << "t" << tmodel.getSystem()->getHeader() << std::endl;
 
+	// solver statistics of each step (converter option use_solver_stats)
+	bool stats = tmodel.getSystem()->getSolverStats();
+	std::ofstream fstats;
+	if (stats)
+	{
+		fstats.open("solver_stats.csv", std::ios::trunc);
+		fstats << "t" << tmodel.getSystem()->getSolverStatsHeader() << std::endl;
+	}
+
 	// t = 0
 	fs << tStart << tmodel << std::endl;
 	// simulation: t: [0:360:1] days
@@ -65,8 +74,15 @@ int main()
 		tmodel.solve(tStart, stepInterval);
 		tStart += stepInterval;
 		fs << tStart << tmodel << std::endl;
+		if (stats)
+		{
+			fstats << tStart;
+			tmodel.getSystem()->printSolverStats(fstats);
+			fstats << std::endl;
+		}
 	}
 	fs.close();
+	fstats.close();
 
 #elif TASK == TASK_SERIALIZATION
 	//------------------------------  serialization ------------------------------//
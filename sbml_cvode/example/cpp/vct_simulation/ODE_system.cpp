@@ -46,7 +46,7 @@ void ODE_system::initSolver(realtype t){
     return;
 }    
 
-state_type ODE_system::_class_parameter = state_type(148, 0);
+thread_local state_type ODE_system::_class_parameter = state_type(148, 0);
 
 void ODE_system::setup_class_parameters(Param& param){
     //mAPC_Endo, mwe9254256_3b91_4192_b9e3_7753526c09c8, index: 0
@@ -687,6 +687,8 @@ void ODE_system::setup_instance_tolerance(Param& param){
     }
     int flag = CVodeSVtolerances(_cvode_mem, reltol, abstol);
     check_flag(&flag, "CVodeSVtolerances", 1);
+    // solver keeps a copy
+    N_VDestroy_Serial(abstol);
 
     
     return;
@@ -25,9 +25,11 @@ public:
     static void classSerialize(Archive & ar, const unsigned int  version);
 
     static const double _QSP_weight;
+    //! class parameters are per thread (checked by MolecularModelBatch)
+    static constexpr bool thread_local_parameters = true;
 private:
-    // parameters shared by all instances of this class
-    static state_type _class_parameter;
+    // parameters shared by all instances of this class in one thread
+    static thread_local state_type _class_parameter;
 public:
     ODE_system();
     ODE_system(const ODE_system& c);
@@ -7,12 +7,14 @@
 */
 
 #include "MolecularModelCVode.h"
+#include "MolecularModelBatch.h"
 #include "ODE_system.h"
 #include "Param.h"
 
 #include <iostream>
 #include <string>
 #include <algorithm> // min
+#include <thread>
 
 #include <boost/program_options.hpp>
 #include <boost/filesystem.hpp>
@@ -21,6 +23,7 @@
 
 namespace po = boost::program_options;
 typedef MolecularModelCVode<CancerVCT::ODE_system> QSP;
+typedef MolecularModelBatch<CancerVCT::ODE_system, CancerVCT::Param> QSP_batch;
 using CancerVCT::Param;
 
 int main(int argc, char* argv[])
@@ -28,6 +31,8 @@ int main(int argc, char* argv[])
 	std::string _inputParam;
 	std::string _outPath;
 	std::string _outfile;
+	std::string _batchFile;
+	unsigned int _nrThread;
 	// command line options
 	try {
 		po::options_description desc("Allowed options");
@@ -36,6 +41,8 @@ int main(int argc, char* argv[])
 			("input-file,i", po::value<std::string>(&_inputParam), "parameter file name")
 			("output-path,o", po::value<std::string>(&_outPath)->default_value("output"), "output file path")
 			("output-file-name,n", po::value<std::string>(&_outfile)->default_value("solution.csv"), "output file name")
+			("batch,b", po::value<std::string>(&_batchFile), "parameter matrix (param_log.csv); simulate all rows, output: batch.npy")
+			("threads,j", po::value<unsigned int>(&_nrThread)->default_value(std::thread::hardware_concurrency()), "number of threads (batch)")
 			;
 		po::variables_map vm;
 		po::store(po::parse_command_line(argc, argv, desc), vm);
@@ -66,6 +73,23 @@ int main(int argc, char* argv[])
 	Param params;
 	params.initializeParams(_inputParam);
 
+	// virtual population: one model object per thread
+	if (!_batchFile.empty())
+	{
+		QSP_batch batch(params);
+		try {
+			batch.readParamMatrix(_batchFile);
+		}
+		catch (std::exception& e) {
+			std::cerr << "error: " << e.what() << "\n";
+			return 1;
+		}
+		int nrFailed = batch.run(params.getVal(0) * SEC_PER_DAY, params.getVal(1) * SEC_PER_DAY,
+			int(params.getVal(2)), _nrThread, _outPath + "/batch.npy");
+		std::cout << batch.size() - nrFailed << " of " << batch.size() << " samples simulated" << std::endl;
+		return nrFailed ? 1 : 0;
+	}
+
 	CancerVCT::ODE_system::setup_class_parameters(params);
 	// simulation object
 	QSP model;
@@ -84,6 +108,15 @@ int main(int argc, char* argv[])
 	// header
 	f << "t" << model.getSystem()->getHeader() << std::endl;
 
+	// solver statistics of each output interval, next to the solution
+	bool stats = model.getSystem()->getSolverStats();
+	std::ofstream fstats;
+	if (stats)
+	{
+		fstats.open(_outPath + "/solver_stats.csv", std::ios::trunc);
+		fstats << "t" << model.getSystem()->getSolverStatsHeader() << std::endl;
+	}
+
 	// solve ODE system
 	double t_start = params.getVal(0) * SEC_PER_DAY;
 	double t_step = params.getVal(1) * SEC_PER_DAY ;
@@ -101,9 +134,16 @@ int main(int argc, char* argv[])
 
 		t_start += t_step_sim;
 		f << t_start << model << std::endl;
+		if (stats)
+		{
+			fstats << t_start;
+			model.getSystem()->printSolverStats(fstats);
+			fstats << std::endl;
+		}
 		//std::cout << t_start / SEC_PER_DAY << std::endl;
 	}
 	f.close();
+	fstats.close();
 	//std::cout << "End of simulation" << std::endl;
 
 	return 0;
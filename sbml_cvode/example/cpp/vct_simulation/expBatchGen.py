@@ -53,6 +53,17 @@ Currently supported rules:
 The resulting parameter files will be saved with names following the format of 
 "<out_path>/subject_i/sample_j/param_i_j_k.xml"
 
+### Packed output
+
+With option --packed, no parameter file is written per sample. Instead, each
+subject path gets the parameter matrix (param_log.csv) and one parameter file
+with the values of sample 1 (param_base.xml, or param_base_k.xml for treatment k),
+to be used as input of a batch runner (e.g. QSP_vct -i param_base.xml -b param_log.csv).
+
+Parameter files are rendered from a template of the batch file, built once per
+sampler: Param_Sampler.iter_samples and Param_Sampler.iter_sample_text stream
+parameter vectors or file contents to a consumer without writing files.
+
 '''
 
 import sys
@@ -66,6 +77,10 @@ from pyDOE2 import lhs
 
 master_value_pattern = re.compile('^\s*\{.*\}\s*$')
 value_range_pattern = re.compile('^\s*\[.*,.*\]\s*$')
+# placeholder of parameter i in template
+TEMPLATE_SLOT = '@@PARAM_{}@@'
+template_slot_pattern = re.compile('@@PARAM_(\d+)@@')
+PARAM_FILE_HEADER = '<?xml version="1.0" encoding="utf-8"?>\n'
 
 MASTER_TAG = 'master'
 MASTER_TAG_EXACT = 'exact'
@@ -320,6 +335,8 @@ class Param_Sampler:
         else:
             raise ValueError('Unrecognized sampling type: {}'.format(sample_type))
         self.param_out_values = np.zeros((self.nr_sample, nr_param_sweep))
+        # parameter file templates, by extra parameter paths
+        self._template = {}
         return
     
     def print_sweep_summary(self):
@@ -386,6 +403,58 @@ class Param_Sampler:
             elem.text = '{:g}'.format(p, end="")
         return tree
 
+    # parameter file as text chunks, with swept parameters followed by extra_path
+    # (e.g. treatment parameters) as slots: [text, slot, text, slot, ..., text].
+    # Element paths are resolved and the tree is serialized only once.
+    def _get_template(self, extra_path=()):
+        key = tuple(extra_path)
+        if key not in self._template:
+            tree = copy.deepcopy(self.tree)
+            root = tree.getroot()
+            for i, p in enumerate(self.sweep_path + list(key)):
+                ET.ElementTree(root).find(p).text = TEMPLATE_SLOT.format(i)
+            # same as Param_exporter: attributes are cleared
+            for elem in root.iter():
+                elem.attrib.clear()
+            text = PARAM_FILE_HEADER + ET.tostring(root, pretty_print = True, encoding='unicode')
+            parts = template_slot_pattern.split(text)
+            parts[1::2] = [int(i) for i in parts[1::2]]
+            self._template[key] = parts
+        return self._template[key]
+
+    # render parameter file content from template and parameter values
+    def _render(self, parts, values):
+        s = [parts[0]]
+        for i in range(1, len(parts), 2):
+            s.append('{:g}'.format(values[parts[i]]))
+            s.append(parts[i+1])
+        return ''.join(s)
+
+    # parameter file content of one sample, optionally with extra parameter values
+    def get_sample_text(self, sample_i, extra_path=(), extra_value=()):
+        parts = self._get_template(extra_path)
+        values = list(self.param_out_values[sample_i]) + list(extra_value)
+        return self._render(parts, values)
+
+    # stream sampled parameter vectors: (sample_i, values)
+    def iter_samples(self):
+        for i in range(self.param_out_values.shape[0]):
+            yield i, self.param_out_values[i]
+
+    # stream parameter file contents: (sample_i, treatment_i, text)
+    # param_path: list of length n
+    # param_values: list of length n x array of length m (one per treatment);
+    # without treatments, treatment_i is None
+    def iter_sample_text(self, param_path=(), param_values=()):
+        parts = self._get_template(param_path)
+        num_treatment = len(param_values[0]) if len(param_values) else 0
+        for i, values in self.iter_samples():
+            values = list(values)
+            if not num_treatment:
+                yield i, None, self._render(parts, values)
+            for ti in range(num_treatment):
+                yield i, ti, self._render(parts, values + [v[ti] for v in param_values])
+
     # write parameter value to file. 
     # rows: experiments
     # columns: parameters
@@ -453,37 +522,48 @@ class Param_exporter():
         fout.close()
         return
 
-def process_subject(ms, ps, subject_id, num_treatment, path, multistage = False):
-    n = ps.sample_param()
-    ps.record_exp_param(path)
-    #print('# samples: {}'.format(n))
-    for si in range(n):
-        process_sample(ms, ps, subject_id, si, num_treatment, path, multistage)
+# write text to file
+def write_text(filename, text):
+    with open(filename, 'w') as fout:
+        fout.write(text)
     return
- 
-def process_sample(ms, ps, subject_id, sample_id, num_treatment, path, multistage):
-    exporter = Param_exporter(ps.get_sample(sample_id))
-    if multistage:
-        ensure_path(path+'/sample_{}'.format(sample_id+1))
-        if num_treatment == 0:
-            exporter.export_sampled_params(path+'/sample_{1}/param_{0}_{1}_1'.format(subject_id+1, sample_id+1))
-        else:
-            exporter.export_sample_params_with_treatment(ms.get_treatment_path(), 
-                ms.get_treatment_value(), path+'/sample_{1}/param_{0}_{1}'.format(subject_id+1, sample_id+1))
+
+def process_subject(ms, ps, subject_id, num_treatment, path, multistage = False, packed = False):
+    ps.sample_param()
+    ps.record_exp_param(path)
+    if num_treatment:
+        param_path, param_values = ms.get_treatment_path(), ms.get_treatment_value()
     else:
-        #print('sample # {}'.format(sample_id+1))
-        exporter.export_sampled_params(path+'/param_{}'.format(sample_id+1))
+        param_path, param_values = [], []
+    if packed:
+        # parameter matrix and base parameter file(s) only
+        for si, ti, text in ps.iter_sample_text(param_path, param_values):
+            if si > 0:
+                break
+            suffix = '' if ti is None else '_{}'.format(ti+1)
+            write_text(path+'/param_base{}.xml'.format(suffix), text)
+        return
+    for si, ti, text in ps.iter_sample_text(param_path, param_values):
+        if multistage:
+            ensure_path(path+'/sample_{}'.format(si+1))
+            filename = path+'/sample_{1}/param_{0}_{1}_{2}.xml'.format(subject_id+1, si+1,
+                                                                     1 if ti is None else ti+1)
+        else:
+            filename = path+'/param_{}.xml'.format(si+1)
+        write_text(filename, text)
     return
 
 if (__name__ == '__main__'):
     
-    if len(sys.argv) != 3:
+    argv = [a for a in sys.argv if a != '--packed']
+    packed = len(argv) != len(sys.argv)
+    if len(argv) != 3:
         print('Usage:')
-        print('python expBatchGen.py parameter_batch out_path')
+        print('python expBatchGen.py parameter_batch out_path [--packed]')
         exit(1)
     else:
-        filename = sys.argv[1]
-        out_path = sys.argv[2]
+        filename = argv[1]
+        out_path = argv[2]
         group_prefix = 'subject'
     
     ms = Master_Sampler(filename)
@@ -494,12 +574,12 @@ if (__name__ == '__main__'):
         if num_subject == 0:
             ps = ms.create_sampler()
             group_out_path = out_path + '/{}_{}'.format(group_prefix, 1)
-            process_subject(ms, ps, 0, num_treatment, group_out_path, True)
+            process_subject(ms, ps, 0, num_treatment, group_out_path, True, packed)
         for i in range(num_subject):
             ps = ms.create_sampler(i)
             group_out_path = out_path + '/{}_{}'.format(group_prefix, i+1)
-            process_subject(ms, ps, i, num_treatment, group_out_path, True)
+            process_subject(ms, ps, i, num_treatment, group_out_path, True, packed)
     else:
         ps = ms.create_sampler()
-        process_subject(ms, ps, 0, 0, out_path)
+        process_subject(ms, ps, 0, 0, out_path, packed = packed)
     
\ No newline at end of file
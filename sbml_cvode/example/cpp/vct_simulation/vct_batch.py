@@ -0,0 +1,72 @@
+"""
+Virtual population in one process: QSP_vct -b simulates all rows of a
+parameter matrix (param_log.csv from expBatchGen.py) on a thread pool and
+writes one columnar array, batch.npy, of shape
+(nr of variables, nr of samples, nr of time points); variable 0 is time.
+With solver statistics in the model class, batch.npy.solver_stats.csv
+holds one row per sample and output interval.
+
+usage:
+python vct_batch.py -i CancerVCT_params.xml -p grid_param/param_log.csv -o out_grid
+python vct_batch.py -o out_grid --csv      # split batch.npy into solution_<id>.csv
+"""
+import os
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+
+BIN = './QSP_vct'
+NPY = 'batch.npy'
+
+# run QSP_vct in batch mode; returns exit code (nonzero if any sample failed)
+def run_batch(param_file, param_log, out_dir, threads=None, binary=BIN):
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    cmd = [binary, '-i', param_file, '-o', out_dir, '-b', param_log]
+    if threads:
+        cmd += ['-j', str(threads)]
+    print(' '.join(cmd))
+    return subprocess.call(cmd)
+
+# variable names, trajectories (memory mapped) and experiment ids of a batch
+def load_batch(out_dir, param_log=None):
+    path = os.path.join(out_dir, NPY)
+    with open(path + '.header') as f:
+        names = f.readline().strip().split(',')
+    values = np.load(path, mmap_mode='r')
+    ids = None
+    if param_log:
+        ids = pd.read_csv(param_log).iloc[:, 0].astype(str).tolist()
+    return names, values, ids
+
+# solver statistics of each sample and output interval; None if not collected
+def load_solver_stats(out_dir):
+    path = os.path.join(out_dir, NPY + '.solver_stats.csv')
+    if not os.path.isfile(path):
+        return None
+    return pd.read_csv(path, dtype={'sample': str})
+
+# one csv per sample, in the format of single runs (solution_<id>.csv)
+def write_csv(out_dir, param_log=None):
+    names, values, ids = load_batch(out_dir, param_log)
+    if ids is None:
+        ids = [str(s) for s in range(values.shape[1])]
+    for s, i in enumerate(ids):
+        df = pd.DataFrame(values[:, s, :].T, columns=names)
+        df.to_csv(os.path.join(out_dir, 'solution_{}.csv'.format(i)), index=False)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch simulation of a virtual population')
+    parser.add_argument('-i', '--input', help='base parameter file')
+    parser.add_argument('-p', '--param_log', default='grid_param/param_log.csv', help='parameter matrix')
+    parser.add_argument('-o', '--output', default='out_grid')
+    parser.add_argument('-j', '--threads', type=int, default=None)
+    parser.add_argument('--bin', default=BIN)
+    parser.add_argument('--csv', action='store_true', help='write one csv per sample')
+    args = parser.parse_args()
+
+    if args.input:
+        run_batch(args.input, args.param_log, args.output, args.threads, args.bin)
+    if args.csv:
+        write_csv(args.output, args.param_log if os.path.isfile(args.param_log) else None)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+'''
+This script runs a simulator binary on the parameter files generated by expBatchGen.py
+
+### Jobs
+
+1. Parameter files are found under param_path, following the layout of expBatchGen.py:
+"<param_path>/subject_i/sample_j/param_i_j_k.xml" (multi-stage), or
+"<param_path>/param_j.xml" (single stage).
+
+2. Each parameter file is simulated n_rep times. Output of a job is written to
+"<sim_path>/subject_i/sample_j/treatment_k/rep_r/" (multi-stage), or
+"<sim_path>/sample_j/rep_r/" (single stage),
+together with stdout/stderr of the simulator (log.txt).
+
+3. Command of a job: <bin> <param_flag> <param_file> <out_flag> <out_dir> <args>
+In args, {subject}, {sample}, {treatment} and {rep} are replaced by the job ids,
+e.g. --args "-s {rep} -t 500 -S"
+
+### Scheduling
+
+1. Jobs are enumerated lazily into a bounded queue, and run by n_worker
+simulator processes at a time.
+
+2. A job is successful when the simulator exits with 0 and all marker files
+(default: QSP_IC_SUCCESS and SIMULATION_SUCCESS) exist in its output directory.
+Failed jobs are retried up to n_retry times. An attempt in which the simulator
+cannot be started fails with exit code -1.
+
+3. Each attempt is appended to "<sim_path>/dispatch_log.csv": job, attempt,
+exit code, success, wall time (s) and peak resident memory (MB) of the simulator.
+
+4. Jobs which are already successful (markers present, or, without markers,
+success recorded in dispatch_log.csv) are skipped: an interrupted sweep is
+resumed by running the same command again.
+'''
+
+import sys
+import os
+import re
+import time
+import shlex
+import argparse
+import threading
+import queue
+import subprocess
+import shutil
+
+MARKER_DEFAULT = ['QSP_IC_SUCCESS', 'SIMULATION_SUCCESS']
+LOG_FILE = 'dispatch_log.csv'
+LOG_HEADER = 'job,attempt,returncode,success,wall_time,max_rss_mb\n'
+JOB_OUTPUT = 'log.txt'
+
+param_multistage_pattern = re.compile(r'^param_(\d+)_(\d+)_(\d+)\.xml$')
+param_single_pattern = re.compile(r'^param_(\d+)\.xml$')
+
+def ensure_path(path):
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return
+
+# sort key: subject_2 before subject_10
+def natural_key(s):
+    return [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', s)]
+
+# one simulation
+class Job():
+    def __init__(self, name, param_file, out_dir, ids):
+        # output directory relative to sim_path
+        self.name = name
+        self.param_file = param_file
+        self.out_dir = out_dir
+        # subject, sample, treatment, rep
+        self.ids = ids
+        return
+
+# enumerate jobs from the parameter file tree, in order of subject, sample, treatment, rep
+def find_jobs(param_path, sim_path, n_rep=1):
+    for dirpath, dirnames, filenames in os.walk(param_path):
+        dirnames.sort(key=natural_key)
+        for f in sorted(filenames, key=natural_key):
+            m = param_multistage_pattern.match(f)
+            if m:
+                subject, sample, treatment = m.groups()
+                path = 'subject_{}/sample_{}/treatment_{}'.format(subject, sample, treatment)
+            else:
+                m = param_single_pattern.match(f)
+                if not m:
+                    continue
+                subject, sample, treatment = '1', m.group(1), '1'
+                path = 'sample_{}'.format(sample)
+            for r in range(1, n_rep+1):
+                name = path + '/rep_{}'.format(r)
+                ids = {'subject': subject, 'sample': sample, 'treatment': treatment, 'rep': r}
+                yield Job(name, os.path.join(dirpath, f), os.path.join(sim_path, name), ids)
+
+# run jobs with a fixed number of simulator processes
+class Dispatcher():
+    def __init__(self, binary, sim_path, args='', param_flag='-p', out_flag='-o',
+                 markers=MARKER_DEFAULT, n_worker=os.cpu_count(), n_retry=1):
+        self.binary = binary
+        self.sim_path = sim_path
+        self.args = args
+        self.param_flag = param_flag
+        self.out_flag = out_flag
+        self.markers = markers
+        self.n_worker = max(1, n_worker)
+        self.n_retry = n_retry
+        self.log_file = os.path.join(sim_path, LOG_FILE)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._running = set()
+        self.n_success = 0
+        self.n_fail = 0
+        self.n_skip = 0
+        return
+
+    # jobs recorded as successful in a previous run
+    def _read_log(self):
+        done = set()
+        if os.path.isfile(self.log_file):
+            with open(self.log_file) as f:
+                next(f, None)
+                for line in f:
+                    items = line.strip().split(',')
+                    if len(items) == 6 and items[3] == '1':
+                        done.add(items[0])
+        return done
+
+    def _is_done(self, job, done):
+        if self.markers:
+            return all(os.path.isfile(os.path.join(job.out_dir, m)) for m in self.markers)
+        return job.name in done
+
+    def _command(self, job):
+        cmd = [self.binary, self.param_flag, job.param_file, self.out_flag, job.out_dir]
+        return cmd + shlex.split(self.args.format(**job.ids))
+
+    # one attempt; returns exit code, wall time and peak RSS (MB, None if not available)
+    def _run_once(self, job):
+        ensure_path(job.out_dir)
+        # stale markers from an earlier failed attempt
+        for m in self.markers:
+            marker = os.path.join(job.out_dir, m)
+            if os.path.isfile(marker):
+                os.remove(marker)
+        t0 = time.time()
+        with open(os.path.join(job.out_dir, JOB_OUTPUT), 'w') as fout:
+            p = subprocess.Popen(self._command(job), stdout=fout, stderr=subprocess.STDOUT)
+            with self._lock:
+                self._running.add(p)
+            max_rss = None
+            if hasattr(os, 'wait4'):
+                # resource usage of this child only; ru_maxrss in kB (Linux)
+                _, status, usage = os.wait4(p.pid, 0)
+                p.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+                max_rss = usage.ru_maxrss / 1024
+            else:
+                p.wait()
+            with self._lock:
+                self._running.discard(p)
+        return p.returncode, time.time() - t0, max_rss
+
+    def _run_job(self, job):
+        for attempt in range(1, self.n_retry+2):
+            if self._stop.is_set():
+                return
+            t0 = time.time()
+            try:
+                returncode, wall_time, max_rss = self._run_once(job)
+            except Exception as e:
+                # e.g. simulator not started: a failed attempt, the worker goes on
+                returncode, wall_time, max_rss = -1, time.time() - t0, None
+                with self._lock:
+                    print('{} (attempt {}): {}'.format(job.name, attempt, repr(e)))
+            if self._stop.is_set():
+                # interrupted: neither success nor failure
+                return
+            success = returncode == 0 and all(
+                os.path.isfile(os.path.join(job.out_dir, m)) for m in self.markers)
+            with self._lock:
+                with open(self.log_file, 'a') as f:
+                    f.write('{},{},{},{:d},{:.3f},{}\n'.format(job.name, attempt, returncode, success,
+                            wall_time, '' if max_rss is None else '{:.1f}'.format(max_rss)))
+                if success:
+                    self.n_success += 1
+                elif attempt > self.n_retry:
+                    self.n_fail += 1
+                print('{} (attempt {}): {}, {:.1f} s'.format(job.name, attempt,
+                      'success' if success else 'failed ({})'.format(returncode), wall_time))
+                sys.stdout.flush()
+            if success:
+                return
+        return
+
+    def _worker(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            self._run_job(job)
+
+    # binary and args usable for a job; raises ValueError otherwise
+    def check(self):
+        if shutil.which(self.binary) is None:
+            raise ValueError('Simulator binary not found or not executable: {}'.format(self.binary))
+        ids = {'subject': '1', 'sample': '1', 'treatment': '1', 'rep': 1}
+        try:
+            shlex.split(self.args.format(**ids))
+        except (KeyError, IndexError, ValueError) as e:
+            raise ValueError('Invalid args "{}": {}'.format(self.args, repr(e)))
+        return
+
+    # run all jobs; returns number of failed jobs
+    def run(self, job_list):
+        self.check()
+        ensure_path(self.sim_path)
+        if not os.path.isfile(self.log_file):
+            with open(self.log_file, 'w') as f:
+                f.write(LOG_HEADER)
+        done = self._read_log()
+        jobs = queue.Queue(maxsize=2*self.n_worker)
+        workers = [threading.Thread(target=self._worker, args=(jobs,), daemon=True)
+                   for i in range(self.n_worker)]
+        for w in workers:
+            w.start()
+        try:
+            for job in job_list:
+                if self._is_done(job, done):
+                    self.n_skip += 1
+                    continue
+                # blocks while all workers are busy
+                while not self._stop.is_set():
+                    try:
+                        jobs.put(job, timeout=1)
+                        break
+                    except queue.Full:
+                        pass
+            for w in workers:
+                jobs.put(None)
+            while any(w.is_alive() for w in workers):
+                for w in workers:
+                    w.join(1)
+        except KeyboardInterrupt:
+            self._stop.set()
+            with self._lock:
+                for p in self._running:
+                    p.terminate()
+            print('Interrupted; run again to resume.')
+            raise
+        return self.n_fail
+
+if (__name__ == '__main__'):
+
+    parser = argparse.ArgumentParser(description='Run simulations of parameter files from expBatchGen.py')
+    parser.add_argument('param_path', help='out_path of expBatchGen.py')
+    parser.add_argument('sim_path', help='simulation output path')
+    parser.add_argument('--bin', required=True, help='simulator binary')
+    parser.add_argument('--args', default='', help='extra arguments; {subject}, {sample}, {treatment}, {rep} are replaced')
+    parser.add_argument('--param_flag', default='-p')
+    parser.add_argument('--out_flag', default='-o')
+    parser.add_argument('--marker', nargs='*', default=MARKER_DEFAULT,
+                        help='files indicating success; none: exit code only')
+    parser.add_argument('-j', '--n_worker', type=int, default=os.cpu_count())
+    parser.add_argument('-r', '--n_rep', type=int, default=1)
+    parser.add_argument('--n_retry', type=int, default=1)
+    args = parser.parse_args()
+
+    dispatcher = Dispatcher(args.bin, args.sim_path, args.args, args.param_flag, args.out_flag,
+                            args.marker, args.n_worker, args.n_retry)
+    try:
+        dispatcher.check()
+    except ValueError as e:
+        parser.error(str(e))
+    n_fail = dispatcher.run(find_jobs(args.param_path, args.sim_path, args.n_rep))
+    print('success: {}, failed: {}, skipped: {}'.format(dispatcher.n_success, n_fail, dispatcher.n_skip))
+    sys.exit(1 if n_fail else 0)
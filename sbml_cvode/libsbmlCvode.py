@@ -9,10 +9,19 @@ import libsbml as lsb
 
 #import xml.etree.ElementTree as ET
 import lxml.etree as ET
+import io
+import os
+
+# converter options and their file; LINEAR_SOLVERS: linear solvers used
+# with the analytic Jacobian, 'auto' chooses from the sparsity pattern at export
+from converter_config import ConverterConfig, model_hash, content_hash, LINEAR_SOLVERS
 
 # version
 CONVERTER_VERSION = '1.0'
 
+# manifest of exported files: <class_name>_manifest.xml
+MANIFEST_ROOT = 'export_manifest'
+
 # time token used as input for AstTranslator
 LC_TIME_NAME = 'lc_time_name'
 ODE_TIME_NAME = 't'
@@ -20,6 +29,24 @@ ODE_TIME_NAME = 't'
 # macro for QSP weight if used in a hybrid model
 QSP_WEIGHT_NAME = 'QSP_W'
 
+# prefix of temporaries from common subexpression elimination
+CSE_TEMP_PREFIX = 'CSE_'
+
+# prefix of temporaries of the analytic Jacobian (partial derivatives)
+JAC_TEMP_PREFIX = 'JAC_'
+
+# declaration of the tolerance of comparing t with the switching time
+# of a time-only trigger component (root-function pruning)
+TIME_TRIGGER_TOL = '    const realtype tol = 100 * UNIT_ROUNDOFF * (std::fabs(t) > 1 ? std::fabs(t) : 1);\n'
+
+# variability of subexpressions for constant folding
+VARIABILITY_LITERAL = 0
+VARIABILITY_CLASS = 1
+VARIABILITY_INSTANCE = 2
+VARIABILITY_TIME = 3
+# macro reading precomputed invariant subexpressions in f()
+PRECOMPUTED_MACRO = 'PRECOMP'
+
 # xml tags
 XML_ROOT = 'QSP'
 XML_SIM = 'simulation'
@@ -61,6 +88,42 @@ ASTNameToCppToken = {
         SBML_FUNCTION_NTHROOT: 'std::pow',
         'ln': 'std::log'
         }
+
+# tokens of the NumPy module (write_python); operands of logical
+# operators are grouped by NumpyTranslator
+ASTNameToNumpyToken = {
+        #operators
+        'times': ' * ',
+        'divide': ' / ',
+        'plus': ' + ',
+        'minus': ' - ',
+        #relational
+        'eq': ' == ',
+        'geq': ' >= ',
+        'gt': ' > ',
+        'leq': ' <= ',
+        'lt': ' < ',
+        'neq': ' != ',
+        #logical
+        'and': ' & ',
+        'or': ' | ',
+        # functions:
+        'power': 'np.power',
+        'root': 'np.sqrt',
+        SBML_FUNCTION_NTHROOT: 'np.power',
+        'ln': 'np.log',
+        'log': 'np.log',
+        'log2': 'np.log2',
+        'log10': 'np.log10',
+        'exp': 'np.exp',
+        'abs': 'np.abs',
+        'floor': 'np.floor',
+        'ceiling': 'np.ceil',
+        'sin': 'np.sin',
+        'cos': 'np.cos',
+        'tan': 'np.tan',
+        'piecewise': 'piecewise'
+        }
 #%% 
 ############################################################
 # converter class and first level operations
@@ -70,11 +133,32 @@ class sbmlConverter:
     def __init__(self):
         self.general_translator = AstTranslator(self.variable_name_string, ASTNameToCppToken)
         self.model = None
+        self.model_hash = ''
         self.convert_unit = True
         self.use_hybrid = False
         self.use_variable_finetune = False
+        self.sim_t_start = 0
+        self.sim_t_step = 0
+        self.sim_n_step = 0
         self.reltol = 0
         self.abstol = 0
+        # common subexpression elimination in ODE right hand side
+        self.use_cse = False
+        self.optimization_report = ''
+        # analytic Jacobian and linear solver (one of LINEAR_SOLVERS)
+        self.use_jacobian = False
+        self.linear_solver = 'auto'
+        self.jacobian = None
+        # precompute invariant subexpressions of the ODE rhs
+        self.use_constant_folding = False
+        # NumPy module of the model next to the cpp class
+        self.use_python = False
+        # thread_local class parameters, for MolecularModelBatch
+        self.use_batch = False
+        # root finding only on trigger components depending on y
+        self.use_root_pruning = False
+        # solver counters, wall time and event firings per output interval
+        self.use_solver_stats = False
         return
 	# get converter version number
     def get_version(self):
@@ -89,12 +173,15 @@ class sbmlConverter:
         if model is None:
             raise NameError('Error loading model:\n' + model_path)
         self.model = lsb.Model(model)
+        self.model_hash = model_hash(model_path)
         self.variable_modifiable = set()
         self.variable_output = set()
         self.hybrid_abm_weight = 0
         self.hybrid_elements = set()
         self.prepare_raw_variables()
         self.parse_events()
+        # names, units and dependencies, shared by validation and export
+        self.analysis = ModelAnalysis(self.model, self.allTriggers, self.general_translator)
         # convert all units to SI   
         getUnitsConvertionScaling(self.model, self.key2name)
         self.speciesStoichiometry, self.reaction_to_y = getSpeciesStoichiometry(self.model)
@@ -104,7 +191,9 @@ class sbmlConverter:
         message = ''
         if not self.has_model():
             raise NameError('No model loaded')
-        message += checkUnitConsistency(self.model, self.general_translator)
+        if self.analysis.unitReport is None:
+            self.analysis.unitReport = checkUnitConsistency(self.model, self.general_translator, self.analysis)
+        message += self.analysis.unitReport
         message += self.print_event_triggers()
         return message
     # check which variables can change during simulation or recorded as output
@@ -133,18 +222,36 @@ class sbmlConverter:
     def save_converter_config(self):
         if not self.has_model():
             raise NameError('No model loaded')
-        return
-    def load_converter_config(self):
+        return ConverterConfig.from_converter(self)
+    # apply a configuration (ConverterConfig) to the loaded model;
+    # returns warnings, e.g. configuration made for a different SBML file
+    def load_converter_config(self, config):
         if not self.has_model():
             raise NameError('No model loaded')
-        return
+        message = config.check_model(self)
+        if message:
+            raise NameError(message)
+        config.apply(self)
+        if config.file_hash != self.model_hash:
+            message += 'Hash mismatch. Configuration generated from a different SBML file.\n'
+        return message
     # write model to cpp/h class files
     def export_model(self, path, class_name, name_space):
         if not self.has_model():
             raise NameError('No model loaded')
+        # files are rendered to memory and only written if changed;
+        # export_files: (file name, MD5, written)
+        self.export_files = []
+        # stale_files: (file name, removed), see remove_stale_files
+        self.stale_files = []
         self.write_xml(path, class_name)
+        self.jacobian = self.build_jacobian() if self.use_jacobian else None
         self.write_header(path, class_name, name_space)
         self.write_cpp(path, class_name, name_space)
+        if self.use_python:
+            self.write_python(path, class_name)
+        self.remove_stale_files(path, class_name)
+        self.write_manifest(path, class_name, name_space)
         return
 
 # sbmlconverter supporting functions
@@ -313,17 +420,17 @@ def process_variables(self):
     # assignment sequence: topological sorting
     model = self.model
     #print("assignment rules graph")
-    self.assignmentRuleOrder, self.arGraph = getAssignmentRulesSorted(self.model)
+    self.assignmentRuleOrder, self.arGraph = getAssignmentRulesSorted(self.model, self.analysis.dependency)
     #print("Initial assignment rules")
     # sort initial assignment   
-    self.initialAssignmentOrder = getInitialAssignmentsSorted(self.model)
+    self.initialAssignmentOrder = getInitialAssignmentsSorted(self.model, self.analysis.dependency)
     # rule required for initial assignments
-    iaVars = getAssignmentRulesRequiredForInitAssignment(model)
+    iaVars = getAssignmentRulesRequiredForInitAssignment(model, self.analysis.dependency)
     iaVarWithDep = {j for i in iaVars for j in self.arGraph.getDependent(i)}
     self.assignmentRuleOrderIA = [i for i in self.assignmentRuleOrder if i in iaVarWithDep]
     #print("trigger order")
     # check if Event trigger condition and assignments rely on assignment rules
-    self.triggerVars, self.eaVars = getAssignmentRulesRequiredForEvents(self.model)
+    self.triggerVars, self.eaVars = getAssignmentRulesRequiredForEvents(self.model, self.analysis.dependency)
     triggerVarWithDep = {j for i in self.triggerVars for j in self.arGraph.getDependent(i)}
     self.assignmentRuleOrderTrigger = [i for i in self.assignmentRuleOrder if i in triggerVarWithDep]    
     eaVarWithDep = {j for i in self.eaVars for j in self.arGraph.getDependent(i)}
@@ -331,10 +438,7 @@ def process_variables(self):
     
     # variables dependent on assignment rule
     #print("extra species order")
-    idxAssignmentRule = {}
-    for i in range(model.getNumRules()):
-        arName = model.getRule(i).getVariable()
-        idxAssignmentRule[arName] = i
+    idxAssignmentRule = self.analysis.dependency.idxAssignmentRule
     extraSpecVars = set()
     for sp in model.getListOfSpecies():
         sid = sp.getId()
@@ -359,7 +463,17 @@ def process_variables(self):
                               self.initialAssignmentOrder)
     """
     #print("trigger components")       
-    self.triggerCompDep = getTriggerComponentDependency(self.model, self.assignmentRuleOrder, self.allTriggers, self.key2var)
+    self.triggerCompDep = getTriggerComponentDependency(self.model, self.assignmentRuleOrder, self.allTriggers, 
+                                                        self.key2var, self.analysis)
+    # trigger components switching at a scheduled time, and rules of each component
+    self.triggerTimeSchedule = getTriggerTimeSchedule(self.model, self.assignmentRuleOrder, self.allTriggers,
+                                                      self.key2var, self.analysis)
+    idxAssignmentRule = self.analysis.dependency.idxAssignmentRule
+    self.assignmentRuleOrderTriggerComp = []
+    for nodes in self.analysis.triggerComponentNodes:
+        compVarWithDep = {j for i in self.analysis.dependency.referenced(nodes, idxAssignmentRule) 
+                          for j in self.arGraph.getDependent(i)}
+        self.assignmentRuleOrderTriggerComp.append([i for i in self.assignmentRuleOrder if i in compVarWithDep])
     return
 
 sbmlConverter.process_variables = process_variables    
@@ -367,10 +481,14 @@ sbmlConverter.process_variables = process_variables
 
 # write header of model and parameter class
 def write_header(self, path, class_name, name_space):
-    with open(path + '/' + '{}.h'.format(class_name), 'w') as file:
-        file.write(getHeaderFileContent(class_name, name_space, self.use_hybrid))
-    with open(path + '/' + 'Param.h', 'w') as file:
-        file.write(getParamHeaderContent(name_space))
+    self.export_file(path, '{}.h'.format(class_name),
+                     getHeaderFileContent(class_name, name_space, self.use_hybrid,
+                                          self.jacobian is not None,
+                                          self.use_constant_folding,
+                                          self.use_batch,
+                                          self.use_root_pruning,
+                                          self.use_solver_stats))
+    self.export_file(path, 'Param.h', getParamHeaderContent(name_space))
     return
 
 # write cpp of model and parameter class
@@ -427,18 +545,27 @@ def write_cpp(self, path, class_name, name_space):
     translatorInSim = AstTranslator(cppInSimVariable, ASTNameToCppToken)
     translatorStatic = AstTranslator(cppStaticVariable, ASTNameToCppToken)
 
-    with open(path + '/'  + '{}.cpp'.format(class_name),'w') as cppfile:
+    linear_solver = self.linear_solver
+    if self.jacobian and linear_solver == 'auto':
+        linear_solver = self.jacobian.chooseSolver()
+
+    with io.StringIO() as cppfile:
         v = getSourceFileMacro(class_name)
+        if self.use_constant_folding:
+            v += '#define {0}(x) ptrOde->_precomputed[x]\n\n'.format(PRECOMPUTED_MACRO)
+        if self.jacobian:
+            v += getSourceFileJacobianMacro(self.jacobian, linear_solver)
         v += 'namespace {}{{\n'.format(name_space)
         cppfile.write(v)
 
-        v = getSourceFileConstructor(class_name, self.use_hybrid, 1-self.hybrid_abm_weight)
+        v = getSourceFileConstructor(class_name, self.use_hybrid, 1-self.hybrid_abm_weight,
+                                     self.use_solver_stats)
         cppfile.write(v)
         v =  getSourceFileInitSolver(class_name)
         cppfile.write(v)
         v = getSourceFileStaticParam(class_name, self.key2name, self.key2var, 
                                          self.varlist, self.hybrid_elements,
-                                         self.variable_name_string)
+                                         self.variable_name_string, self.use_batch)
         cppfile.write(v)
         v =  getSourceFileVariableSetup(class_name, self.model, self.key2name, self.key2var, 
                                          self.varlist, self.param_id_reltol, self.param_id_abstol,
@@ -451,41 +578,187 @@ def write_cpp(self, path, class_name, name_space):
                               self.initialAssignmentOrder, translatorMember)
         cppfile.write(v)
         
+        # root functions: trigger components depending on y (and on t, if not scheduled)
+        rootTriggers = None
+        if self.use_root_pruning:
+            rootTriggers = [i for i in range(len(self.allTriggers)) 
+                            if self.triggerCompDep[i] and self.triggerTimeSchedule[i] is None]
         v = getSourceFileEventSetup(class_name, self.model, self.allTriggers, 
-                                       self.triggerParser, self.general_translator)
+                                       self.triggerParser, self.general_translator, rootTriggers)
         cppfile.write(v)
+        cse = None
+        fold = None
+        self.optimization_report = ''
+        if self.use_constant_folding:
+            fold = getReactionFolding(self.model, self.assignmentRuleOrder,
+                                      self.speciesStoichiometry, self.convert_unit, self.key2var)
+            self.optimization_report += fold.report('f()')
+        if self.use_cse:
+            cse = getReactionCse(self.model, self.assignmentRuleOrder, fold)
+            self.optimization_report += cse.report('f()')
         v = getSourceFileReaction(class_name, self.model, self.assignmentRuleOrder, 
                                   self.speciesStoichiometry, self.convert_unit, 
                                   self.key2var, self.hybrid_elements, 
-                                  translatorStatic, self.variable_name_string)
+                                  translatorStatic, self.variable_name_string, cse, fold,
+                                  self.analysis)
         cppfile.write(v)
+        if fold:
+            v = getSourceFilePrecomputed(class_name, fold, translatorMember)
+            cppfile.write(v)
+        if self.jacobian:
+            v = getSourceFileJacobian(class_name, self.model, self.assignmentRuleOrder,
+                                      self.jacobian, translatorStatic)
+            cppfile.write(v)
+            self.optimization_report += self.jacobian.report('jac()', linear_solver)
         v = getSourceFileEventDetails(class_name, self.model, self.allTriggers, self.triggerCompDep, self.eventToTrigger,
                                       self.assignmentRuleOrderTrigger, self.assignmentRuleOrderEA,
                                       self.general_translator, translatorStatic, 
                                       translatorInSim, translatorMember, 
-                                      self.triggerParser)
+                                      self.triggerParser, rootTriggers, self.triggerTimeSchedule,
+                                      self.assignmentRuleOrderTriggerComp)
         cppfile.write(v)
         
         v = getSourceFileHandleOutput(class_name, self.model, self.varlist, self.key2name, 
                                         translatorInSim, self.general_translator,
-                                        self.assignmentRuleOrderExtraSpec)
+                                        self.assignmentRuleOrderExtraSpec,
+                                        self.use_constant_folding)
         cppfile.write(v)
+        if self.use_solver_stats:
+            v = getSourceFileSolverStats(class_name, self.model)
+            cppfile.write(v)
         v = '\n};\n'
         cppfile.write(v)
+        self.export_file(path, '{}.cpp'.format(class_name), cppfile.getvalue())
 
-    with open(path + '/'  + 'Param.cpp','w') as cppfile:
-        v = getParamSourceConetent(name_space, self.model, self.key2name)
-        cppfile.write(v)
+    v = getParamSourceConetent(name_space, self.model, self.key2name)
+    self.export_file(path, 'Param.cpp', v)
     return
 
+# analytic Jacobian of the ODE rhs; None if the model cannot be differentiated
+def build_jacobian(self):
+    if self.linear_solver not in LINEAR_SOLVERS:
+        raise NameError('Unknown linear solver: {}'.format(self.linear_solver))
+    try:
+        return getReactionJacobian(self.model, self.assignmentRuleOrder,
+                                   self.speciesStoichiometry, self.convert_unit,
+                                   self.key2var, self.key2name, self.hybrid_elements,
+                                   self.analysis)
+    except ValueError as e:
+        print('Error: analytic Jacobian not generated, {}'.format(e))
+        return None
+
 def write_xml(self, path, class_name):
-    with open(path + '/' + class_name+'_params.xml', 'w') as file:
-        file.write('<?xml version="1.0" encoding="utf-8"?>\n')
-        file.write(ET.tostring(self.param_root, pretty_print = True, encoding='unicode'))
+    v = '<?xml version="1.0" encoding="utf-8"?>\n'
+    v += ET.tostring(self.param_root, pretty_print = True, encoding='unicode')
+    self.export_file(path, class_name+'_params.xml', v)
+    return
+# write the NumPy module of the model: <class_name>.py
+def write_python(self, path, class_name):
+    vartype2Numpy = {'sp_var': 'Y',
+                   'nsp_var': 'Q',
+                   'p_const': 'P'}
+    
+    def numpyVariable(varName):
+        if varName == LC_TIME_NAME:
+            return ODE_TIME_NAME
+        elif varName in self.key2var:
+            return '{}[{}]'.format(vartype2Numpy[self.key2var[varName]['vartype']],
+                                   self.key2var[varName]['idx'])
+        else:
+            return 'AUX_VAR_{}'.format(self.key2name[varName]['name'])
+    
+    trans = NumpyTranslator(numpyVariable)
+    triggerParser = EventTriggerParser(ASTNameToNumpyToken)
+    # leaves of the parameter file tree: (path, value)
+    pfile = [('.'.join([a.tag for a in reversed(list(e.iterancestors()))] + [e.tag]), 
+              float(e.text)) for e in self.param_root.iter() if len(e) == 0]
+    
+    with io.StringIO() as pyfile:
+        pyfile.write(getPythonModuleHeader(class_name, self.use_hybrid, 1-self.hybrid_abm_weight))
+        pyfile.write(getPythonModuleVariables(self.key2name, self.key2var, self.varlist, pfile,
+                                              self.param_id_reltol, self.param_id_abstol,
+                                              self.hybrid_elements, self.variable_name_string))
+        pyfile.write(getPythonModuleInitialAssignment(self.model, self.key2var,
+                                                      self.assignmentRuleOrderIA,
+                                                      self.initialAssignmentOrder,
+                                                      self.use_hybrid, trans))
+        pyfile.write(getPythonModuleReaction(self.model, self.assignmentRuleOrder,
+                                             self.speciesStoichiometry, self.convert_unit,
+                                             self.key2var, self.hybrid_elements, trans,
+                                             self.variable_name_string, self.analysis))
+        pyfile.write(getPythonModuleEvents(self.model, self.allTriggers, self.triggerCompDep,
+                                           self.eventToTrigger, self.assignmentRuleOrderTrigger,
+                                           self.assignmentRuleOrderEA, self.general_translator,
+                                           trans, triggerParser))
+        pyfile.write(getPythonModuleSimulation())
+        self.export_file(path, '{}.py'.format(class_name), pyfile.getvalue())
+    return
+# write content to path/file_name, unless the file has the same content (MD5):
+# unchanged files keep their timestamps and are not recompiled
+def export_file(self, path, file_name, content):
+    file_path = path + '/' + file_name
+    new_hash = content_hash(content)
+    try:
+        with open(file_path, 'r') as file:
+            written = content_hash(file.read()) != new_hash
+    except (OSError, ValueError):
+        written = True
+    if written:
+        with open(file_path, 'w') as file:
+            file.write(content)
+    self.export_files.append((file_name, new_hash, written))
+    return
+# files of an earlier export which this export does not write, e.g. after
+# turning an option off: removed if unchanged since listed in the previous
+# manifest, otherwise (edited, or exported without a manifest) only reported
+def remove_stale_files(self, path, class_name):
+    previous = {}
+    try:
+        manifest = ET.parse(path + '/' + class_name + '_manifest.xml')
+        for f in manifest.getroot().iter('file'):
+            previous[f.get('name')] = f.get('hash')
+    except (OSError, ET.XMLSyntaxError):
+        pass
+    # optional outputs
+    candidates = set(previous) | {'{}.py'.format(class_name)}
+    current = {f[0] for f in self.export_files} | {class_name + '_manifest.xml'}
+    for file_name in sorted(candidates - current):
+        file_path = path + '/' + file_name
+        if not os.path.isfile(file_path):
+            continue
+        try:
+            with open(file_path, 'r') as file:
+                removed = content_hash(file.read()) == previous.get(file_name)
+        except (OSError, ValueError):
+            removed = False
+        if removed:
+            os.remove(file_path)
+        self.stale_files.append((file_name, removed))
+    return
+# write the manifest of the export: model, configuration and file hashes
+def write_manifest(self, path, class_name, name_space):
+    config = ConverterConfig.from_converter(self)
+    root = ET.Element(MANIFEST_ROOT)
+    ET.SubElement(root, 'converter_version').text = CONVERTER_VERSION
+    ET.SubElement(root, 'model_hash').text = self.model_hash
+    ET.SubElement(root, 'config_hash').text = content_hash(config.to_xml())
+    ET.SubElement(root, 'class_name').text = class_name
+    ET.SubElement(root, 'namespace').text = name_space
+    files = ET.SubElement(root, 'files')
+    for file_name, file_hash, written in self.export_files:
+        ET.SubElement(files, 'file', name=file_name, hash=file_hash)
+    v = '<?xml version="1.0" encoding="utf-8"?>\n'
+    v += ET.tostring(root, pretty_print = True, encoding='unicode')
+    self.export_file(path, class_name+'_manifest.xml', v)
     return
 sbmlConverter.write_header = write_header
 sbmlConverter.write_cpp = write_cpp
 sbmlConverter.write_xml = write_xml
+sbmlConverter.build_jacobian = build_jacobian
+sbmlConverter.write_python = write_python
+sbmlConverter.export_file = export_file
+sbmlConverter.remove_stale_files = remove_stale_files
+sbmlConverter.write_manifest = write_manifest
 
 #%%
 ############################################################
@@ -499,19 +772,31 @@ fname: function to format the name of a variable from AST node
 ASTOperatorNameToToken: convert operator from AST operator name 
     such as "times" (getOperatorName())
     to symbol such as "*"
+The tree is walked with an explicit stack (no recursion limit on deeply
+nested expressions) and each formula is joined once from its parts.
+Subtrees are interned by structure (node type, formatted token and
+children), and the formula of each distinct subtree is kept in memo,
+so identical subtrees of the reactions, rules and events translated by
+one translator are assembled once.
+Other output languages derive from this class and override nodeFormat
+and the format* methods; the traversal is shared.
 """    
 class AstTranslator:
     
     def __init__(self, fname, ASTNameToCppToken):
         self.fname = fname
         self.ASTNameToCppToken = ASTNameToCppToken
+        # structure of subtree -> id; id -> formula; id -> uninterpreted names
+        self.subtreeId = {}
+        self.memo = {}
+        self.memoNames = {}
         
     """
     format one math expression
     """
     def mathToString(self, math):
         if math:
-            formula, _ = self.nodeVisit(None, math, [])
+            formula, _ = self.translate(math)
             return formula
     
     """
@@ -519,7 +804,7 @@ class AstTranslator:
     """
     def check_math_expression(self, math):
         if math:
-            _, name_list = self.nodeVisit(None, math, [])
+            _, name_list = self.translate(math)
         return name_list
     
     """
@@ -527,16 +812,18 @@ class AstTranslator:
     in parentheses. 
     Compare precedence of current operation with 
     that of parent node.
+    parent, current: (type, precedence, isFunction) of the nodes
+    isRight: current is the right child of parent
     """
-    def isGrouped(self, parent, current):
+    def isGrouped(self, parent, current, isRight):
         if parent:
-            d = parent.getPrecedence() - current.getPrecedence()
-            if d < 0 or parent.isFunction():
+            d = parent[1] - current[1]
+            if d < 0 or parent[2]:
                 return False
             elif d == 0:
-                if parent.getRightChild() == current:
-                    pt = parent.getType()
-                    ct = current.getType()
+                if isRight:
+                    pt = parent[0]
+                    ct = current[0]
                     if pt == lsb.AST_MINUS or pt == lsb.AST_DIVIDE or pt != ct:
                         return True
                 else:
@@ -545,98 +832,128 @@ class AstTranslator:
                 return True
         else:
             return False
-        
     
     """
-    check one node and decide what it is
+    expression replacing the subtree at current, None to translate it.
+    parent is None at the root of the translated math.
     """
-    def nodeVisit(self, parent, current, name_list):
-        formula = ''
-        if current.isFunction():
-            f, name_list = self.nodeVisitFunction(current, name_list)
-            formula += f
-        elif current.isUMinus():
-            f, name_list = self.nodeVisitUMinus(current, name_list)
-            formula += f
-        else:
-            f, name_list = self.nodeVisitGeneral(parent, current, name_list)
-            formula += f
-        return formula, name_list
+    def nodeReplacement(self, parent, current):
+        return None
     
     """
-    if node is a function:
-    format node;
-    print parentheses and visit node of each argument
+    children of current which appear in the formula, as (child, isRight):
+    functions: arguments (only the radicand of root);
+    unary minus: operand;
+    other nodes: left and right child
     """
-    def nodeVisitFunction(self, current, name_list):
-        
+    def visitedChildren(self, current, isFunction, isUMinus):
         nrChild = current.getNumChildren()
-        f, name_list = self.nodeFormat(current, name_list)
-        formula = f + '('
-        
-        if current.getType() == lsb.AST_FUNCTION_ROOT:
-            # By specification, AST_FUNCTION_ROOT node has two children, 
-            # the first of which is an AST_INTEGER node having value equal to 2
-            # see libSBML API libsbml.ASTNode.isSqrt() documentation
-            f, name_list = self.nodeVisit(current, current.getChild(1), name_list)
-            formula += f
-        elif current.getName() == SBML_FUNCTION_NTHROOT:
+        if isFunction:
+            if current.getType() == lsb.AST_FUNCTION_ROOT:
+                # By specification, AST_FUNCTION_ROOT node has two children, 
+                # the first of which is an AST_INTEGER node having value equal to 2
+                # see libSBML API libsbml.ASTNode.isSqrt() documentation
+                return [(current.getChild(1), False)]
+            return [(current.getChild(i), False) for i in range(nrChild)]
+        elif isUMinus:
+            return [(current.getLeftChild(), False)]
+        children = []
+        if nrChild > 0:
+            children.append((current.getLeftChild(), False))
+        if nrChild > 1:
+            children.append((current.getRightChild(), True))
+        return children
+    
+    # function call; args: formulas of visited children
+    def formatFunction(self, current, token, args):
+        if current.getType() != lsb.AST_FUNCTION_ROOT and current.getName() == SBML_FUNCTION_NTHROOT:
             # Matlab/simbiology use nthroot(x, n), which is not currently supported in libSBML
             # we translate it into power(child(0), 1.0/child(1))
-            f, name_list = self.nodeVisit(current, current.getChild(0), name_list)
-            formula += f
-            formula += ', 1.0 / '
-            f, name_list = self.nodeVisit(current, current.getChild(1), name_list)
-            formula += f
-        else:
-            f_list = []
-            for i in range(nrChild):
-               f, name_list = self.nodeVisit(current, current.getChild(i), name_list)
-               f_list += [f]
-            formula += ', '.join(f_list)
-        formula += ')'
-        return formula, name_list
-    """
-    if node is unary minus:
-    print "-"
-    visit child
-    """
-    def nodeVisitUMinus(self, current, name_list):
-        formula = ' -'
-        f, name_list = self.nodeVisit(current, current.getLeftChild(), name_list)
-        formula += f
-        return formula, name_list
+            return [token, '(', args[0], ', 1.0 / ', args[1], ')']
+        return [token, '(', ', '.join(args), ')']
+    
+    # unary minus
+    def formatUMinus(self, current, token, args):
+        return [' -', args[0]]
+    
+    # operators, relations, leaves: left child, current, right child
+    def formatGeneral(self, current, token, args):
+        if len(args) > 1:
+            return [args[0], token, args[1]]
+        return args + [token]
+    
+    # subtree in parentheses
+    def formatGroup(self, formula):
+        return '(' + formula + ')'
     
     """
-    other types of nodes:
-    determine precedence, if so group them with parentheses
-    visit first argument
-    format current operator
-    visit second argument
+    translate math; return formula and list of uninterpreted names.
+    Nodes are finished in post-order: a node's formula is built from
+    the formulas of its visited children on top of the result stacks.
     """
-    def nodeVisitGeneral(self, parent, current, name_list):
-        formula = ''
-        nrChild = current.getNumChildren()
-        group = self.isGrouped(parent, current)
-        
-        if (group):
-            formula += '('
-    
-        if (nrChild > 0):
-            f, name_list = self.nodeVisit(current, current.getLeftChild(), name_list)
-            formula += f
-    	
-        f, name_list = self.nodeFormat(current, name_list)
-        formula += f
+    def translate(self, math):
+        # entries: (node, parent info, isRight, node info or None if not expanded)
+        stack = [(math, None, False, None)]
+        # subtree ids and formulas (as seen by the parent) of finished nodes
+        resultIds = []
+        resultFormulas = []
+        memo = self.memo
+        memoNames = self.memoNames
+        while stack:
+            current, parent, isRight, info = stack.pop()
+            if info is None:
+                replacement = self.nodeReplacement(None if parent is None else parent[3], current)
+                if replacement is not None:
+                    resultIds.append(self.internSubtree(('replaced', replacement)))
+                    resultFormulas.append(replacement)
+                    continue
+                isFunction = current.isFunction()
+                isUMinus = current.isUMinus()
+                children = self.visitedChildren(current, isFunction, isUMinus)
+                info = (current.getType(), current.getPrecedence(), isFunction, current, 
+                        isUMinus, len(children))
+                stack.append((current, parent, isRight, info))
+                for child, right in reversed(children):
+                    stack.append((child, info, right, None))
+                continue
+            k = len(resultIds) - info[5]
+            argIds = resultIds[k:]
+            argFormulas = resultFormulas[k:]
+            del resultIds[k:]
+            del resultFormulas[k:]
+            token, ownNames = self.nodeFormat(current, [])
+            sid = self.internSubtree((info[0], token, *argIds))
+            if sid not in memo:
+                if info[2]:
+                    parts = self.formatFunction(current, token, argFormulas)
+                elif info[4]:
+                    parts = self.formatUMinus(current, token, argFormulas)
+                else:
+                    parts = self.formatGeneral(current, token, argFormulas)
+                memo[sid] = ''.join(parts)
+                # names in order of appearance: functions before their
+                # arguments, operators between left and right child
+                childNames = [memoNames.get(i, []) for i in argIds]
+                if info[4]:
+                    ownNames = []
+                pos = 0 if info[2] else 1
+                names = [n for c in childNames[:pos] for n in c] + ownNames + \
+                    [n for c in childNames[pos:] for n in c]
+                if names:
+                    memoNames[sid] = names
+            formula = memo[sid]
+            if not info[2] and not info[4] and \
+                self.isGrouped(parent, info, isRight):
+                formula = self.formatGroup(formula)
+            resultIds.append(sid)
+            resultFormulas.append(formula)
+        return resultFormulas[0], list(memoNames.get(resultIds[0], []))
     
-        if (nrChild > 1):
-            f, name_list = self.nodeVisit(current, current.getRightChild(), name_list)
-            formula += f
-    	
-        if (group):
-            formula += ')'
-                
-        return formula, name_list
+    # id of a subtree structure
+    def internSubtree(self, key):
+        if key not in self.subtreeId:
+            self.subtreeId[key] = len(self.subtreeId)
+        return self.subtreeId[key]
     
     """
     format a single node.
@@ -681,6 +998,22 @@ class AstTranslator:
         return formula, name_list
 
 
+"""
+Translate math AST to a NumPy expression (write_python).
+Variables are rows of the state arrays, so every expression is evaluated
+for a whole batch of parameter sets at once. Operands of '&' and '|' are
+grouped, as these bind tighter than comparisons in Python.
+"""
+class NumpyTranslator(AstTranslator):
+    
+    def __init__(self, fname):
+        AstTranslator.__init__(self, fname, ASTNameToNumpyToken)
+    
+    def formatGeneral(self, current, token, args):
+        if current.isLogical():
+            args = [self.formatGroup(a) for a in args]
+        return AstTranslator.formatGeneral(self, current, token, args)
+
 """
 Parse math AST to expression of a Event trigger
 ASTOperatorNameToToken: convert operator from AST operator name 
@@ -807,9 +1140,11 @@ Class Directed acyclic graphs.
 handles topological sorting of assignment orders.
 """
 import copy
+from collections import deque
 class DirectedAcyclicGraph:
     def __init__(self):
         self.graph = {}
+        self.unsorted = []
     # add vertex to graph
     def addVertex(self, v):
         if not v in self.graph:
@@ -837,37 +1172,561 @@ class DirectedAcyclicGraph:
                     for child in self.graph[vcurrent]:
                         tmp.append(child)
         return dep
+    # Kahn's algorithm: a vertex is ready once all the vertices it depends on
+    # (its outgoing edges) are sorted. Ready vertices are queued in the order
+    # they were added to the graph.
     def topoSort(self):
-        graph = copy.deepcopy(self.graph)
+        position = {v: k for k, v in enumerate(self.graph)}
+        nDependency = {}
+        dependents = {v: [] for v in self.graph}
+        for v, children in self.graph.items():
+            nDependency[v] = len(children)
+            for child in children:
+                dependents[child].append(v)
+        independentVertices = deque(v for v in self.graph if not nDependency[v])
         sortedVertices = []
-        independentVertices = []
-        while True:
-            # if all the dependencies of a vertex is handled,
-            # i.e. that vertex has no outgoing edge,
-            # this vertex go into the independent list
-            for i in list(graph.keys()):
-                if not graph[i]:
-                    independentVertices.append(i)
-                    graph.pop(i, None)
-                    
-            # if no more indipendent vertex, end iteration
-            if not independentVertices:
-                break
-            
-            # move one vertex from the independent list,
-            # and remove edge to this vertex from the graph
-            v = independentVertices.pop(0)
+        while independentVertices:
+            v = independentVertices.popleft()
             sortedVertices.append(v)
-            for i in graph:
-                if v in graph[i]:
-                    graph[i].remove(v)
-                    
-        # check if there are remaining vertex
-        noCycleDetected = True
-        if graph:
-            noCycleDetected = False
+            released = []
+            for i in dependents[v]:
+                nDependency[i] -= 1
+                if not nDependency[i]:
+                    released.append(i)
+            released.sort(key = position.get)
+            independentVertices.extend(released)
+        # vertices left are on a cycle or depend on one
+        self.unsorted = [v for v in self.graph if nDependency[v]]
+        noCycleDetected = not self.unsorted
         return sortedVertices, noCycleDetected
+    # one cycle among the vertices left unsorted by topoSort, as a list of
+    # vertices [v0, v1, ..., v0]; empty if the graph is acyclic
+    def findCycle(self):
+        remaining = set(self.unsorted)
+        if not remaining:
+            return []
+        # every remaining vertex has an edge to another remaining vertex
+        path = [self.unsorted[0]]
+        visited = {path[0]: 0}
+        while True:
+            v = next(c for c in self.graph[path[-1]] if c in remaining)
+            if v in visited:
+                return path[visited[v]:] + [v]
+            visited[v] = len(path)
+            path.append(v)
+
+"""
+Common subexpression elimination over a set of math ASTs.
+Subtrees are identified by their infix formula (structurally equal
+subtrees share one key), so all expressions of a function form one
+shared expression DAG. Subtrees used more than once are hoisted into
+temporaries, which are evaluated once per call.
+"""
+class CommonSubexpressions:
+
+    def __init__(self, prefix = CSE_TEMP_PREFIX):
+        self.prefix = prefix
+        # key: math node (copy) and number of occurrences
+        self.nodes = {}
+        self.count = {}
+        # hoisted subexpressions: key -> temporary name, in creation order
+        self.temps = {}
+        self.exprs = []
+
+    # structural key of a subtree
+    def key(self, node):
+        return lsb.formulaToL3String(node)
+
+    # leaf nodes (names, numbers) are never hoisted
+    def isLeaf(self, node):
+        return node.getNumChildren() == 0
+
+    # add one expression to the DAG
+    def add(self, math):
+        self.exprs.append(math)
+        stack = [math]
+        while stack:
+            node = stack.pop()
+            if self.isLeaf(node):
+                continue
+            k = self.key(node)
+            if k not in self.count:
+                self.count[k] = 0
+                self.nodes[k] = node.deepCopy()
+            self.count[k] += 1
+            for i in range(node.getNumChildren()):
+                stack.append(node.getChild(i))
+        return
 
+    # hoisted subtrees directly referenced by math;
+    # the root itself is expanded when expand_root is True
+    def references(self, math, expand_root = False):
+        refs = []
+        stack = [(math, True)]
+        while stack:
+            node, isRoot = stack.pop()
+            if self.isLeaf(node):
+                continue
+            k = self.key(node)
+            if k in self.temps and not (isRoot and expand_root):
+                refs.append(k)
+                continue
+            for i in range(node.getNumChildren()):
+                stack.append((node.getChild(i), False))
+        return refs
+
+    # choose subtrees to hoist: a subtree is hoisted if it is still used
+    # at least twice once repeated parents are evaluated only once
+    def build(self):
+        candidates = {k for k, c in self.count.items() if c > 1}
+        while True:
+            self.temps = {k: None for k in candidates}
+            uses = dict.fromkeys(candidates, 0)
+            for math in self.exprs:
+                for k in self.references(math):
+                    uses[k] += 1
+            for k in candidates:
+                for r in self.references(self.nodes[k], expand_root = True):
+                    uses[r] += 1
+            keep = {k for k in candidates if uses[k] > 1}
+            if keep == candidates:
+                break
+            candidates = keep
+        # name temporaries in order of first appearance
+        names = {}
+        for math in self.exprs:
+            self.nameTemps(math, names, False)
+        self.temps = names
+        return
+
+    def nameTemps(self, math, names, expand_root):
+        for k in self.references(math, expand_root):
+            if k not in names:
+                self.nameTemps(self.nodes[k], names, True)
+                names[k] = '{}{}'.format(self.prefix, len(names))
+        return
+
+    # temporaries needed before evaluating math, in evaluation order;
+    # temporaries already in defined are skipped and defined is updated
+    def requiredTemps(self, math, defined, expand_root = False):
+        required = []
+        for k in self.references(math, expand_root):
+            if k not in defined:
+                required += self.requiredTemps(self.nodes[k], defined, True)
+                defined.add(k)
+                required.append(k)
+        return required
+
+    # (arithmetic operations, function calls) to evaluate math once,
+    # not counting hoisted subtrees unless at the expanded root
+    def opCount(self, math, use_temps = True, expand_root = False):
+        ops = 0
+        calls = 0
+        stack = [(math, True)]
+        while stack:
+            node, isRoot = stack.pop()
+            if self.isLeaf(node):
+                continue
+            if use_temps and self.key(node) in self.temps and not (isRoot and expand_root):
+                continue
+            if node.isFunction():
+                calls += 1
+                if node.getName() == SBML_FUNCTION_NTHROOT:
+                    ops += 1
+            elif node.isUMinus():
+                ops += 1
+            else:
+                ops += max(node.getNumChildren() - 1, 1)
+            for i in range(node.getNumChildren()):
+                stack.append((node.getChild(i), False))
+        return ops, calls
+
+    # operation count per call before and after elimination
+    def report(self, name):
+        before = [0, 0]
+        after = [0, 0]
+        for math in self.exprs:
+            for i, c in enumerate(self.opCount(math, use_temps = False)):
+                before[i] += c
+            for i, c in enumerate(self.opCount(math)):
+                after[i] += c
+        for k in self.temps:
+            for i, c in enumerate(self.opCount(self.nodes[k], expand_root = True)):
+                after[i] += c
+        message = '{}: {} expressions, {} temporaries\n'.format(name, len(self.exprs), len(self.temps))
+        message += '    operations per call: {} -> {} (removed {})\n'.format(
+            sum(before), sum(after), sum(before) - sum(after))
+        message += '    arithmetic: {} -> {}; function calls: {} -> {}\n'.format(
+            before[0], after[0], before[1], after[1])
+        return message
+
+"""
+AstTranslator replacing hoisted subtrees by their temporaries.
+"""
+class CseTranslator(AstTranslator):
+
+    def __init__(self, translator, cse):
+        AstTranslator.__init__(self, translator.fname, translator.ASTNameToCppToken)
+        self.cse = cse
+
+    # expression of math, the root itself can be a temporary
+    def exprToString(self, math):
+        k = self.cse.key(math)
+        if k in self.cse.temps:
+            return self.cse.temps[k]
+        return self.mathToString(math)
+
+    # definition of temporaries required before evaluating math
+    def tempDefinitions(self, math, defined, indent = '    '):
+        source = ''
+        for k in self.cse.requiredTemps(math, defined):
+            source += '{}realtype {} = {};\n'.format(indent, self.cse.temps[k],
+                                                   self.mathToString(self.cse.nodes[k]))
+        return source
+
+    def nodeReplacement(self, parent, current):
+        if parent is not None and not self.cse.isLeaf(current):
+            k = self.cse.key(current)
+            if k in self.cse.temps:
+                return self.cse.temps[k]
+        return None
+
+"""
+Symbolic derivative of math ASTs, used for the analytic Jacobian.
+dname(node): derivative of a name node (ASTNode), None if it is zero.
+Derivatives are new trees of binary operators (as handled by AstTranslator);
+None stands for an expression that is identically zero.
+"""
+class AstDifferentiator:
+
+    def __init__(self, dname):
+        self.dname = dname
+
+    # constructors of new nodes
+    @staticmethod
+    def number(v):
+        node = lsb.ASTNode(lsb.AST_REAL)
+        node.setValue(float(v))
+        return node
+
+    @staticmethod
+    def name(n):
+        node = lsb.ASTNode(lsb.AST_NAME)
+        node.setName(n)
+        return node
+
+    @staticmethod
+    def operator(t, children, name = None):
+        node = lsb.ASTNode(t)
+        if name is not None:
+            node.setName(name)
+        for c in children:
+            node.addChild(c)
+        return node
+
+    @staticmethod
+    def isOne(node):
+        return node.isNumber() and node.getValue() == 1
+
+    # sum of terms, None terms skipped
+    def add(self, terms):
+        terms = [x for x in terms if x is not None]
+        if not terms:
+            return None
+        s = terms[0]
+        for x in terms[1:]:
+            if x.isUMinus():
+                s = self.operator(lsb.AST_MINUS, [s, x.getChild(0).deepCopy()])
+            else:
+                s = self.operator(lsb.AST_PLUS, [s, x])
+        return s
+
+    def neg(self, a):
+        if a is None:
+            return None
+        return self.operator(lsb.AST_MINUS, [a])
+
+    def sub(self, a, b):
+        if b is None:
+            return a
+        if a is None:
+            return self.neg(b)
+        return self.operator(lsb.AST_MINUS, [a, b])
+
+    # product of factors, None if any factor is None
+    def mul(self, factors):
+        if any(x is None for x in factors):
+            return None
+        factors = [x for x in factors if not self.isOne(x)]
+        if not factors:
+            return self.number(1)
+        p = factors[0]
+        for x in factors[1:]:
+            p = self.operator(lsb.AST_TIMES, [p, x])
+        return p
+
+    def div(self, a, b):
+        if a is None:
+            return None
+        return self.operator(lsb.AST_DIVIDE, [a, b])
+
+    def pow(self, a, b):
+        return self.operator(lsb.AST_FUNCTION_POWER, [a, b])
+
+    def ln(self, a):
+        return self.operator(lsb.AST_FUNCTION_LN, [a])
+
+    # d(x^e)/dx, for e independent of the variable
+    def dpow(self, x, e):
+        return self.mul([e.deepCopy(), self.pow(x.deepCopy(),
+                         self.sub(e.deepCopy(), self.number(1)))])
+
+    """
+    derivative of math; raise ValueError if an operation depending on
+    the variable cannot be differentiated
+    """
+    def derivative(self, math):
+        nrChild = math.getNumChildren()
+        if nrChild == 0:
+            if math.isName() and math.getType() != lsb.AST_NAME_TIME:
+                return self.dname(math)
+            return None
+        c = [math.getChild(i) for i in range(nrChild)]
+        d = [self.derivative(x) for x in c]
+        if all(x is None for x in d):
+            return None
+        t = math.getType()
+        if t == lsb.AST_PLUS:
+            return self.add(d)
+        elif math.isUMinus():
+            return self.neg(d[0])
+        elif t == lsb.AST_MINUS:
+            return self.sub(d[0], d[1])
+        elif t == lsb.AST_TIMES:
+            return self.add([self.mul([dk] + [x.deepCopy() for j, x in enumerate(c) if j != k])
+                             for k, dk in enumerate(d)])
+        elif t == lsb.AST_DIVIDE:
+            # du/v - u*dv/(v*v)
+            u, v = c
+            return self.sub(self.div(d[0], v.deepCopy()),
+                            self.div(self.mul([u.deepCopy(), d[1]]),
+                                     self.mul([v.deepCopy(), v.deepCopy()])))
+        elif t == lsb.AST_POWER or t == lsb.AST_FUNCTION_POWER:
+            u, v = c
+            if d[1] is None:
+                return self.mul([self.dpow(u, v), d[0]])
+            # u^v*(dv*ln(u) + v*du/u)
+            return self.mul([math.deepCopy(),
+                             self.add([self.mul([d[1], self.ln(u.deepCopy())]),
+                                       self.div(self.mul([v.deepCopy(), d[0]]), u.deepCopy())])])
+        elif t == lsb.AST_FUNCTION_EXP:
+            return self.mul([math.deepCopy(), d[0]])
+        elif t == lsb.AST_FUNCTION_LN:
+            return self.div(d[0], c[0].deepCopy())
+        elif t == lsb.AST_FUNCTION_LOG and d[0] is None:
+            # log(base, x)
+            return self.div(d[1], self.mul([c[1].deepCopy(), self.ln(c[0].deepCopy())]))
+        elif t == lsb.AST_FUNCTION_ROOT and d[0] is None:
+            # root(n, x) = x^(1/n)
+            return self.mul([self.dpow(c[1], self.div(self.number(1), c[0].deepCopy())), d[1]])
+        elif math.getName() == SBML_FUNCTION_NTHROOT and d[1] is None:
+            # nthroot(x, n) = x^(1/n)
+            return self.mul([self.dpow(c[0], self.div(self.number(1), c[1].deepCopy())), d[0]])
+        elif math.getName() == 'log2' and nrChild == 1:
+            return self.div(d[0], self.mul([c[0].deepCopy(), self.ln(self.number(2))]))
+        raise ValueError('cannot differentiate: {}'.format(lsb.formulaToL3String(math)))
+
+"""
+Analytic Jacobian of the ODE right hand side, d(ydot_i)/d(y_j).
+Assignment rules and reaction fluxes depending on y get one temporary
+per (expression, y_j) pair, chained in assignment rule order;
+entries combine flux derivatives by stoichiometry.
+entries: (row, column, math), sorted by column then row
+    (compressed sparse column order)
+"""
+class ReactionJacobian:
+
+    def __init__(self, neq):
+        self.neq = neq
+        # derivative temporaries: (name, math) in evaluation order
+        self.rules = []
+        self.fluxes = []
+        # reaction flux values required by the entries: (name, math)
+        self.flux_values = []
+        self.entries = []
+        # names not translated as model variables
+        self.local_names = {QSP_WEIGHT_NAME}
+
+    def nnz(self):
+        return len(self.entries)
+
+    # (upper, lower) bandwidth
+    def bandwidth(self):
+        mu = max([j - i for i, j, _ in self.entries] + [0])
+        ml = max([i - j for i, j, _ in self.entries] + [0])
+        return mu, ml
+
+    # column pointers and row indices, compressed sparse column
+    def pattern(self):
+        colptrs = [0]*(self.neq+1)
+        for i, j, _ in self.entries:
+            colptrs[j+1] += 1
+        for j in range(self.neq):
+            colptrs[j+1] += colptrs[j]
+        rowvals = [i for i, j, _ in self.entries]
+        return colptrs, rowvals
+
+    # solver for 'auto': banded if narrow, KLU if large and sparse
+    def chooseSolver(self):
+        mu, ml = self.bandwidth()
+        if mu + ml + 1 <= self.neq // 4:
+            return 'band'
+        if self.neq >= 100 and self.nnz() <= 0.1*self.neq*self.neq:
+            return 'klu'
+        return 'dense'
+
+    def report(self, name, linear_solver):
+        mu, ml = self.bandwidth()
+        message = '{}: {} x {}, {} nonzeros ({:.1%}), bandwidth {}/{}\n'.format(
+            name, self.neq, self.neq, self.nnz(),
+            self.nnz()/max(self.neq*self.neq, 1), mu, ml)
+        message += '    temporaries: {} rule derivatives, {} flux derivatives\n'.format(
+            len(self.rules), len(self.fluxes))
+        message += '    linear solver: {}\n'.format(linear_solver)
+        return message
+
+"""
+Constant folding by variability.
+Subexpressions are classified as literal, class constant (class 
+parameters), per-instance (non-species variables, changed only by events) 
+or time-varying (species, time and rules depending on them). 
+Invariant assignment rules and maximal invariant subexpressions are 
+evaluated by update_precomputed() before each integration segment and 
+read back as PRECOMP(k); the rhs only evaluates the time-varying part.
+nameVariability: function sid -> VARIABILITY_*
+"""
+class InvariantSubexpressions:
+
+    def __init__(self, nameVariability):
+        self.nameVariability = nameVariability
+        # invariant assignment rules: variable -> (slot, math, variability)
+        self.rules = {}
+        # folded subexpressions: key -> (slot, math, variability)
+        self.exprs = {}
+        # name in folded math -> slot
+        self.names = {}
+        self.size = 0
+        # folded math of rules (None if invariant) and kinetic laws, by index
+        self.ruleMath = {}
+        self.kineticMath = {}
+        # compartment -> slot of its reciprocal
+        self.compReciprocal = {}
+
+    # structural key, numbers at full precision
+    def key(self, node):
+        return (node.getType(), node.getName(),
+                repr(node.getValue()) if node.isNumber() else None,
+                tuple(self.key(node.getChild(i)) for i in range(node.getNumChildren())))
+
+    def variability(self, node):
+        if node.getNumChildren() == 0:
+            if node.getType() == lsb.AST_NAME_TIME:
+                return VARIABILITY_TIME
+            elif node.isName():
+                n = node.getName()
+                if n in self.rules:
+                    return self.rules[n][2]
+                return self.nameVariability(n)
+            return VARIABILITY_LITERAL
+        return max(self.variability(node.getChild(i)) for i in range(node.getNumChildren()))
+
+    def newSlot(self, name = None):
+        slot = self.size
+        self.size += 1
+        self.names['{}_{}'.format(PRECOMPUTED_MACRO, slot)] = slot
+        if name is not None:
+            self.names[name] = slot
+        return slot
+
+    def slotNode(self, slot):
+        node = lsb.ASTNode(lsb.AST_NAME)
+        node.setName('{}_{}'.format(PRECOMPUTED_MACRO, slot))
+        return node
+
+    def addExpr(self, math, variability):
+        k = self.key(math)
+        if k not in self.exprs:
+            self.exprs[k] = (self.newSlot(), math.deepCopy(), variability)
+        return self.exprs[k][0]
+
+    # add one assignment rule, in assignment rule order;
+    # return its folded math, None if the whole rule is invariant
+    def addRule(self, var, math):
+        v = self.variability(math)
+        if v <= VARIABILITY_INSTANCE:
+            slot = self.newSlot(var)
+            self.rules[var] = (slot, math, v)
+            return None
+        return self.fold(math)
+
+    # slot name replacing node, None if node is not folded
+    def replacement(self, node):
+        if node.getNumChildren() == 0:
+            if node.isName() and node.getName() in self.rules:
+                return self.slotNode(self.rules[node.getName()][0])
+            return None
+        v = self.variability(node)
+        if v == VARIABILITY_LITERAL or v == VARIABILITY_TIME:
+            return None
+        return self.slotNode(self.addExpr(node, v))
+
+    # copy of math with maximal invariant subtrees replaced
+    def fold(self, math):
+        r = self.replacement(math)
+        if r is not None:
+            return r
+        node = math.deepCopy()
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            for i in range(current.getNumChildren()):
+                r = self.replacement(current.getChild(i))
+                if r is None:
+                    stack.append(current.getChild(i))
+                else:
+                    current.replaceChild(i, r, True)
+        return node
+
+    # slot of 1/sid if sid is invariant, else None
+    def reciprocal(self, sid):
+        if sid in self.rules or self.nameVariability(sid) <= VARIABILITY_INSTANCE:
+            math = lsb.ASTNode(lsb.AST_DIVIDE)
+            one = lsb.ASTNode(lsb.AST_INTEGER)
+            one.setValue(1)
+            name = lsb.ASTNode(lsb.AST_NAME)
+            name.setName(sid)
+            math.addChild(one)
+            math.addChild(name)
+            return self.addExpr(math, self.variability(math))
+        return None
+
+    # name formatting reading folded names from PRECOMP(k)
+    def translator(self, trans):
+        def fname(varName):
+            if varName in self.names:
+                return '{}({})'.format(PRECOMPUTED_MACRO, self.names[varName])
+            return trans.fname(varName)
+        return AstTranslator(fname, trans.ASTNameToCppToken)
+
+    def report(self, name):
+        count = [0]*(VARIABILITY_TIME+1)
+        for _, _, v in list(self.rules.values()) + list(self.exprs.values()):
+            count[v] += 1
+        message = '{}: {} precomputed values ({} assignment rules, {} subexpressions)\n'.format(
+            name, self.size, len(self.rules), len(self.exprs))
+        message += '    class constant: {}; per-instance: {}\n'.format(
+            count[VARIABILITY_CLASS], count[VARIABILITY_INSTANCE])
+        return message
 
 """
 Print different model components to stdout
@@ -1166,20 +2025,17 @@ sbmlConverter.get_SI_str = get_SI_str
 
 """
 print units of compartment, species and parameters
-Units are converted to SI unit
+Units are converted to SI unit (as computed by getUnitsConvertionScaling)
 """
 def printAllConvertedUnits(model, f, key2name, key2var):
     f.write('item, name, category, scaling, unit, converted_ic\n')
     for n in range(0, model.getNumCompartments()):
         c = model.getCompartment(n)
         #print(c.getName())
-        ud = c.getDerivedUnitDefinition()
-        ud = lsb.UnitDefinition.convertToSI(ud)
-        lsb.UnitDefinition.simplify(ud)
         cname = 'Compartment {},'.format(n) + c.getName()
-        udStr = UnitDefinitionConvertToString(ud)
-        scale = UnitDefinitionScalingFactor(ud)
         eid = c.getId()
+        udStr = key2name[eid]['unit_SI']
+        scale = key2name[eid]['scaling_SI']
         initValue = key2name[eid]['init_use']
         vtype = key2var[eid]['vartype'] if eid in key2var else 'rule'
         f.write('{}, {}, {},{},{}\n'.format(cname, vtype, scale, udStr, initValue))
@@ -1187,16 +2043,13 @@ def printAllConvertedUnits(model, f, key2name, key2var):
     for n in range(0, model.getNumSpecies()):
         s = model.getSpecies(n)
         #print(s.getName())
-        ud = s.getDerivedUnitDefinition()
-        ud = lsb.UnitDefinition.convertToSI(ud)
-        lsb.UnitDefinition.simplify(ud)    
         sname = 'Species {},'.format(n) + \
             model.getElementBySId(s.getCompartment()).getName() + \
             '.' + s.getName()
         
-        udStr = UnitDefinitionConvertToString(ud)
-        scale = UnitDefinitionScalingFactor(ud)
         eid = s.getId()
+        udStr = key2name[eid]['unit_SI']
+        scale = key2name[eid]['scaling_SI']
         initValue =  key2name[eid]['init_use']
         vtype = key2var[eid]['vartype'] if eid in key2var else 'rule'
         f.write('{},{}, {},{},{}\n'.format(sname, vtype, scale, udStr, initValue))
@@ -1204,14 +2057,11 @@ def printAllConvertedUnits(model, f, key2name, key2var):
     for n in range(0, model.getNumParameters()):
         p = model.getParameter(n)
         #print(p.getName())
-        ud = p.getDerivedUnitDefinition()
-        ud = lsb.UnitDefinition.convertToSI(ud)
-        lsb.UnitDefinition.simplify(ud)    
         pname = 'Parameter {},'.format(n) + p.getName()
         
-        udStr = UnitDefinitionConvertToString(ud)
-        scale = UnitDefinitionScalingFactor(ud)
         eid = p.getId()
+        udStr = key2name[eid]['unit_SI']
+        scale = key2name[eid]['scaling_SI']
         initValue =  key2name[eid]['init_use']
         vtype = key2var[eid]['vartype'] if eid in key2var else 'rule'
         f.write('{},{}, {},{},{}\n'.format(pname, vtype, scale, udStr, initValue))
@@ -1274,13 +2124,14 @@ def isVariantOfSubstancePerVolumeTime(ud, level, version):
     
 """
 check unit consistency
+analysis: ModelAnalysis of model (kinetic law units and formulas), built if not provided
 """
-def checkUnitConsistency(model, translator):
+def checkUnitConsistency(model, translator, analysis = None):
+    if analysis is None:
+        analysis = ModelAnalysis(model, translator = translator)
     
     ### initial assignment left-hand side: getSymbol() or getId()
-    model_level = model.getLevel()
-    model_version = model.getVersion()
-    
+
     message = ''
     message += 'Checking unit consistency:\n'
     message += 'InitialAssignment\n'
@@ -1294,7 +2145,7 @@ def checkUnitConsistency(model, translator):
             message += 'Warning: Initial assignment {}: matching units: {}\n'.format(i, sameUnit)
             message += '    left: {} ({})\n\t Unit: {}\n'.format(lhs.getName(), lhs.getId(), 
                   lsb.UnitDefinition.printUnits(ud_lhs))
-            message += '    right: {}\n\t Unit: {}\n'.format(translator.mathToString(ia.getMath()), 
+            message += '    right: {}\n\t Unit: {}\n'.format(analysis.formula('ia', i), 
                   lsb.UnitDefinition.printUnits(ud_ia))
     
     ### rules: repeated assignment (check rules are all assignments) 
@@ -1313,7 +2164,7 @@ def checkUnitConsistency(model, translator):
             message += 'Warning: Assignment rule {}: matching units: {}\n'.format(i, sameUnit)
             message += '    left: {} ({})\n\t Unit: {}\n'.format(lhs.getName(), lhs.getId(),
                   lsb.UnitDefinition.printUnits(ud_lhs))
-            message += '    right: {}\n\t Unit: {}\n'.format(translator.mathToString(ar.getMath()), 
+            message += '    right: {}\n\t Unit: {}\n'.format(analysis.formula('rule', i), 
                   lsb.UnitDefinition.printUnits(ud_ar))
     
     # reactions: all kineticlaw should have unit of substance per time or substance per (time x volume)
@@ -1323,11 +2174,9 @@ def checkUnitConsistency(model, translator):
         if (not r.isSetKineticLaw()):
             message += 'Warning: undefined KineticLaw for reaction {}\n'.format(i)
             break
-        ud = r.getKineticLaw().getDerivedUnitDefinition()
-        isSubstanceUnit = ud.isVariantOfSubstancePerTime()
+        isSubstanceUnit, isSubstancePerVolTime = analysis.fluxUnit[i]
         if not isSubstanceUnit:
             # change reaction rate formula with compartment size
-            isSubstancePerVolTime = isVariantOfSubstancePerVolumeTime(ud, model_level, model_version)
             if not isSubstancePerVolTime:
                 message += 'Warning: kineticLaw for reaction {}: unit is not substance/time nor substance/vol/time\n'.format(i)
         ##print out actual units:
@@ -1386,130 +2235,199 @@ def checkAssignmentValidity(model, speciesStoichiometry):
     return
 
 
+"""
+Analysis of a loaded model (intermediate representation), built in one 
+pass by load_model. It only depends on the model, not on the converter
+configuration, so unit validation, process_variables and every export
+read from it instead of walking the libSBML model again.
+    ruleNodes[i], iaNodes[i], reactionNodes[i], triggerNodes[i], eaNodes[i][j]:
+        names in the math of rules, initial assignments, kinetic laws,
+        event triggers and event assignments, as a list of (name, is_time)
+    triggerComponentNodes[k]: same for the trigger components (allTriggers)
+    fluxUnit[i]: (substance/time, substance/volume/time) flags of the unit
+        of kinetic law i; None if the kinetic law is not set
+    fluxUnitSI[i]: SI unit string of kinetic law i
+    dependency: ModelDependencyGraph
+    unitReport: message of checkUnitConsistency, set on first validation
+Math strings of the general translator are cached by formula().
+Unit scaling of compartments, species and parameters is kept in key2name
+(getUnitsConvertionScaling).
+"""
+class ModelAnalysis:
+    def __init__(self, model, allTriggers = [], translator = None):
+        self.model = model
+        self.translator = translator
+        self.ruleNodes = [self.nodes(model.getRule(i).getMath()) 
+                          for i in range(model.getNumRules())]
+        self.iaNodes = [self.nodes(model.getInitialAssignment(i).getMath()) 
+                        for i in range(model.getNumInitialAssignments())]
+        self.reactionNodes = []
+        self.fluxUnit = []
+        self.fluxUnitSI = []
+        for i in range(model.getNumReactions()):
+            r = model.getReaction(i)
+            if not r.isSetKineticLaw():
+                self.reactionNodes.append([])
+                self.fluxUnit.append(None)
+                self.fluxUnitSI.append('')
+                continue
+            k = r.getKineticLaw()
+            self.reactionNodes.append(self.nodes(k.getMath()))
+            ud = k.getDerivedUnitDefinition()
+            self.fluxUnit.append((ud.isVariantOfSubstancePerTime(), 
+                isVariantOfSubstancePerVolumeTime(ud, model.getLevel(), model.getVersion())))
+            udSI = lsb.UnitDefinition.convertToSI(ud)
+            lsb.UnitDefinition.simplify(udSI)
+            self.fluxUnitSI.append(UnitDefinitionConvertToString(udSI))
+        self.triggerNodes = []
+        self.eaNodes = []
+        for i in range(model.getNumEvents()):
+            e = model.getEvent(i)
+            self.triggerNodes.append(self.nodes(e.getTrigger().getMath()))
+            self.eaNodes.append([self.nodes(e.getEventAssignment(j).getMath()) 
+                                 for j in range(e.getNumEventAssignments())])
+        self.triggerComponentNodes = [self.nodes(t) for t in allTriggers]
+        self.formulas = {}
+        self.unitReport = None
+        self.dependency = ModelDependencyGraph(model, self)
+        return
+    # names in math as a list of (name, is_time)
+    @staticmethod
+    def nodes(math):
+        l = math.getListOfNodes()
+        nodes = []
+        for j in range(l.getSize()):
+            node = l.get(j)
+            if node.isName():
+                nodes.append((node.getName(), node.getType() == lsb.AST_NAME_TIME))
+        return nodes
+    @staticmethod
+    def names(nodes):
+        return [n for n, isTime in nodes]
+    # general translator string of the math of rule/initial assignment/reaction i
+    # kind: 'rule' | 'ia' | 'reaction'
+    def formula(self, kind, i):
+        key = (kind, i)
+        if key not in self.formulas:
+            if kind == 'rule':
+                math = self.model.getRule(i).getMath()
+            elif kind == 'ia':
+                math = self.model.getInitialAssignment(i).getMath()
+            else:
+                math = self.model.getReaction(i).getKineticLaw().getMath()
+            self.formulas[key] = self.translator.mathToString(math)
+        return self.formulas[key]
+
+"""
+Dependencies of assignment rules and initial assignments of a model,
+from the names collected by ModelAnalysis. The sorting and 
+getAssignmentRulesRequiredFor* functions below query this object.
+    ruleGraph: edges from a rule index to indices of rules it depends on
+    iaGraph: same for initial assignments
+    iaRules/triggerRules/eaRules: indices of rules referenced directly by
+        initial assignments/event triggers/event assignments
+"""
+class ModelDependencyGraph:
+    def __init__(self, model, analysis):
+        self.idxAssignmentRule = {}
+        for i in range(model.getNumRules()):
+            arName = model.getRule(i).getVariable()
+            self.idxAssignmentRule[arName] = i
+        self.idxInitAssignment = {}
+        for i in range(model.getNumInitialAssignments()):
+            iaName = model.getInitialAssignment(i).getSymbol()
+            self.idxInitAssignment[iaName] = i
+        self.ruleVariable = {i: v for v, i in self.idxAssignmentRule.items()}
+        self.iaVariable = {i: v for v, i in self.idxInitAssignment.items()}
+
+        self.ruleGraph = DirectedAcyclicGraph()
+        for i, nodes in enumerate(analysis.ruleNodes):
+            self.ruleGraph.addVertex(i)
+            for v1 in self.referenced(nodes, self.idxAssignmentRule):
+                self.ruleGraph.addEdge(i, v1)
+
+        self.iaGraph = DirectedAcyclicGraph()
+        self.iaRules = set()
+        for i, nodes in enumerate(analysis.iaNodes):
+            self.iaGraph.addVertex(i)
+            for v1 in self.referenced(nodes, self.idxInitAssignment):
+                self.iaGraph.addEdge(i, v1)
+            self.iaRules.update(self.referenced(nodes, self.idxAssignmentRule))
+
+        self.triggerRules = set()
+        self.eaRules = set()
+        for i, nodes in enumerate(analysis.triggerNodes):
+            self.triggerRules.update(self.referenced(nodes, self.idxAssignmentRule))
+            for eaNodes in analysis.eaNodes[i]:
+                self.eaRules.update(self.referenced(eaNodes, self.idxAssignmentRule))
+        return
+    # indices of names in nodes which are keys of idx, in order of appearance
+    @staticmethod
+    def referenced(nodes, idx):
+        return [idx[n] for n, isTime in nodes if n in idx]
+    # variable names along a cycle of graph, 'a -> b -> a'
+    @staticmethod
+    def cycleToString(graph, names):
+        return ' -> '.join(names[v] for v in graph.findCycle())
+
 """
 Check if algebraic loops exist in initial assignments:
 Assignments are represented with a directed graph,
 with edges start from one variable to variables it is 
 dependent of. 
-If cycles are detected, print error message;
+If cycles are detected, print error message naming one cycle;
 Otherwise, return topological sorting of variable indices
+deps: ModelDependencyGraph of model, built if not provided
 """       
-def getInitialAssignmentsSorted(model):
-    # initial Assignments
-    idxInitAssignment = {}
-    for i in range(model.getNumInitialAssignments()):
-        iaName = model.getInitialAssignment(i).getSymbol()
-        idxInitAssignment[iaName] = i
-    graphInitAssignment = DirectedAcyclicGraph()
-    for i in range(model.getNumInitialAssignments()):
-        ia = model.getInitialAssignment(i)
-        graphInitAssignment.addVertex(i)
-        l = ia.getMath().getListOfNodes()
-        for j in range(l.getSize()):
-            node = l.get(j)
-            if node.isName():
-                nodeName = node.getName()
-                if nodeName in idxInitAssignment:
-                    v1 = idxInitAssignment[nodeName]
-                    graphInitAssignment.addEdge(i, v1)
-    srted, noCycle = graphInitAssignment.topoSort()
+def getInitialAssignmentsSorted(model, deps = None):
+    if deps is None:
+        deps = ModelAnalysis(model).dependency
+    srted, noCycle = deps.iaGraph.topoSort()
     if noCycle:
         return srted
     else:
-        print('Error: algebraic loop in initial assignments')
+        print('Error: algebraic loop in initial assignments: ' 
+              + deps.cycleToString(deps.iaGraph, deps.iaVariable))
         return None
 """
 Check if algebraic loops exist in assignment rules:
 Assignments are represented with a directed graph,
 with edges start from one variable to variables it is 
 dependent of. 
-If cycles are detected, print error message;
+If cycles are detected, print error message naming one cycle;
 Otherwise, return topological sorting of variable indices.
 and the graph object
+deps: ModelDependencyGraph of model, built if not provided
 """                      
-def getAssignmentRulesSorted(model):
-    # assignment rules
-    idxAssignmentRule = {}
-    for i in range(model.getNumRules()):
-        arName = model.getRule(i).getVariable()
-        idxAssignmentRule[arName] = i
-    graphAssignmentRule = DirectedAcyclicGraph()
-    for i in range(model.getNumRules()):
-        ar = model.getRule(i)
-        graphAssignmentRule.addVertex(i)
-        l = ar.getMath().getListOfNodes()
-        for j in range(l.getSize()):
-            node = l.get(j)
-            if node.isName():
-                nodeName = node.getName()
-                if nodeName in idxAssignmentRule:
-                    v1 = idxAssignmentRule[nodeName]
-                    graphAssignmentRule.addEdge(i, v1)
-    srted, noCycle = graphAssignmentRule.topoSort()
+def getAssignmentRulesSorted(model, deps = None):
+    if deps is None:
+        deps = ModelAnalysis(model).dependency
+    srted, noCycle = deps.ruleGraph.topoSort()
     if noCycle:
-        return srted, graphAssignmentRule
+        return srted, deps.ruleGraph
 
     else:
-        print('Error: algebraic loop in assignments rules')
+        print('Error: algebraic loop in assignments rules: ' 
+              + deps.cycleToString(deps.ruleGraph, deps.ruleVariable))
         return None       
 
 """
 Get the list of variables subject to rule assignments which are
 also needed for initial assignments.
 """       
-def getAssignmentRulesRequiredForInitAssignment(model):
-    # assignment rules
-    idxAssignmentRule = {}
-    for i in range(model.getNumRules()):
-        arName = model.getRule(i).getVariable()
-        idxAssignmentRule[arName] = i
-    iaVars = set()
-    for i in range(model.getNumInitialAssignments()):
-        ia = model.getInitialAssignment(i)
-        l = ia.getMath().getListOfNodes()
-        for j in range(l.getSize()):
-            node = l.get(j)
-            if node.isName():
-                nodeName = node.getName()
-                if nodeName in idxAssignmentRule:
-                    iaVars.add(idxAssignmentRule[nodeName])             
-    return iaVars
+def getAssignmentRulesRequiredForInitAssignment(model, deps = None):
+    if deps is None:
+        deps = ModelAnalysis(model).dependency
+    return set(deps.iaRules)
 
 """
 Get the list of variables subject to rule assignments which are
 also needed for event tigger evaluation or event assignments rhs.
 """       
-def getAssignmentRulesRequiredForEvents(model):
-    # assignment rules
-    idxAssignmentRule = {}
-    for i in range(model.getNumRules()):
-        arName = model.getRule(i).getVariable()
-        idxAssignmentRule[arName] = i
-    triggerVars = set()
-    eaVars = set()
-    for i in range(model.getNumEvents()):
-        e = model.getEvent(i)
-        # trigger
-        tMath = e.getTrigger().getMath()
-        l = tMath.getListOfNodes()
-        for j in range(l.getSize()):
-            node = l.get(j)
-            if node.isName():
-                nodeName = node.getName()
-                if nodeName in idxAssignmentRule:
-                    triggerVars.add(idxAssignmentRule[nodeName])
-        # event assignments
-        for k in range(e.getNumEventAssignments()):
-            ea = e.getEventAssignment(k)
-            eaMath = ea.getMath()
-            l = eaMath.getListOfNodes()
-            for j in range(l.getSize()):
-                node = l.get(j)
-                if node.isName():
-                    nodeName = node.getName()
-                    if nodeName in idxAssignmentRule:
-                        eaVars.add(idxAssignmentRule[nodeName])               
-    return triggerVars, eaVars
+def getAssignmentRulesRequiredForEvents(model, deps = None):
+    if deps is None:
+        deps = ModelAnalysis(model).dependency
+    return set(deps.triggerRules), set(deps.eaRules)
 
 """
 Variables in SBML documents can be Species, Compartments or Parameters.
@@ -1684,7 +2602,9 @@ True if dependent of y or t;
 False if not (only dependent of parameters or other variables 
 subject to change by other means) 
 """
-def getAssignmentRuleYDependency(model, assignmentRuleOrder, key2var):
+def getAssignmentRuleYDependency(model, assignmentRuleOrder, key2var, analysis = None):
+    if analysis is None:
+        analysis = ModelAnalysis(model)
     depAssignmentRule = {}
     for i in range(model.getNumRules()):
         arName = model.getRule(i).getVariable()
@@ -1692,53 +2612,84 @@ def getAssignmentRuleYDependency(model, assignmentRuleOrder, key2var):
             
     for i in assignmentRuleOrder:
         vName = model.getRule(i).getVariable()
-        l = model.getRule(i).getMath().getListOfNodes()
-        for j in range(l.getSize()):
-            node = l.get(j)
-            if node.isName():
-                nodeName = node.getName()
-                if nodeName in depAssignmentRule:
-                    if depAssignmentRule[nodeName] == True:
-                        depAssignmentRule[vName] = True
-                        break
-                elif nodeName in key2var:
-                    if key2var[nodeName]['vartype'] == 'sp_var':
-                        depAssignmentRule[vName] = True
-                        break
-                elif node.getType() == lsb.AST_NAME_TIME:
-                   depAssignmentRule[vName] = True
-                   break
+        for nodeName, isTime in analysis.ruleNodes[i]:
+            if nodeName in depAssignmentRule:
+                if depAssignmentRule[nodeName] == True:
+                    depAssignmentRule[vName] = True
+                    break
+            elif nodeName in key2var:
+                if key2var[nodeName]['vartype'] == 'sp_var':
+                    depAssignmentRule[vName] = True
+                    break
+            elif isTime:
+               depAssignmentRule[vName] = True
+               break
     return depAssignmentRule
     
 """
 Check if trigger components contain variables 
 dependent of y, directly or inderectly.
 """
-def getTriggerComponentDependency(model, assignmentRuleOrder, allTriggers, key2var):
+def getTriggerComponentDependency(model, assignmentRuleOrder, allTriggers, key2var, analysis = None):
+    if analysis is None:
+        analysis = ModelAnalysis(model, allTriggers)
     
-    isContinuousAR = getAssignmentRuleYDependency(model, assignmentRuleOrder, key2var)        
+    isContinuousAR = getAssignmentRuleYDependency(model, assignmentRuleOrder, key2var, analysis)        
                 
     triggerCompDep = [False]*len(allTriggers)
     # trigger component dependencies
-    for i, t in enumerate(allTriggers):
-        l = t.getListOfNodes()
-        for j in range(l.getSize()):
-            node = l.get(j)
-            if node.isName():
-                nodeName = node.getName()
-                if nodeName in isContinuousAR:
-                    if isContinuousAR[nodeName] == True:
-                        triggerCompDep[i] = True
-                        break
-                elif nodeName in key2var:
-                    if key2var[nodeName]['vartype'] == 'sp_var':
-                        triggerCompDep[i] = True
-                        break
-                elif node.getType() == lsb.AST_NAME_TIME:
-                   triggerCompDep[i] = True
-                   break
+    for i, nodes in enumerate(analysis.triggerComponentNodes):
+        for nodeName, isTime in nodes:
+            if nodeName in isContinuousAR:
+                if isContinuousAR[nodeName] == True:
+                    triggerCompDep[i] = True
+                    break
+            elif nodeName in key2var:
+                if key2var[nodeName]['vartype'] == 'sp_var':
+                    triggerCompDep[i] = True
+                    break
+            elif isTime:
+               triggerCompDep[i] = True
+               break
     return triggerCompDep
 
+"""
+Find trigger components depending on time only, in the form of t <rel> T
+(or T <rel> t), where T depends neither on y nor on t. These switch at t = T
+and can be scheduled as stops of the solver instead of root finding.
+Returns a list with one item per trigger component: None if not scheduled,
+otherwise (T, direction); direction is 1 if the component becomes true at T,
+-1 if it becomes false.
+"""
+def getTriggerTimeSchedule(model, assignmentRuleOrder, allTriggers, key2var, analysis = None):
+    if analysis is None:
+        analysis = ModelAnalysis(model, allTriggers)
+    
+    isContinuousAR = getAssignmentRuleYDependency(model, assignmentRuleOrder, key2var, analysis)
+    
+    def isConstant(math):
+        for nodeName, isTime in analysis.nodes(math):
+            if isTime or isContinuousAR.get(nodeName, False):
+                return False
+            if nodeName in key2var and key2var[nodeName]['vartype'] == 'sp_var':
+                return False
+        return True
+    
+    schedule = [None]*len(allTriggers)
+    for i, trigger in enumerate(allTriggers):
+        ro = trigger.getName()
+        if ro not in {'gt', 'geq', 'lt', 'leq'} or trigger.getNumChildren() != 2:
+            continue
+        # g = left - right for gt/geq, right - left for lt/leq
+        sign = 1 if ro in {'gt', 'geq'} else -1
+        left = trigger.getLeftChild()
+        right = trigger.getRightChild()
+        if left.getType() == lsb.AST_NAME_TIME and isConstant(right):
+            schedule[i] = (right, sign)
+        elif right.getType() == lsb.AST_NAME_TIME and isConstant(left):
+            schedule[i] = (left, -sign)
+    return schedule
+
 """
 Deprecated 
 initial assignment are now handled in getSourceFileInitialAssginment()
@@ -1818,7 +2769,9 @@ def processInitConditions(model, varlist, key2var, key2name, ODE_TIME_NAME,
 #
 ############################################################
 
-def getHeaderFileContent(class_name, name_space, use_hybrid):
+def getHeaderFileContent(class_name, name_space, use_hybrid, use_jacobian = False,
+                         use_folding = False, use_batch = False, use_pruning = False,
+                         use_stats = False):
     header = """#pragma once
 
 #include "CVODEBase.h"
@@ -1844,14 +2797,29 @@ public:
     template<class Archive>
     static void classSerialize(Archive & ar, const unsigned int  version);
 """
+    if use_jacobian:
+        header += """
+    //! analytic Jacobian of f
+    static int jac(realtype t, N_Vector y, N_Vector fy, SUNMatrix J, void *user_data,
+        N_Vector tmp1, N_Vector tmp2, N_Vector tmp3);"""
     if use_hybrid:
         header += """
     static double _QSP_weight;"""
-    header += """
+    if use_batch:
+        header += """
+    //! class parameters are per thread (checked by MolecularModelBatch)
+    static constexpr bool thread_local_parameters = true;
+private:
+    // parameters shared by all instances of this class in one thread
+    static thread_local state_type _class_parameter;
+public:"""
+    else:
+        header += """
 private:
     // parameters shared by all instances of this class
     static state_type _class_parameter;
-public:
+public:"""
+    header += """
     {0}();
     {0}(const {0}& c);
     ~{0}();
@@ -1871,9 +2839,26 @@ public:
 protected:
     void setupVariables(void);
     void setupEvents(void);
-    void initSolver(realtype t0);
+    void initSolver(realtype t0);"""
+    if use_jacobian:
+        header += """
+    void setupLinearSolver(void);"""
+    if use_folding:
+        header += """
+    //! evaluate invariant subexpressions of f
+    void update_precomputed(void);
+    //! invariant subexpressions of f, read as PRECOMP(k)
+    state_type _precomputed;"""
+    header += """
     void update_y_other(void);
-    bool triggerComponentEvaluate(int i, realtype t, bool curr);
+    bool triggerComponentEvaluate(int i, realtype t, bool curr);"""
+    if use_pruning:
+        header += """
+    //! next switching time of time-only trigger components
+    bool getNextTimeTrigger(realtype t, realtype& tNext);
+    //! switch time-only trigger components scheduled at t
+    void updateTimeTriggers(realtype t);"""
+    header += """
     //! evaluate one event trigger
     bool eventEvaluate(int i);
     //! execute one event
@@ -1881,7 +2866,12 @@ protected:
     //! unit conversion factor for species (y and non-y)
     realtype get_unit_conversion_species(int i) const;
     //! unit conversion foactor for non-species variables
-    realtype get_unit_conversion_nspvar(int i) const;
+    realtype get_unit_conversion_nspvar(int i) const;"""
+    if use_stats:
+        header += """
+    //! event id in solver statistics
+    std::string getEventName(int i) const;"""
+    header += """
 private:
     friend class boost::serialization::access;
     template<class Archive>
@@ -1958,8 +2948,9 @@ def getSourceFileMacro(class_name):
 
 
 
-def getSourceFileConstructor(class_name, use_hybrid, qsp_weight):
+def getSourceFileConstructor(class_name, use_hybrid, qsp_weight, use_stats = False):
     source = ""
+    stats = '\n    setSolverStats(true);' if use_stats else ''
     if use_hybrid:
         source += '#define {1} {0}::_QSP_weight\n\n'.format(class_name, QSP_WEIGHT_NAME)
         source += 'double {0}::_QSP_weight = {1};\n'.format(class_name, qsp_weight)
@@ -1971,19 +2962,19 @@ def getSourceFileConstructor(class_name, use_hybrid, qsp_weight):
     setupVariables();
     setupEvents();
     setupCVODE();
-    update_y_other();
+    update_y_other();{1}
 }}
-""".format(class_name)
+""".format(class_name, stats)
     source += """
 {0}::{0}(const {0}& c)
 {{
-    setupCVODE();
+    setupCVODE();{1}
 }}
 
 {0}::~{0}()
 {{
 }}
-""".format(class_name)
+""".format(class_name, stats)
     return source
 
 def getSourceFileInitSolver(class_name):
@@ -2012,9 +3003,10 @@ void {0}::initSolver(realtype t){{
     return source.format(class_name)
 
 def getSourceFileStaticParam(class_name, key2name, key2var, varlist,
-                             hybrid_elements, fname):
+                             hybrid_elements, fname, use_batch = False):
 
-    source = '\nstate_type {}::_class_parameter = state_type({}, {});\n'.format(class_name, len(varlist['p_const']), 0)
+    source = '\n{}state_type {}::_class_parameter = state_type({}, {});\n'.format(
+        'thread_local ' if use_batch else '', class_name, len(varlist['p_const']), 0)
     source += '\nvoid {}::setup_class_parameters(Param& param){{\n'.format(class_name)
     for i, key in enumerate(varlist['p_const']):
         e = key2name[key]
@@ -2101,7 +3093,9 @@ void {}::setup_instance_tolerance(Param& param){{
     source += '    }\n'
         
     source += '    int flag = CVodeSVtolerances(_cvode_mem, reltol, abstol);\n'
-    source += '    check_flag(&flag, "CVodeSVtolerances", 1);\n\n'
+    source += '    check_flag(&flag, "CVodeSVtolerances", 1);\n'
+    source += '    // solver keeps a copy\n'
+    source += '    N_VDestroy_Serial(abstol);\n\n'
     source += """    
     return;
 }
@@ -2154,14 +3148,23 @@ void {}::eval_init_assignment(void){{
 """
 Event setup
 """
-def getSourceFileEventSetup(class_name, model, allTriggers, triggerParser, translator):
+def getSourceFileEventSetup(class_name, model, allTriggers, triggerParser, translator,
+                            rootTriggers = None):
     source = 'void {}::setupEvents(void){{\n\n'.format(class_name)
 
     source += '    _nevent = {};\n'.format(model.getNumEvents())
-    source += '    _nroot = {};\n\n'.format(len(allTriggers))
+    if rootTriggers is None:
+        source += '    _nroot = {};\n\n'.format(len(allTriggers))
     
-    source += '    _trigger_element_type = std::vector<EVENT_TRIGGER_ELEM_TYPE>(_nroot, TRIGGER_NON_INSTANT);\n'
-    source += '    _trigger_element_satisfied = std::vector<bool>(_nroot, false);\n'
+        source += '    _trigger_element_type = std::vector<EVENT_TRIGGER_ELEM_TYPE>(_nroot, TRIGGER_NON_INSTANT);\n'
+        source += '    _trigger_element_satisfied = std::vector<bool>(_nroot, false);\n'
+    else:
+        source += '    _nroot = {};\n'.format(len(rootTriggers))
+        source += '    // trigger components in root finding; others are time-only or constant\n'
+        source += '    _root_trigger = {{{}}};\n\n'.format(', '.join(map(str, rootTriggers)))
+
+        source += '    _trigger_element_type = std::vector<EVENT_TRIGGER_ELEM_TYPE>({}, TRIGGER_NON_INSTANT);\n'.format(len(allTriggers))
+        source += '    _trigger_element_satisfied = std::vector<bool>({}, false);\n'.format(len(allTriggers))
     source += '    _event_triggered = std::vector<bool>(_nevent, false);\n\n'
     
     for i, trigger in enumerate(allTriggers):
@@ -2179,50 +3182,126 @@ def getSourceFileEventSetup(class_name, model, allTriggers, triggerParser, trans
     
     return source
 
+"""
+shared expression DAG of the ODE right hand side:
+assignment rules (in evaluation order) and reaction fluxes
+"""
+def getReactionCse(model, assignmentRuleOrder, fold = None):
+    cse = CommonSubexpressions()
+    for i in assignmentRuleOrder:
+        m = fold.ruleMath[i] if fold else model.getRule(i).getMath()
+        if m is not None:
+            cse.add(m)
+    for i in range(model.getNumReactions()):
+        cse.add(fold.kineticMath[i] if fold else model.getReaction(i).getKineticLaw().getMath())
+    cse.build()
+    return cse
+
+"""
+constant folding of the rhs: assignment rules, kinetic laws and 
+reciprocals of compartments of concentration species
+"""
+def getReactionFolding(model, assignmentRuleOrder, speciesStoichiometry,
+                       convert_unit, key2var):
+    def nameVariability(sid):
+        if sid in key2var:
+            if key2var[sid]['vartype'] == 'p_const':
+                return VARIABILITY_CLASS
+            elif key2var[sid]['vartype'] == 'nsp_var':
+                return VARIABILITY_INSTANCE
+        return VARIABILITY_TIME
+    fold = InvariantSubexpressions(nameVariability)
+    for i in assignmentRuleOrder:
+        ar = model.getRule(i)
+        fold.ruleMath[i] = fold.addRule(ar.getVariable(), ar.getMath())
+    for i in range(model.getNumReactions()):
+        fold.kineticMath[i] = fold.fold(model.getReaction(i).getKineticLaw().getMath())
+    if convert_unit:
+        for sp in model.getListOfSpecies():
+            if sp.getId() in speciesStoichiometry and not sp.getHasOnlySubstanceUnits():
+                comp = sp.getCompartment()
+                slot = fold.reciprocal(comp)
+                if slot is not None:
+                    fold.compReciprocal[comp] = slot
+    return fold
+
 """
 reactions
 abm: array of type bool. True if abm assumes part of the reaction
+cse: CommonSubexpressions of the right hand side (None: no elimination);
+    temporaries are defined right before the first statement using them
+fold: InvariantSubexpressions (None: no folding); invariant rules are
+    skipped and invariant subexpressions read from PRECOMP(k)
+analysis: ModelAnalysis of model, built if not provided
 """
 def getSourceFileReaction(class_name, model, assignmentRuleOrder, 
-                          speciesStoichiometry, convert_unit, key2var,hybrid_elements, trans, fname):
-    model_level = model.getLevel()
-    model_version = model.getVersion()
+                          speciesStoichiometry, convert_unit, key2var,hybrid_elements, trans, fname,
+                          cse = None, fold = None, analysis = None):
     source = """
 int {}::f(realtype t, N_Vector y, N_Vector ydot, void *user_data){{
 
 """.format(class_name)
     source += '    {0}* ptrOde = static_cast<{0}*>(user_data);\n\n'.format(class_name)
+    source += getReactionStatements(model, assignmentRuleOrder, speciesStoichiometry,
+                                    convert_unit, key2var, hybrid_elements, trans, fname,
+                                    cse, fold, analysis)
+    source += '    return(0);\n}'
+    return source
+
+"""
+stoichiometric coefficient in dydt: integers as before, others unchanged
+"""
+def stoicCoefficient(stoic):
+    a = abs(stoic)
+    return str(int(a)) if a == int(a) else repr(float(a))
+
+"""
+statements of f(): assignment rules, reaction fluxes and dydt,
+one level of indentation
+lhs: format of the derivative of species variable {}
+"""
+def getReactionStatements(model, assignmentRuleOrder, speciesStoichiometry,
+                          convert_unit, key2var, hybrid_elements, trans, fname,
+                          cse = None, fold = None, analysis = None, 
+                          lhs = 'NV_DATA_S(ydot)[{}]'):
+    if analysis is None:
+        analysis = ModelAnalysis(model)
+    if fold:
+        trans = fold.translator(trans)
+    exprTrans = trans
+    defined = set()
+    if cse:
+        exprTrans = CseTranslator(trans, cse)
+    source = ''
     # assignment rules
     source += '    //Assignment rules:\n\n'
     for i in assignmentRuleOrder:
         ar = model.getRule(i)
-        source += '    realtype {} = {};\n\n'.format(trans.fname(ar.getVariable()),
-                                                trans.mathToString(ar.getMath()))
+        m = fold.ruleMath[i] if fold else ar.getMath()
+        if m is None:
+            continue
+        if cse:
+            source += exprTrans.tempDefinitions(m, defined)
+            source += '    realtype {} = {};\n\n'.format(trans.fname(ar.getVariable()),
+                                                exprTrans.exprToString(m))
+        else:
+            source += '    realtype {} = {};\n\n'.format(trans.fname(ar.getVariable()),
+                                                trans.mathToString(m))
     # reaction flux
     source += '    //Reaction fluxes:\n\n'
     for i in range(model.getNumReactions()):
         r = model.getReaction(i)
         key = r.getId()
         k = r.getKineticLaw()
-        m = k.getMath()
-        ud = r.getKineticLaw().getDerivedUnitDefinition()
-        isSPT = ud.isVariantOfSubstancePerTime()
-        reactionFluxSPT =  trans.mathToString(m)
-        if convert_unit and not isSPT:
-            isSubstancePerVolTime = isVariantOfSubstancePerVolumeTime(ud, model_level, model_version)
-            if isSubstancePerVolTime:
-                sr = None
-                if len(r.getListOfProducts()):
-                    sr = r.getListOfProducts()[0]
-                elif len(r.getListOfReactants()):
-                    sr = r.getListOfReactants()[0]
-                if sr:
-                    sp = model.getElementBySId(sr.getSpecies())
-                    reactionFluxSPT = '(' + reactionFluxSPT + ')*{}'.format(trans.fname(sp.getCompartment()))
-                else:
-                    print('Error: no product or reactant in reaction {}. cannot determine compartment.'.format(i))
-            else:
-                print('Error: reaction {} is not substance per time nor substance per volume per time'.format(i)) 
+        m = fold.kineticMath[i] if fold else k.getMath()
+        if cse:
+            source += exprTrans.tempDefinitions(m, defined)
+            reactionFluxSPT = exprTrans.exprToString(m)
+        else:
+            reactionFluxSPT =  trans.mathToString(m)
+        comp = getReactionFluxCompartment(model, i, convert_unit, analysis)
+        if comp:
+            reactionFluxSPT = '(' + reactionFluxSPT + ')*{}'.format(trans.fname(comp))
         #if abm[i]:
         if key in hybrid_elements:
             reactionFluxSPT = '{} * ('.format(QSP_WEIGHT_NAME) + reactionFluxSPT + ')'
@@ -2238,43 +3317,337 @@ int {}::f(realtype t, N_Vector y, N_Vector ydot, void *user_data){{
             if not sp.getHasOnlySubstanceUnits():
                 isConcentration = True
             source += '    //d({})/dt\n'.format(fname(sid))
-            lhs = '    NV_DATA_S(ydot)[{}] = '.format(key2var[sid]['idx'])
+            left = '    {} = '.format(lhs.format(key2var[sid]['idx']))
             dydt = ''
             for i, (r, stoic) in enumerate(speciesStoichiometry[sid]):
                 pre = (' + '*(i!=0) if stoic > 0 else ' - ' ) + \
-                      ('{}*'.format(int(abs(stoic))) if abs(stoic) != 1 else '')
+                      ('{}*'.format(stoicCoefficient(stoic)) if abs(stoic) != 1 else '')
                 #y += '+({})*ReactionFlux{}'.format(stoic, r+1)
                 dydt += pre + 'ReactionFlux{}'.format(r+1)
             if convert_unit and isConcentration:
-                dydt = '1/{}*('.format(trans.fname(sp.getCompartment())) + dydt + ')'
-            source += (lhs+dydt) + ';\n\n'
-        
-    source += '    return(0);\n}'
+                comp = sp.getCompartment()
+                if fold and comp in fold.compReciprocal:
+                    dydt = '{}({})*('.format(PRECOMPUTED_MACRO, fold.compReciprocal[comp]) + dydt + ')'
+                else:
+                    dydt = '1/{}*('.format(trans.fname(comp)) + dydt + ')'
+            source += (left+dydt) + ';\n\n'
     return source
     
+"""
+update_precomputed(): evaluate invariant rules and subexpressions 
+of the rhs; trans: translator accessing member variables
+"""
+def getSourceFilePrecomputed(class_name, fold, trans):
+    source = '\nvoid {}::update_precomputed(void){{\n\n'.format(class_name)
+    source += '    _precomputed.resize({});\n\n'.format(fold.size)
+    source += '    //Invariant assignment rules:\n\n'
+    for var, (slot, math, _) in fold.rules.items():
+        source += '    realtype {} = {};\n'.format(trans.fname(var), trans.mathToString(math))
+        source += '    _precomputed[{}] = {};\n\n'.format(slot, trans.fname(var))
+    source += '    //Invariant subexpressions:\n\n'
+    for slot, math, _ in fold.exprs.values():
+        source += '    _precomputed[{}] = {};\n'.format(slot, trans.mathToString(math))
+    source += '\n    return;\n}\n'
+    return source
+
+"""
+compartment of a reaction whose kinetic law is in substance per volume 
+per time; the flux is multiplied by its size to give substance per time.
+None if no conversion is needed.
+analysis: ModelAnalysis holding the kinetic law units, built if not provided
+"""
+def getReactionFluxCompartment(model, i, convert_unit, analysis = None):
+    if analysis is None:
+        analysis = ModelAnalysis(model)
+    r = model.getReaction(i)
+    isSPT, isSubstancePerVolTime = analysis.fluxUnit[i]
+    if convert_unit and not isSPT:
+        if isSubstancePerVolTime:
+            sr = None
+            if len(r.getListOfProducts()):
+                sr = r.getListOfProducts()[0]
+            elif len(r.getListOfReactants()):
+                sr = r.getListOfReactants()[0]
+            if sr:
+                sp = model.getElementBySId(sr.getSpecies())
+                return sp.getCompartment()
+            else:
+                print('Error: no product or reactant in reaction {}. cannot determine compartment.'.format(i))
+        else:
+            print('Error: reaction {} is not substance per time nor substance per volume per time'.format(i)) 
+    return None
+
+"""
+Analytic Jacobian of the right hand side written by getSourceFileReaction.
+Assignment rules, reaction fluxes and dydt are differentiated with respect 
+to each species variable they depend on, directly or through other rules.
+The sparsity pattern follows from speciesStoichiometry: 
+d(dy_i/dt)/dy_j is nonzero if species i takes part in a reaction 
+whose flux depends on y_j.
+"""
+def getReactionJacobian(model, assignmentRuleOrder, speciesStoichiometry,
+                        convert_unit, key2var, key2name, hybrid_elements, analysis = None):
+    if analysis is None:
+        analysis = ModelAnalysis(model)
+    yIdx = {sid: v['idx'] for sid, v in key2var.items() if v['vartype'] == 'sp_var'}
+    jac = ReactionJacobian(len(yIdx))
+    build = AstDifferentiator(None)
+    # expression name -> {species sid: derivative temporary}
+    dtemps = {}
+
+    def names(math):
+        found = set()
+        stack = [math]
+        while stack:
+            node = stack.pop()
+            if node.isName():
+                found.add(node.getName())
+            for i in range(node.getNumChildren()):
+                stack.append(node.getChild(i))
+        return found
+
+    # species math depends on, sorted by index
+    def dependency(math):
+        dep = set()
+        for n in names(math):
+            if n in yIdx:
+                dep.add(n)
+            elif n in dtemps:
+                dep.update(dtemps[n])
+        return sorted(dep, key = yIdx.get)
+
+    def differentiate(math, sid):
+        def dname(node):
+            n = node.getName()
+            if n == sid:
+                return AstDifferentiator.number(1)
+            if sid in dtemps.get(n, {}):
+                return AstDifferentiator.name(dtemps[n][sid])
+            return None
+        return AstDifferentiator(dname).derivative(math)
+
+    # d(expression)/dy for all species it depends on, as temporaries
+    def addTemps(name, math, prefix, temps):
+        dtemps[name] = {}
+        for sid in dependency(math):
+            d = differentiate(math, sid)
+            if d is not None:
+                tmp = '{}{}_{}'.format(JAC_TEMP_PREFIX, prefix, yIdx[sid])
+                dtemps[name][sid] = tmp
+                temps.append((tmp, d))
+                jac.local_names.add(tmp)
+        return
+
+    # assignment rules
+    for i in assignmentRuleOrder:
+        ar = model.getRule(i)
+        var = ar.getVariable()
+        addTemps(var, ar.getMath(), 'AUX_VAR_{}'.format(key2name[var]['name']), jac.rules)
+
+    # reaction fluxes, in substance per time
+    fluxes = {}
+    for i in range(model.getNumReactions()):
+        r = model.getReaction(i)
+        m = r.getKineticLaw().getMath().deepCopy()
+        comp = getReactionFluxCompartment(model, i, convert_unit, analysis)
+        if comp:
+            m = build.mul([m, build.name(comp)])
+        if r.getId() in hybrid_elements:
+            m = build.mul([build.name(QSP_WEIGHT_NAME), m])
+        flux = 'ReactionFlux{}'.format(i+1)
+        fluxes[flux] = m
+        jac.local_names.add(flux)
+        addTemps(flux, m, flux, jac.fluxes)
+
+    # dydt, same form as in f()
+    for sp in model.getListOfSpecies():
+        sid = sp.getId()
+        if sid not in speciesStoichiometry or sid not in yIdx:
+            continue
+        dydt = None
+        for r, stoic in speciesStoichiometry[sid]:
+            coef = abs(stoic)
+            term = build.mul([build.number(coef), build.name('ReactionFlux{}'.format(r+1))])
+            dydt = build.add([dydt, term]) if stoic > 0 else build.sub(dydt, term)
+        if convert_unit and not sp.getHasOnlySubstanceUnits():
+            dydt = build.mul([build.div(build.number(1), build.name(sp.getCompartment())), dydt])
+        for sj in dependency(dydt):
+            d = differentiate(dydt, sj)
+            if d is not None:
+                jac.entries.append((yIdx[sid], yIdx[sj], d))
+    jac.entries.sort(key = lambda e: (e[1], e[0]))
+
+    # flux values appear in entries only through compartments depending on y
+    used = set()
+    for _, _, d in jac.entries:
+        used.update(names(d))
+    jac.flux_values = [(f, m) for f, m in fluxes.items() if f in used]
+    return jac
+
+"""
+preprocessor setup of the analytic Jacobian:
+linear solver (can be overridden with -DQSP_LINEAR_SOLVER=QSP_LS_...),
+matrix size and access to one Jacobian entry
+"""
+def getSourceFileJacobianMacro(jac, linear_solver):
+    mu, ml = jac.bandwidth()
+    solver_macro = {'dense': 'QSP_LS_DENSE', 'band': 'QSP_LS_BAND', 'klu': 'QSP_LS_KLU'}
+    source = """#define QSP_LS_DENSE 0
+#define QSP_LS_BAND 1
+#define QSP_LS_KLU 2
+#ifndef QSP_LINEAR_SOLVER
+#define QSP_LINEAR_SOLVER {0}
+#endif
+
+#define JAC_NNZ {1}
+#define JAC_MU {2}
+#define JAC_ML {3}
+
+#if QSP_LINEAR_SOLVER == QSP_LS_KLU
+#include <sunmatrix/sunmatrix_sparse.h>
+#include <sunlinsol/sunlinsol_klu.h>
+#define JAC_ENTRY(i, j, k) SM_DATA_S(J)[k]
+#elif QSP_LINEAR_SOLVER == QSP_LS_BAND
+#include <sunmatrix/sunmatrix_band.h>
+#include <sunlinsol/sunlinsol_band.h>
+#define JAC_ENTRY(i, j, k) SM_ELEMENT_B(J, i, j)
+#else
+#define JAC_ENTRY(i, j, k) SM_ELEMENT_D(J, i, j)
+#endif
+
+"""
+    return source.format(solver_macro[linear_solver], max(jac.nnz(), 1), mu, ml)
+
+# c++ array initializer, wrapped every n items
+def formatIndexArray(values, n = 20, indent = '        '):
+    lines = [', '.join(str(v) for v in values[i:i+n]) for i in range(0, len(values), n)]
+    return '{\n' + ',\n'.join(indent + l for l in lines) + '}'
+
+"""
+jac(): analytic Jacobian callback, and setupLinearSolver() attaching
+the matrix, linear solver and jac() to CVODE
+"""
+def getSourceFileJacobian(class_name, model, assignmentRuleOrder, jac, trans):
+    def fname(varName):
+        if varName in jac.local_names:
+            return varName
+        return trans.fname(varName)
+    jacTrans = AstTranslator(fname, trans.ASTNameToCppToken)
+    colptrs, rowvals = jac.pattern()
+
+    source = """
+
+int {0}::jac(realtype t, N_Vector y, N_Vector fy, SUNMatrix J, void *user_data,
+    N_Vector tmp1, N_Vector tmp2, N_Vector tmp3){{
+
+""".format(class_name)
+    source += '    {0}* ptrOde = static_cast<{0}*>(user_data);\n\n'.format(class_name)
+    source += '#if QSP_LINEAR_SOLVER == QSP_LS_KLU\n'
+    source += '    // sparsity pattern, compressed sparse column\n'
+    source += '    static const sunindextype colptrs[] = {};\n'.format(formatIndexArray(colptrs))
+    source += '    static const sunindextype rowvals[] = {};\n'.format(formatIndexArray(rowvals or [0]))
+    source += """    for (sunindextype j = 0; j <= {}; j++){{
+        SM_INDEXPTRS_S(J)[j] = colptrs[j];
+    }}
+    for (sunindextype k = 0; k < JAC_NNZ; k++){{
+        SM_INDEXVALS_S(J)[k] = rowvals[k];
+    }}
+#endif
+
+""".format(jac.neq)
+    source += '    //Assignment rules:\n\n'
+    for i in assignmentRuleOrder:
+        ar = model.getRule(i)
+        source += '    realtype {} = {};\n\n'.format(trans.fname(ar.getVariable()),
+                                                trans.mathToString(ar.getMath()))
+    if jac.flux_values:
+        source += '    //Reaction fluxes:\n\n'
+        for name, m in jac.flux_values:
+            source += '    realtype {} = {};\n\n'.format(name, jacTrans.mathToString(m))
+    source += '    //Derivatives of assignment rules:\n\n'
+    for name, d in jac.rules:
+        source += '    realtype {} = {};\n'.format(name, jacTrans.mathToString(d))
+    source += '\n    //Derivatives of reaction fluxes:\n\n'
+    for name, d in jac.fluxes:
+        source += '    realtype {} = {};\n'.format(name, jacTrans.mathToString(d))
+    source += '\n    //Jacobian entries:\n\n'
+    for k, (i, j, d) in enumerate(jac.entries):
+        source += '    JAC_ENTRY({}, {}, {}) = {};\n'.format(i, j, k, jacTrans.mathToString(d))
+    source += '\n    return(0);\n}\n'
+
+    source += """
+void {0}::setupLinearSolver(void){{
+
+    int flag;
+
+#if QSP_LINEAR_SOLVER == QSP_LS_KLU
+    _A = SUNSparseMatrix(_neq, _neq, JAC_NNZ, CSC_MAT);
+    check_flag((void *)_A, "SUNSparseMatrix", 0);
+    _LS = SUNLinSol_KLU(_y, _A);
+    check_flag((void *)_LS, "SUNLinSol_KLU", 0);
+#elif QSP_LINEAR_SOLVER == QSP_LS_BAND
+    _A = SUNBandMatrix(_neq, JAC_MU, JAC_ML);
+    check_flag((void *)_A, "SUNBandMatrix", 0);
+    _LS = SUNLinSol_Band(_y, _A);
+    check_flag((void *)_LS, "SUNLinSol_Band", 0);
+#else
+    _A = SUNDenseMatrix(_neq, _neq);
+    check_flag((void *)_A, "SUNDenseMatrix", 0);
+    _LS = SUNLinSol_Dense(_y, _A);
+    check_flag((void *)_LS, "SUNLinSol_Dense", 0);
+#endif
+
+    flag = CVodeSetLinearSolver(_cvode_mem, _LS, _A);
+    check_flag(&flag, "CVodeSetLinearSolver", 1);
+
+    /* analytic Jacobian instead of difference quotients */
+    flag = CVodeSetJacFn(_cvode_mem, jac);
+    check_flag(&flag, "CVodeSetJacFn", 1);
+
+    return;
+}}
+""".format(class_name)
+    return source
+
 """
 event rootfinding, evaluation and execution
 """
 def getSourceFileEventDetails(class_name, model, allTriggers, triggerCompDep, eventToTrigger,
                               assignmentRuleOrderTrigger, assignmentRuleOrderEA,
                               trans, transStatic, translatorInSim, transMember, 
-                              triggerParser):
-                            
+                              triggerParser, rootTriggers = None, timeSchedule = None,
+                              assignmentRuleOrderTriggerComp = None):
+    
+    # rules with variable names of the function they are evaluated in
+    def ruleStr(order, translator, idt = '    '):
+        s = ''
+        for i in order:
+            ar = model.getRule(i)
+            s += idt + 'realtype {} = {};\n\n'.format(translator.fname(ar.getVariable()),
+                                                translator.mathToString(ar.getMath()))
+        return s
+    
     # rootfinding
     source = '\nint {}::g(realtype t, N_Vector y, realtype *gout, void *user_data){{\n\n'.format(class_name)
     
     source += '    {0}* ptrOde = static_cast<{0}*>(user_data);\n\n'.format(class_name)
     
     source += '    //Assignment rules:\n\n'
-    for i in assignmentRuleOrderTrigger:
-        ar = model.getRule(i)
-        source += '    realtype {} = {};\n\n'.format(trans.fname(ar.getVariable()),
-                                                trans.mathToString(ar.getMath()))
+    if rootTriggers is None:
+        source += ruleStr(assignmentRuleOrderTrigger, transStatic)
                                                 
-    for i, trigger in enumerate(allTriggers):
-        rel, cs = triggerParser.parseComponentCondition(trigger, transStatic)
-        source += '    //{}\n'.format(trans.mathToString(trigger))
-        source += '    gout[{}] = {};\n\n'.format(i, cs if triggerCompDep[i] else 1)
+        for i, trigger in enumerate(allTriggers):
+            rel, cs = triggerParser.parseComponentCondition(trigger, transStatic)
+            source += '    //{}\n'.format(trans.mathToString(trigger))
+            source += '    gout[{}] = {};\n\n'.format(i, cs if triggerCompDep[i] else 1)
+    else:
+        # only rules of the root functions
+        required = {j for i in rootTriggers for j in assignmentRuleOrderTriggerComp[i]}
+        source += ruleStr([i for i in assignmentRuleOrderTrigger if i in required], transStatic)
+        for k, i in enumerate(rootTriggers):
+            rel, cs = triggerParser.parseComponentCondition(allTriggers[i], transStatic)
+            source += '    //{}\n'.format(trans.mathToString(allTriggers[i]))
+            source += '    gout[{}] = {};\n\n'.format(k, cs)
         
     source += '    return(0);\n}\n'
 
@@ -2289,13 +3662,16 @@ def getSourceFileEventDetails(class_name, model, allTriggers, triggerCompDep, ev
     source += '    bool eval = false;\n'
     
     source += '    //Assignment rules:\n\n'
-    for i in assignmentRuleOrderTrigger:
-        ar = model.getRule(i)
-        source += '    realtype {} = {};\n\n'.format(trans.fname(ar.getVariable()),
-                                                trans.mathToString(ar.getMath()))
+    if rootTriggers is None:
+        source += ruleStr(assignmentRuleOrderTrigger, translatorInSim)
     source += '    switch(i)\n    {\n'                                            
     for i, trigger in enumerate(allTriggers):
-        source += '    case {}:\n'.format(i)        
+        source += '    case {}:\n'.format(i)
+        idt = '        '
+        if rootTriggers is not None:
+            # only rules this component depends on
+            source += '    {\n'
+            source += ruleStr(assignmentRuleOrderTriggerComp[i], translatorInSim, idt)
         source += '        //{}\n'.format(trans.mathToString(trigger))        
         if triggerCompDep[i]:
             rel, cs = triggerParser.parseComponentCondition(trigger, translatorInSim)
@@ -2304,6 +3680,8 @@ def getSourceFileEventDetails(class_name, model, allTriggers, triggerCompDep, ev
             source += '        eval = {};\n'.format(translatorInSim.mathToString(trigger))
             source += '        discrete = true;\n'
         source += '        break;\n'
+        if rootTriggers is not None:
+            source += '    }\n'
     source += '    default:\n        break;\n    }\n'
     source += '    if (!discrete){\n        eval = diff == 0 ? curr : (diff > 0);\n    }\n'
 	   
@@ -2311,6 +3689,10 @@ def getSourceFileEventDetails(class_name, model, allTriggers, triggerCompDep, ev
 
     sourceFull += source
     
+    if rootTriggers is not None:
+        sourceFull += getSourceFileTimeTriggers(class_name, model, allTriggers, timeSchedule,
+                                                assignmentRuleOrderTriggerComp, trans, translatorInSim, ruleStr)
+    
     # event evaluation
     g = lambda x: 'getSatisfied({})'.format(x)
     source = '\nbool {}::eventEvaluate(int i) {{\n'.format(class_name)
@@ -2379,11 +3761,60 @@ def getSourceFileEventDetails(class_name, model, allTriggers, triggerCompDep, ev
     return sourceFull
     
 
+"""
+Time-only trigger components (root-function pruning): next switching time
+and switching at the scheduled time. T is recomputed in each function, so
+t is compared with T to a tolerance of a few units of roundoff: a component
+switches at a stop within the tolerance of T, and is not scheduled again.
+"""
+def getSourceFileTimeTriggers(class_name, model, allTriggers, timeSchedule,
+                              assignmentRuleOrderTriggerComp, trans, translatorInSim, ruleStr):
+    scheduled = [i for i in range(len(allTriggers)) if timeSchedule[i] is not None]
+    # rules of all scheduled components, in evaluation order
+    order = []
+    for i in scheduled:
+        order += [j for j in assignmentRuleOrderTriggerComp[i] if j not in order]
+    
+    source = '\nbool {}::getNextTimeTrigger(realtype t, realtype& tNext){{\n\n'.format(class_name)
+    source += '    bool found = false;\n'
+    source += '    realtype ts = 0;\n'
+    source += TIME_TRIGGER_TOL
+    source += '    //Assignment rules:\n\n'
+    source += ruleStr(order, translatorInSim)
+    for i in scheduled:
+        T, direction = timeSchedule[i]
+        source += '    //{}\n'.format(trans.mathToString(allTriggers[i]))
+        source += '    ts = {};\n'.format(translatorInSim.mathToString(T))
+        source += '    if (ts > t + tol && (!found || ts < tNext)){\n'
+        source += '        tNext = ts;\n'
+        source += '        found = true;\n'
+        source += '    }\n\n'
+    source += '    return found;\n}\n'
+    
+    source += '\nvoid {}::updateTimeTriggers(realtype t){{\n\n'.format(class_name)
+    source += TIME_TRIGGER_TOL
+    source += '    //Assignment rules:\n\n'
+    source += ruleStr(order, translatorInSim)
+    for i in scheduled:
+        T, direction = timeSchedule[i]
+        source += '    //{}\n'.format(trans.mathToString(allTriggers[i]))
+        source += '    if (std::fabs({} - t) <= tol){{\n'.format(translatorInSim.mathToString(T))
+        source += '        _trigger_element_satisfied[{}] = {};\n'.format(i, 'true' if direction > 0 else 'false')
+        source += '    }\n\n'
+    source += '    return;\n}\n'
+    return source
+
 """
 Header and output handling
 """    
 def getSourceFileHandleOutput(class_name, model, varlist, key2name, trans, translator, 
-                              assignmentRuleOrderExtraSpec):
+                              assignmentRuleOrderExtraSpec, const_scalor = False):
+    # constant arrays of scaling factors (std::vector if empty)
+    def scalorDeclaration(n):
+        if const_scalor and n:
+            return '    static const realtype scalor[] = {\n'
+        return '    static std::vector<realtype> scalor = {\n'
+
     source = '\nvoid {}::update_y_other(void){{\n\n'.format(class_name)
     for i in assignmentRuleOrderExtraSpec:
         ar = model.getRule(i)
@@ -2408,7 +3839,7 @@ def getSourceFileHandleOutput(class_name, model, varlist, key2name, trans, trans
     source += '    return s;\n}'
     
     source += '\nrealtype {}::get_unit_conversion_species(int i) const{{\n\n'.format(class_name)
-    source += '    static std::vector<realtype> scalor = {\n'
+    source += scalorDeclaration(len(varlist['sp_var']) + len(varlist['sp_other']))
     source += '        //sp_var\n'
     for i, sid in enumerate(varlist['sp_var']):
         source += '        {},\n'.format(key2name[sid]['scaling_use'])
@@ -2418,12 +3849,22 @@ def getSourceFileHandleOutput(class_name, model, varlist, key2name, trans, trans
     source += '    };\n    return scalor[i];\n}'
         
     source += '\nrealtype {}::get_unit_conversion_nspvar(int i) const{{\n\n'.format(class_name)
-    source += '    static std::vector<realtype> scalor = {\n'
+    source += scalorDeclaration(len(varlist['nsp_var']))
     for i, sid in enumerate(varlist['nsp_var']):
         source += '        {},\n'.format(key2name[sid]['scaling_use'])
     source += '    };\n    return scalor[i];\n}'
     return source
 
+# event ids as columns of solver statistics; event_<i> if an event has no id
+def getSourceFileSolverStats(class_name, model):
+    source = '\nstd::string {}::getEventName(int i) const{{\n\n'.format(class_name)
+    source += '    static const std::vector<std::string> name = {\n'
+    for i in range(model.getNumEvents()):
+        e = model.getEvent(i)
+        source += '        "{}",\n'.format(e.getId() if e.isSetId() else 'event_{}'.format(i))
+    source += '    };\n    return name[i];\n}\n'
+    return source
+
 def getParamSourceConetent(name_space, model, key2name):
     n_param = 0
     source = """#include "Param.h"
@@ -2509,3 +3950,415 @@ void Param::setupParam(){
 };
 """
     return source
+
+"""
+NumPy module (write_python)
+State arrays are stored variables-first, batch dimensions last:
+Y (species, ODE state), Q (non-species variables), P (class parameters).
+Each generated function evaluates a whole batch of parameter sets at once.
+"""
+def getPythonModuleHeader(class_name, use_hybrid, qsp_weight):
+    source = '''# -*- coding: utf-8 -*-
+"""
+{0}: NumPy model generated by sbml_cvode converter {1}
+
+State arrays are stored variables-first, batch dimensions last:
+    Y: species (ODE state), shape (NEQ, ...)
+    Q: non-species variables, shape (N_NSPVAR, ...)
+    P: class parameters, shape (N_PARAM, ...)
+pfile: values of the parameter file {0}_params.xml in the order of
+    PFILE_NAMES, shape (N_PFILE, ...); see read_pfile
+
+setup(pfile): P, Y, Q in SI units, initial assignments evaluated
+f(t, Y, P, Q): right hand side dY/dt
+g(t, Y, P, Q): root functions of the event trigger components
+trigger_components, event_evaluate, execute_event: event logic of the
+    C++ class {0}
+rhs(P, Q), jac_sparsity(batch): for scipy.integrate.solve_ivp with the
+    flattened batch Y.ravel() (events not handled)
+simulate(pfile, t): batch simulation with events, as CVODEBase::simOdeStep
+"""
+
+import numpy as np
+
+'''.format(class_name, CONVERTER_VERSION)
+    source += 'TRIGGER_NON_INSTANT = 0\nTRIGGER_EQ = 1\nTRIGGER_NEQ = 2\n\n'
+    source += 'SEC_PER_DAY = 86400\n\n'
+    if use_hybrid:
+        source += '{} = {}\n\n'.format(QSP_WEIGHT_NAME, qsp_weight)
+    return source
+
+"""
+sizes, names, parameter file layout and unit conversion
+pfile: list of (path, default value) of the parameter file
+"""
+def getPythonModuleVariables(key2name, key2var, varlist, pfile,
+                             id_reltol, id_abstol, hybrid_elements, fname):
+    # python list literal, n items per line
+    def listLiteral(items, n):
+        lines = [', '.join(items[i:i+n]) for i in range(0, len(items), n)]
+        return '[' + ''.join('\n    ' + l + ',' for l in lines) + ('\n]' if lines else ']')
+    def indexArray(keys):
+        return 'np.array({}, dtype=int)'.format(listLiteral(
+            [str(key2name[key]['init_id']) for key in keys], 20))
+    def scalingArray(keys):
+        return 'np.array({}, dtype=float)'.format(listLiteral(
+            [str(key2name[key]['scaling_use']) for key in keys], 5))
+    def nameList(keys):
+        return listLiteral(["'{}'".format(fname(key)) for key in keys], 1)
+
+    source = 'NEQ = {}\n'.format(len(varlist['sp_var']))
+    source += 'N_NSPVAR = {}\n'.format(len(varlist['nsp_var']))
+    source += 'N_PARAM = {}\n'.format(len(varlist['p_const']))
+    source += 'N_PFILE = {}\n\n'.format(len(pfile))
+
+    source += 'SPECIES = {}\n'.format(nameList(varlist['sp_var']))
+    source += 'NSPVAR = {}\n'.format(nameList(varlist['nsp_var']))
+    source += 'PARAMETERS = {}\n\n'.format(nameList(varlist['p_const']))
+
+    source += '#parameter file\n'
+    source += 'PFILE_NAMES = {}\n'.format(listLiteral(
+        ["'{}'".format(name) for name, value in pfile], 1))
+    source += 'PFILE_DEFAULT = np.array({}, dtype=float)\n'.format(listLiteral(
+        [str(value) for name, value in pfile], 5))
+    source += 'PFILE_START = 0\nPFILE_STEP = 1\nPFILE_NSTEP = 2\n'
+    source += 'PFILE_RELTOL = {}\nPFILE_ABSTOL = {}\n\n'.format(id_reltol, id_abstol)
+
+    source += '#position in parameter file and unit conversion\n'
+    source += 'SPECIES_PFILE = {}\n'.format(indexArray(varlist['sp_var']))
+    source += 'SPECIES_SCALING = {}\n'.format(scalingArray(varlist['sp_var']))
+    source += 'NSPVAR_PFILE = {}\n'.format(indexArray(varlist['nsp_var']))
+    source += 'NSPVAR_SCALING = {}\n'.format(scalingArray(varlist['nsp_var']))
+    source += 'PARAM_PFILE = {}\n'.format(indexArray(varlist['p_const']))
+    source += 'PARAM_SCALING = {}\n'.format(scalingArray(varlist['p_const']))
+    source += '#parameters scaled by {}\n'.format(QSP_WEIGHT_NAME)
+    source += 'PARAM_HYBRID = np.array({}, dtype=int)\n\n'.format(listLiteral(
+        [str(i) for i, key in enumerate(varlist['p_const']) if key in hybrid_elements], 20))
+    return source
+
+"""
+setup: class parameters, instance variables and initial assignments
+"""
+def getPythonModuleInitialAssignment(model, key2var, assignmentRuleOrderIA,
+                                     initialAssignmentOrder, use_hybrid, trans):
+    source = '''
+def setup(pfile):
+    pfile = np.asarray(pfile, dtype=float)
+    P = _column(PARAM_SCALING, pfile) * pfile[PARAM_PFILE]
+'''
+    if use_hybrid:
+        source += '    P[PARAM_HYBRID] *= {}\n'.format(QSP_WEIGHT_NAME)
+    source += '''    Y = _column(SPECIES_SCALING, pfile) * pfile[SPECIES_PFILE]
+    Q = _column(NSPVAR_SCALING, pfile) * pfile[NSPVAR_PFILE]
+    {} = pfile[PFILE_START]
+'''.format(ODE_TIME_NAME)
+    source += '    #Assignment Rules required before IA\n'
+    for i in assignmentRuleOrderIA:
+        ar = model.getRule(i)
+        source += '    {} = {}\n'.format(trans.fname(ar.getVariable()),
+                                         trans.mathToString(ar.getMath()))
+    source += '    #InitialAssignment\n'
+    for i in initialAssignmentOrder:
+        ia = model.getInitialAssignment(i)
+        sid = ia.getSymbol()
+        if sid in key2var:
+            source += '    {} = {}\n'.format(trans.fname(sid),
+                                             trans.mathToString(ia.getMath()))
+    source += '    return P, Y, Q\n'
+    return source
+
+"""
+right hand side, as getSourceFileReaction
+"""
+def getPythonModuleReaction(model, assignmentRuleOrder, speciesStoichiometry,
+                            convert_unit, key2var, hybrid_elements, trans, fname,
+                            analysis):
+    source = '''
+def f(t, Y, P, Q):
+    dY = np.zeros(np.shape(Y))
+'''
+    source += '    #Assignment rules:\n'
+    for i in assignmentRuleOrder:
+        ar = model.getRule(i)
+        source += '    {} = {}\n'.format(trans.fname(ar.getVariable()),
+                                         trans.mathToString(ar.getMath()))
+    source += '    #Reaction fluxes:\n'
+    for i in range(model.getNumReactions()):
+        r = model.getReaction(i)
+        reactionFluxSPT = trans.mathToString(r.getKineticLaw().getMath())
+        comp = getReactionFluxCompartment(model, i, convert_unit, analysis)
+        if comp:
+            reactionFluxSPT = '(' + reactionFluxSPT + ')*{}'.format(trans.fname(comp))
+        if r.getId() in hybrid_elements:
+            reactionFluxSPT = '{} * ('.format(QSP_WEIGHT_NAME) + reactionFluxSPT + ')'
+        source += '    ReactionFlux{} = {}\n'.format(i+1, reactionFluxSPT)
+    source += '    #dydt:\n'
+    for sp in model.getListOfSpecies():
+        sid = sp.getId()
+        if sid in speciesStoichiometry:
+            source += '    #d({})/dt\n'.format(fname(sid))
+            dydt = ''
+            for i, (r, stoic) in enumerate(speciesStoichiometry[sid]):
+                pre = (' + '*(i!=0) if stoic > 0 else ' - ' ) + \
+                      ('{}*'.format(stoicCoefficient(stoic)) if abs(stoic) != 1 else '')
+                dydt += pre + 'ReactionFlux{}'.format(r+1)
+            if convert_unit and not sp.getHasOnlySubstanceUnits():
+                dydt = '1/{}*('.format(trans.fname(sp.getCompartment())) + dydt + ')'
+            source += '    dY[{}] = {}\n'.format(key2var[sid]['idx'], dydt)
+    source += '    return dY\n'
+    return source
+
+"""
+events, as getSourceFileEventSetup and getSourceFileEventDetails
+"""
+def getPythonModuleEvents(model, allTriggers, triggerCompDep, eventToTrigger,
+                          assignmentRuleOrderTrigger, assignmentRuleOrderEA,
+                          translator, trans, triggerParser):
+    def ruleStr(order):
+        s = '    #Assignment rules:\n'
+        for i in order:
+            ar = model.getRule(i)
+            s += '    {} = {}\n'.format(trans.fname(ar.getVariable()),
+                                       trans.mathToString(ar.getMath()))
+        return s
+    batchShape = '({},) + np.shape(Y)[1:]'
+    
+    source = '\nN_ROOT = {}\nN_EVENT = {}\n'.format(len(allTriggers), model.getNumEvents())
+    source += 'ROOT_TYPE = np.array([{}], dtype=int)\n'.format(', '.join(
+        triggerParser.parseComponentCondition(trigger, trans)[0] for trigger in allTriggers))
+    source += 'EVENT_INITIAL = np.array([{}], dtype=bool)\n'.format(', '.join(
+        str(bool(e.getTrigger().getInitialValue())) for e in model.getListOfEvents()))
+    
+    # root finding
+    source += '\ndef g(t, Y, P, Q):\n'
+    source += '    G = np.empty({})\n'.format(batchShape.format('N_ROOT'))
+    source += ruleStr(assignmentRuleOrderTrigger)
+    for i, trigger in enumerate(allTriggers):
+        rel, cs = triggerParser.parseComponentCondition(trigger, trans)
+        source += '    #{}\n'.format(translator.mathToString(trigger))
+        source += '    G[{}] = {}\n'.format(i, cs if triggerCompDep[i] else 1)
+    source += '    return G\n'
+    
+    # trigger components, curr: current values
+    source += '\ndef trigger_components(t, Y, P, Q, curr):\n'
+    source += '    S = np.empty({}, dtype=bool)\n'.format(batchShape.format('N_ROOT'))
+    source += ruleStr(assignmentRuleOrderTrigger)
+    for i, trigger in enumerate(allTriggers):
+        source += '    #{}\n'.format(translator.mathToString(trigger))
+        if triggerCompDep[i]:
+            rel, cs = triggerParser.parseComponentCondition(trigger, trans)
+            source += '    S[{}] = _satisfied({}, curr[{}])\n'.format(i, cs, i)
+        else:
+            source += '    S[{}] = {}\n'.format(i, trans.mathToString(trigger))
+    source += '    return S\n'
+    
+    # events from satisfied trigger components
+    g = lambda x: 'S[{}]'.format(x)
+    source += '\ndef event_evaluate(S):\n'
+    source += '    V = np.empty((N_EVENT,) + np.shape(S)[1:], dtype=bool)\n'
+    for i, e in enumerate(model.getListOfEvents()):
+        s, c = triggerParser.parseTrigger(e.getTrigger().getMath())
+        source += '    V[{}] = {}\n'.format(i, s.format(*(map(g, eventToTrigger[i]))))
+    source += '    return V\n'
+    
+    # event assignments, for the members in mask (all if None)
+    source += '\ndef execute_event(i, t, Y, P, Q, mask = None):\n'
+    source += ruleStr(assignmentRuleOrderEA)
+    for i, e in enumerate(model.getListOfEvents()):
+        source += '    {} i == {}:\n'.format('if' if i == 0 else 'elif', i)
+        if e.getNumEventAssignments() == 0:
+            source += '        pass\n'
+        for ea in e.getListOfEventAssignments():
+            v = trans.fname(ea.getVariable())
+            source += '        {0} = _assign(mask, {0}, {1})\n'.format(v,
+                                                trans.mathToString(ea.getMath()))
+    source += '    return\n'
+    return source
+
+"""
+model independent part of the NumPy module: helpers, solve_ivp interface
+and the batch simulation with events
+"""
+def getPythonModuleSimulation():
+    source = '''
+#%% helpers
+
+# unit conversion factors as a column of the state arrays
+def _column(v, x):
+    return v.reshape(v.shape + (1,)*(np.ndim(x) - 1))
+
+# piecewise(value0, condition0, value1, condition1, ..., [otherwise])
+def piecewise(*args):
+    n = len(args) // 2
+    otherwise = args[-1] if len(args) % 2 else np.nan
+    conditions = [np.asarray(c, dtype=bool) for c in args[1:2*n:2]]
+    return np.select(conditions, args[0:2*n:2], otherwise)
+
+# trigger component: keep the current value while diff is 0
+def _satisfied(diff, curr):
+    return np.where(diff == 0, curr, diff > 0)
+
+# event assignment for the members in mask (all if mask is None)
+def _assign(mask, old, new):
+    if mask is None:
+        return new
+    return np.where(mask, new, old)
+
+# parameter file as array in the order of PFILE_NAMES;
+# for a batch: np.column_stack([read_pfile(f) for f in files])
+def read_pfile(filename):
+    import xml.etree.ElementTree as ET
+    root = ET.parse(filename).getroot()
+    pfile = PFILE_DEFAULT.copy()
+    for i, name in enumerate(PFILE_NAMES):
+        e = root.find('/'.join(name.split('.')[1:]))
+        if e is not None and e.text is not None:
+            pfile[i] = float(e.text)
+    return pfile
+
+#%% scipy.integrate interface
+
+# right hand side of the flattened batch Y.ravel(); P, Q as returned by setup
+def rhs(P, Q):
+    shape = (NEQ,) + np.shape(P)[1:]
+    def fun(t, y):
+        return f(t, y.reshape(shape), P, Q).ravel()
+    return fun
+
+# sparsity of the Jacobian of rhs: members of the batch are independent
+def jac_sparsity(batch):
+    import scipy.sparse
+    return scipy.sparse.kron(np.ones((NEQ, NEQ)), scipy.sparse.identity(batch),
+                             format='csc')
+
+#%% batch simulation
+
+ROOT_MAX_ITER = 100
+
+# sign change of root functions from g0 to g1; components at 0 in g0 are
+# ignored until they leave 0 (as CVODE does after a root)
+def _crossed(g0, g1):
+    return (g0 != 0) & (np.sign(g1) != np.sign(g0))
+
+# earliest root in (ta, tb] by bisection of the dense output sol
+# return: root time, state, direction of each root function (1, -1 or 0)
+def _locate_root(sol, ta, tb, g0, shape, P, Q):
+    lo, hi = ta, tb
+    y = sol(hi).reshape(shape)
+    g_hi = g(hi, y, P, Q)
+    for _ in range(ROOT_MAX_ITER):
+        if hi - lo <= 4 * np.finfo(float).eps * max(abs(lo), abs(hi), 1.0):
+            break
+        mid = 0.5 * (lo + hi)
+        y_mid = sol(mid).reshape(shape)
+        g_mid = g(mid, y_mid, P, Q)
+        if _crossed(g0, g_mid).any():
+            hi, y, g_hi = mid, y_mid, g_mid
+        else:
+            lo = mid
+    found = np.where(_crossed(g0, g_hi), np.where(g0 < 0, 1, -1), 0)
+    return hi, y, found
+
+# CVODEBase::updateTriggerComponentConditionsOnRoot
+def _update_on_root(found, S):
+    transient = (ROOT_TYPE != TRIGGER_NON_INSTANT)[:, None]
+    eq = (ROOT_TYPE == TRIGGER_EQ)[:, None]
+    S[...] = np.where(transient & (found != 0), eq, S)
+    S[...] = np.where(~transient & (found == 1), True, S)
+    S[...] = np.where(~transient & (found == -1), False, S)
+
+# CVODEBase::evaluateAllEvents, for the members in mask
+# return: members with an event executed
+def _evaluate_all_events(t, Y, P, Q, S, E, mask):
+    executed = np.zeros(mask.shape, dtype=bool)
+    V = event_evaluate(S)
+    for i in range(N_EVENT):
+        fire = V[i] & ~E[i] & mask
+        if fire.any():
+            execute_event(i, t, Y, P, Q, fire)
+            executed |= fire
+        E[i] = np.where(mask, V[i], E[i])
+    return executed
+
+# CVODEBase::resolveEvents, for the members in mask
+def _resolve_events(t, Y, P, Q, S, E, mask):
+    while mask.any():
+        S[...] = np.where(mask, trigger_components(t, Y, P, Q, S), S)
+        mask = _evaluate_all_events(t, Y, P, Q, S, E, mask)
+
+# CVODEBase::resetTransient, for the members in mask
+def _reset_transient(S, mask):
+    S[...] = np.where(mask & (ROOT_TYPE == TRIGGER_EQ)[:, None], False, S)
+    S[...] = np.where(mask & (ROOT_TYPE == TRIGGER_NEQ)[:, None], True, S)
+
+"""
+simulate a batch of parameter sets; events are resolved at the start of
+each output step and at roots of g, as in CVODEBase::simOdeStep.
+The batch shares the steps of one solver of the flattened state.
+pfile: (N_PFILE,) or (N_PFILE, batch), see read_pfile
+t: output times; default start + k * step days, k = 0, ..., n_step
+    (parameter file of the first member)
+method: name of a scipy.integrate OdeSolver, or the class
+rtol, atol: default from the parameter file (smallest rtol of the batch)
+return: t, species in the units of the parameter file at t,
+    shape (len(t), NEQ) or (len(t), NEQ, batch)
+"""
+def simulate(pfile, t = None, method = 'BDF', rtol = None, atol = None):
+    import scipy.integrate
+    pfile = np.asarray(pfile, dtype=float)
+    single = pfile.ndim == 1
+    if single:
+        pfile = pfile[:, None]
+    batch = pfile.shape[1]
+    if t is None:
+        n_step = int(pfile[PFILE_NSTEP, 0])
+        t = pfile[PFILE_START, 0] + SEC_PER_DAY * pfile[PFILE_STEP, 0] * np.arange(n_step + 1)
+    t = np.asarray(t, dtype=float)
+    if rtol is None:
+        rtol = np.min(pfile[PFILE_RELTOL])
+    if atol is None:
+        atol = (SPECIES_SCALING[:, None] * pfile[PFILE_ABSTOL][None, :]).ravel()
+    solver = getattr(scipy.integrate, method) if isinstance(method, str) else method
+    options = {}
+    if solver in (scipy.integrate.BDF, scipy.integrate.Radau):
+        options['jac_sparsity'] = jac_sparsity(batch)
+
+    P, Y, Q = setup(pfile)
+    shape = Y.shape
+    fun = rhs(P, Q)
+    S = np.zeros((N_ROOT, batch), dtype=bool)
+    E = np.repeat(EVENT_INITIAL[:, None], batch, axis=1)
+    everyone = np.ones(batch, dtype=bool)
+    out = np.empty((len(t),) + shape)
+    out[0] = Y
+    for k in range(1, len(t)):
+        t0, t1 = t[k-1], t[k]
+        _resolve_events(t0, Y, P, Q, S, E, everyone)
+        while t0 < t1:
+            ode = solver(fun, t0, Y.ravel(), t1, rtol=rtol, atol=atol, **options)
+            g0 = g(t0, Y, P, Q)
+            root = None
+            while ode.status == 'running':
+                message = ode.step()
+                if ode.status == 'failed':
+                    raise RuntimeError('t = {}: {}'.format(ode.t, message))
+                g1 = g(ode.t, ode.y.reshape(shape), P, Q)
+                if _crossed(g0, g1).any():
+                    root = _locate_root(ode.dense_output(), ode.t_old, ode.t, g0, shape, P, Q)
+                    break
+                g0 = g1
+            if root is None:
+                t0 = t1
+                Y[...] = ode.y.reshape(shape)
+            else:
+                t0, Y[...], found = root
+                _update_on_root(found, S)
+                executed = _evaluate_all_events(t0, Y, P, Q, S, E, everyone)
+                if executed.any():
+                    _resolve_events(t0, Y, P, Q, S, E, executed)
+                    _reset_transient(S, executed)
+        out[k] = Y
+    out /= _column(SPECIES_SCALING, out[0])
+    return t, (out[..., 0] if single else out)
+'''
+    return source
@@ -1,87 +1,24 @@
-import numpy
-import os
-import pandas as pd
-import geopandas
-import pysal
-import glob2 as glob
 import numpy as np
-import seaborn
-import contextily
 import matplotlib.pyplot as plt
-from sklearn.cluster import DBSCAN
-from matplotlib.collections import LineCollection
-from pointpats import centrography
-from pointpats import (distance_statistics,QStatistic,random,PointPattern)
+import spQSP_spatial as sps
 x0=242
 z0=242
 l=50
 result_dir = './snapShots/'
+# immune cells around cancer cells: same voxel, 8 neighbors, and the 8 voxels
+# two steps away along axes and diagonals
+ring_0 = [(0,0)]
+ring_1 = ring_0 + [(dx,dz) for dx in (-1,0,1) for dz in (-1,0,1) if (dx,dz) != (0,0)]
+ring_2 = ring_1 + [(dx,dz) for dx in (-2,0,2) for dz in (-2,0,2) if (dx,dz) != (0,0)]
+# all time points and slices, one table for this simulation
+stats = sps.neighborhood_stats_series(result_dir, [0,1,2], focal='cancer', target='immune',
+                                      window=(x0,z0,l), neighborhoods=[ring_0,ring_1,ring_2])
+stats.to_csv(sps.FILE_NEIGHBORHOOD_STATS, index=False)
 for k in range (60,61,60):
-    patient_spatial = pd.read_csv(result_dir+'score_{}.csv'.format(k))
-    l_0 = []
-    l_1 = []
-    l_2 = []
-    for y in range(5,6,1): 
-        patient_slice = patient_spatial.loc[patient_spatial['y'] == y]
-        cancer_cell = patient_slice.loc[patient_slice['Type'] == 1]
-        n=0
-        for i in range(len(cancer_cell)):
-            x = cancer_cell.iloc[i]['x']
-            z = cancer_cell.iloc[i]['z']
-            if (x > x0 and x < x0+l and z > z0 and z < z0+l):
-                n+=1
-                cell_0 = patient_slice.loc[(patient_slice['x'] == x) & (patient_slice['z'] == z)]
-                cell_1 = patient_slice.loc[(patient_slice['x'] == x) & (patient_slice['z'] == z+1)]
-                cell_2 = patient_slice.loc[(patient_slice['x'] == x) & (patient_slice['z'] == z-1)]
-                cell_3 = patient_slice.loc[(patient_slice['x'] == x+1) & (patient_slice['z'] == z)]
-                cell_4 = patient_slice.loc[(patient_slice['x'] == x+1) & (patient_slice['z'] == z-1)]
-                cell_5 = patient_slice.loc[(patient_slice['x'] == x+1) & (patient_slice['z'] == z+1)]
-                cell_6 = patient_slice.loc[(patient_slice['x'] == x-1) & (patient_slice['z'] == z)]
-                cell_7 = patient_slice.loc[(patient_slice['x'] == x-1) & (patient_slice['z'] == z-1)]
-                cell_8 = patient_slice.loc[(patient_slice['x'] == x-1) & (patient_slice['z'] == z+1)]
-                
-                cell_9 = patient_slice.loc[(patient_slice['x'] == x) & (patient_slice['z'] == z+2)]
-                cell_10 = patient_slice.loc[(patient_slice['x'] == x) & (patient_slice['z'] == z-2)]
-                cell_11 = patient_slice.loc[(patient_slice['x'] == x+2) & (patient_slice['z'] == z)]
-                cell_12 = patient_slice.loc[(patient_slice['x'] == x+2) & (patient_slice['z'] == z-2)]
-                cell_13 = patient_slice.loc[(patient_slice['x'] == x+2) & (patient_slice['z'] == z+2)]
-                cell_14 = patient_slice.loc[(patient_slice['x'] == x-2) & (patient_slice['z'] == z)]
-                cell_15 = patient_slice.loc[(patient_slice['x'] == x-2) & (patient_slice['z'] == z-2)]
-                cell_16 = patient_slice.loc[(patient_slice['x'] == x-2) & (patient_slice['z'] == z+2)]   
-            
-                d_0= cell_0.loc[cell_0['Type'] != 1]
-                d_1= cell_1.loc[cell_1['Type'] != 1]
-                d_2= cell_2.loc[cell_2['Type'] != 1]
-                d_3= cell_3.loc[cell_3['Type'] != 1]
-                d_4= cell_4.loc[cell_4['Type'] != 1]
-                d_5= cell_5.loc[cell_5['Type'] != 1]
-                d_6= cell_6.loc[cell_6['Type'] != 1]
-                d_7= cell_7.loc[cell_7['Type'] != 1]
-                d_8= cell_8.loc[cell_8['Type'] != 1]
-                
-                d_9= cell_9.loc[cell_9['Type'] != 1]
-                d_10= cell_10.loc[cell_10['Type'] != 1]
-                d_11= cell_11.loc[cell_11['Type'] != 1]
-                d_12= cell_12.loc[cell_12['Type'] != 1]
-                d_13= cell_13.loc[cell_13['Type'] != 1]
-                d_14= cell_14.loc[cell_14['Type'] != 1]                 
-                d_15= cell_15.loc[cell_15['Type'] != 1] 
-                d_16= cell_16.loc[cell_16['Type'] != 1]  
-    
-                n_0=len(d_0)
-                n_1=len(d_1)+len(d_2)+len(d_3)+len(d_4)+len(d_5)+len(d_6)+len(d_7)+len(d_8)
-                n_2=len(d_9)+len(d_10)+len(d_11)+len(d_12)+len(d_13)+len(d_14)+len(d_15)+len(d_16)
-                
-                n_0=n_0
-                n_1=n_0+n_1
-                n_2=n_1+n_2
-                
-                l_0.append(n_0)
-                l_1.append(n_1)
-                l_2.append(n_2)
-    L_0=np.mean(l_0)
-    L_1=np.mean(l_1)
-    L_2=np.mean(l_2)
+    s = stats.loc[(stats['t'] == k) & stats['y'].isin(range(5,6,1))]
+    # mean over all focal cells of the selected slices
+    n = s.groupby('r')['n_focal'].sum()
+    L_0, L_1, L_2 = (s['mean'].fillna(0)*s['n_focal']).groupby(s['r']).sum()/n
 R = np.arange(0,50.5,0.5)
 L = []
 for r in R:
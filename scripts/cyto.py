@@ -1,56 +1,115 @@
 #Required packages
-import csv
-import random
-import sys
 import os
 import shutil
 import argparse
-import sys
 import warnings
+from multiprocessing import Pool
 import pandas as pd
 import numpy as np
-from io import BytesIO
-from scipy import special
-
-#**************************Saving and generating folders*********************
-data_folder = "Tecplot/" 
-if not os.path.isdir(data_folder):
-	os.makedirs(data_folder)
-else:
-	warnings.warn("Folder {} already exists, so it is removed first an then made".format(data_folder))
-	shutil.rmtree(data_folder)
-	os.makedirs(data_folder)
-print('Saving data to '+ data_folder)
-#***************************Convert data***************************************
-num_index = 100
-step = 1
-SizeX = 100
-SizeY = 100
-SizeZ = 100
-nc=SizeX*SizeY*SizeZ 
-f1 = open(data_folder+"grid.dat", "w")
-f1.write("TITLE = \"Scalar Field\"\n")
-f1.write("VARIABLES = \"x\", \"y\", \"z\"\n")
-f1.write("Zone T = \"Frame 0\", I = {}, J = {}, K = {}\n".format(SizeX+1,SizeY+1,SizeZ+1))
-for k in range(SizeZ+1):
-	for j in range(SizeY+1):
-		for i in range(SizeX+1):
-				f1.write("{} {} {}\n".format(i,j,k))
-f1.close()
-for kk in range (0, num_index+1, step):
-	num = 0
-	core= pd.read_csv("snapShots/"+"cyto_"+str(kk)+".csv")
-	f1 = open(data_folder+"cyto_"+str(kk)+".dat", "w")
-	f1.write("TITLE = \"Scalar Field\"\n")
-	f1.write("VARIABLES = \"x\", \"y\", \"z\", \"IFNg\", \"IL2\"\n")
-	f1.write("Zone T = \"Frame 0\", I = {}, J = {}, K = {}\n".format(SizeX,SizeY,SizeZ))
-	for k in range(SizeZ):
-		for j in range(SizeY):
-			for i in range(SizeX):
-				f1.write("{} {} {} {} {}\n".format(i+0.5,j+0.5,k+0.5,core.iloc[num,0],core.iloc[num,1]))
-				#f2.write("{} {} {} {} {}\n".format(i,j,k,margin.iloc[num,0],margin.iloc[num,1]))
-				num=num+1
-	f1.close()
+import spQSP_snapshot_store as sss
 
+#**************************Reading cytokine grids******************************
+# voxel values of cyto_<k>.csv as a (n_voxel, n_substrate) array, x index running fastest
+def read_cyto(snap_dir, k):
+	if sss.has_store(snap_dir):
+		store = sss.snapshot_store(snap_dir)
+		if k in store.times(sss.PREFIX_CYTO):
+			return store.columns(sss.PREFIX_CYTO, k), np.column_stack(
+				list(store.get(sss.PREFIX_CYTO, k).values()))
+	core = pd.read_csv(os.path.join(snap_dir, "cyto_"+str(k)+".csv"))
+	return list(core.columns), core.to_numpy(dtype=float)
 
+# grid size from the number of voxels; a cubic grid unless given explicitly
+def get_grid_size(nr_voxel, size=None):
+	if size is not None:
+		assert np.prod(size) == nr_voxel, "grid size {} does not match {} voxels".format(size, nr_voxel)
+		return tuple(size)
+	n = int(round(nr_voxel ** (1/3)))
+	assert n**3 == nr_voxel, "grid size required for {} voxels (not a cube)".format(nr_voxel)
+	return (n, n, n)
 
+#**************************Tecplot (ASCII) *************************************
+# write a block of rows in bulk; one formatted write per file instead of per voxel
+def write_rows(f, rows):
+	pd.DataFrame(rows).to_csv(f, sep=" ", header=False, index=False)
+
+def write_tecplot_grid(filename, SizeX, SizeY, SizeZ):
+	k, j, i = np.meshgrid(np.arange(SizeZ+1), np.arange(SizeY+1), np.arange(SizeX+1), indexing="ij")
+	with open(filename, "w") as f1:
+		f1.write("TITLE = \"Scalar Field\"\n")
+		f1.write("VARIABLES = \"x\", \"y\", \"z\"\n")
+		f1.write("Zone T = \"Frame 0\", I = {}, J = {}, K = {}\n".format(SizeX+1,SizeY+1,SizeZ+1))
+		write_rows(f1, np.column_stack([i.ravel(), j.ravel(), k.ravel()]))
+
+def write_tecplot_frame(filename, names, values, SizeX, SizeY, SizeZ):
+	k, j, i = np.meshgrid(np.arange(SizeZ), np.arange(SizeY), np.arange(SizeX), indexing="ij")
+	with open(filename, "w") as f1:
+		f1.write("TITLE = \"Scalar Field\"\n")
+		f1.write("VARIABLES = \"x\", \"y\", \"z\", {}\n".format(", ".join("\"{}\"".format(n) for n in names)))
+		f1.write("Zone T = \"Frame 0\", I = {}, J = {}, K = {}\n".format(SizeX,SizeY,SizeZ))
+		write_rows(f1, np.column_stack([i.ravel()+0.5, j.ravel()+0.5, k.ravel()+0.5, values]))
+
+#**************************VTK image data (binary) ******************************
+def write_vti_frame(filename, names, values, SizeX, SizeY, SizeZ):
+	extent = "0 {} 0 {} 0 {}".format(SizeX, SizeY, SizeZ)
+	blocks = [np.ascontiguousarray(values[:, n], dtype="<f8").tobytes() for n in range(len(names))]
+	arrays = []
+	offset = 0
+	for name, b in zip(names, blocks):
+		arrays.append("        <DataArray type=\"Float64\" Name=\"{}\" format=\"appended\" offset=\"{}\"/>\n".format(name, offset))
+		offset += 8 + len(b)
+	with open(filename, "wb") as f1:
+		f1.write(("<?xml version=\"1.0\"?>\n"
+			"<VTKFile type=\"ImageData\" version=\"1.0\" byte_order=\"LittleEndian\" header_type=\"UInt64\">\n"
+			"  <ImageData WholeExtent=\"{0}\" Origin=\"0 0 0\" Spacing=\"1 1 1\">\n"
+			"    <Piece Extent=\"{0}\">\n"
+			"      <CellData Scalars=\"{1}\">\n"
+			"{2}"
+			"      </CellData>\n"
+			"    </Piece>\n"
+			"  </ImageData>\n"
+			"  <AppendedData encoding=\"raw\">\n_").format(extent, names[0], "".join(arrays)).encode())
+		for b in blocks:
+			f1.write(np.uint64(len(b)).tobytes())
+			f1.write(b)
+		f1.write(b"\n  </AppendedData>\n</VTKFile>\n")
+
+#**************************Convert data***************************************
+def convert_frame(args):
+	snap_dir, data_folder, kk, fmt, size = args
+	names, values = read_cyto(snap_dir, kk)
+	SizeX, SizeY, SizeZ = get_grid_size(len(values), size)
+	if fmt == "vti":
+		write_vti_frame(data_folder+"cyto_"+str(kk)+".vti", names, values, SizeX, SizeY, SizeZ)
+	else:
+		write_tecplot_frame(data_folder+"cyto_"+str(kk)+".dat", names, values, SizeX, SizeY, SizeZ)
+	return SizeX, SizeY, SizeZ
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Export cytokine grids (cyto_<k>.csv) to Tecplot or VTK")
+	parser.add_argument("--snapdir", default="snapShots/")
+	parser.add_argument("--out", default="Tecplot/")
+	parser.add_argument("--format", choices=["tecplot", "vti"], default="tecplot")
+	parser.add_argument("--num_index", type=int, default=100)
+	parser.add_argument("--step", type=int, default=1)
+	parser.add_argument("--size", type=int, nargs=3, default=None, help="SizeX SizeY SizeZ; cubic grid inferred from file when omitted")
+	parser.add_argument("--workers", type=int, default=os.cpu_count())
+	args = parser.parse_args()
+
+	#**************************Saving and generating folders*********************
+	data_folder = os.path.join(args.out, "")
+	if not os.path.isdir(data_folder):
+		os.makedirs(data_folder)
+	else:
+		warnings.warn("Folder {} already exists, so it is removed first an then made".format(data_folder))
+		shutil.rmtree(data_folder)
+		os.makedirs(data_folder)
+	print('Saving data to '+ data_folder)
+
+	jobs = [(args.snapdir, data_folder, kk, args.format, args.size)
+		for kk in range(0, args.num_index+1, args.step)]
+	with Pool(max(1, min(args.workers, len(jobs)))) as pool:
+		sizes = pool.map(convert_frame, jobs)
+	# node coordinates shared by all Tecplot frames
+	if args.format == "tecplot" and sizes:
+		write_tecplot_grid(data_folder+"grid.dat", *sizes[0])
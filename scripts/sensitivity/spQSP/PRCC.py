@@ -4,14 +4,74 @@ Created on Mon Feb 24 07:56:49 2020
 @author: Chang Gong
 
 Adapted from Matlab code published in the following paper:
-Marino, Simeone, Ian B. Hogue, Christian J. Ray, and Denise E. Kirschner. 
-"A methodology for performing global uncertainty and sensitivity analysis 
+Marino, Simeone, Ian B. Hogue, Christian J. Ray, and Denise E. Kirschner.
+"A methodology for performing global uncertainty and sensitivity analysis
 in systems biology." Journal of theoretical biology 254, no. 1 (2008): 178-196.
 
+Partial correlations are computed in NumPy (previously MATLAB partialcorr):
+rank transform once, then all k x m coefficients from the inverse of the
+parameter correlation matrix.
 """
 
 import numpy as np
-import matlab.engine
+from scipy import stats
+
+TYPES = ['Spearman', 'Pearson']
+MTC_METHODS = [None, 'Bonferroni', 'FDR']
+
+# check inputs; res as n x m
+def _check_input(LHS, res, Type):
+    if Type not in TYPES:
+        raise ValueError('mode should be either "Spearman" for rank correlation or "Pearson" for linear correlation')
+    LHS = np.asarray(LHS, dtype=float)
+    res = np.asarray(res, dtype=float)
+    if res.shape[0] != LHS.shape[0]:
+        raise ValueError('X and Y should have the same number of rows')
+    if res.ndim == 1:
+        res = res.reshape((-1, 1))
+    return LHS, res
+
+# drop rows with nan in any column ('Rows', 'complete'), rank if Spearman
+def _transform(LHS, res, Type):
+    rows = ~(np.isnan(LHS).any(axis=1) | np.isnan(res).any(axis=1))
+    LHS = LHS[rows]
+    res = res[rows]
+    if Type == 'Spearman':
+        # average rank for ties, as tiedrank
+        LHS = stats.rankdata(LHS, axis=0)
+        res = stats.rankdata(res, axis=0)
+    return LHS, res
+
+# partial correlation of each result with each parameter, controlling for
+# the other parameters. With C = corr(LHS), c = corr(LHS, res[:, j]) and
+# b = inv(C) c, the (i, j) entry of the inverse of the joint correlation
+# matrix gives rho = b_i / sqrt(inv(C)_ii (1 - c.b) + b_i^2)
+def _partial_corr(X, Y):
+    k = X.shape[1]
+    R = np.corrcoef(np.concatenate((X, Y), axis=1), rowvar=False)
+    C_inv = np.linalg.inv(R[:k, :k])
+    B = C_inv @ R[:k, k:]
+    s = 1 - np.sum(R[:k, k:] * B, axis=0)
+    Rho = B / np.sqrt(np.diag(C_inv)[:, None] * s[None, :] + B**2)
+    return np.clip(Rho, -1, 1)
+
+# two-sided p-value of partial correlations, t-test with n-2-(k-1) dof
+def _pval(Rho, n, k):
+    df = max(n - 2 - (k - 1), 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = Rho * np.sqrt(df / (1 - Rho**2))
+    return 2 * stats.t.sf(np.abs(t), df)
+
+# Benjamini-Hochberg adjusted p-values over all entries
+def _fdr(Pval):
+    p = Pval.ravel()
+    N = len(p)
+    order = np.argsort(p)
+    adj = p[order] * N / np.arange(1, N+1)
+    adj = np.minimum.accumulate(adj[::-1])[::-1]
+    Pval_correct = np.empty(N)
+    Pval_correct[order] = np.minimum(adj, 1)
+    return Pval_correct.reshape(Pval.shape)
 
 """
 Calculate partial correlation between parameters and results
@@ -19,8 +79,9 @@ n simulations, k parameters, m results
 LHS: parameter values, n x k
 res: simulation results, n x m
 alpha: significance level
-Type = ['Spearman' (default) |'Pearson']: rank/linear correlation 
-MTC: multiple testing correction, [None (default)|'Bonferroni']
+Type = ['Spearman' (default) |'Pearson']: rank/linear correlation
+MTC: multiple testing correction, [None (default)|'Bonferroni'|'FDR']
+rows with nan in LHS or res are excluded
 
 output:
 Rho: partial correlation, k x m
@@ -31,70 +92,78 @@ Pval_corrected: after multiple testing correction
 """
 def partial_corr(LHS, res, alpha, Type = 'Spearman', MTC = None):
 
-    if Type not in ['Spearman', 'Pearson']:
-        raise ValueError('mode should be either "Spearman" for rank correlation or "Pearson" for linear correlation')
-    
-    n, k = LHS.shape
-    n2 = res.shape[0]
-    if n2 != n:
-        raise ValueError('X and Y should have the same number of rows')
-    
-    if len(res.shape) == 1:
-        res = res.reshape((-1, 1))
-    m = res.shape[1]
-    
-    Rho = np.zeros((k, m))
-    Pval = np.zeros((k, m))
-    
-    eng = matlab.engine.start_matlab()
-    
-    x = matlab.double(res.tolist())
-
-    for i in range(k):
-        idx = np.asarray(k * [True])
-        idx[i] = False
-        y = matlab.double(LHS[:, [i]].tolist())
-        z = matlab.double(LHS[:, idx].tolist())
-        rho, pval = eng.partialcorr(x, y, z, 'Type', Type, 'Rows','complete', nargout = 2)
-        #print(rho)
-        Rho[i, :] = np.array(rho).T
-        Pval[i, :] = np.array(pval).T
-    
-    eng.quit()
-    
+    if MTC not in MTC_METHODS:
+        raise ValueError('Unknown MTC method: ' + str(MTC))
+
+    LHS, res = _check_input(LHS, res, Type)
+    X, Y = _transform(LHS, res, Type)
+    n, k = X.shape
+    m = Y.shape[1]
+
+    Rho = _partial_corr(X, Y)
+    Pval = _pval(Rho, n, k)
+
     # Multiple testing correction: Bonferroni and FDR
-    Sig = np.zeros((k, m), dtype=bool)
     Pval_correct = Pval
-    
+
     if MTC is None:
         Sig = Pval < alpha
     elif MTC == 'Bonferroni':
         Pval_correct = Pval * m * k
-        Sig = Pval_correct  < alpha 
+        Sig = Pval_correct  < alpha
     else:
-        raise ValueError('Unknown MTC method: ' + MTC)
-    
-    
+        Pval_correct = _fdr(Pval)
+        Sig = Pval_correct < alpha
+
     return Rho, Pval, Sig, Pval_correct
+
+"""
+Bootstrap confidence interval of the partial correlations
+LHS, res, Type: as partial_corr
+n_boot: number of resamples (rows drawn with replacement)
+ci: confidence level
+seed: random seed or np.random.Generator
+
+output:
+Rho_low, Rho_high: percentile interval, k x m
+"""
+def bootstrap_ci(LHS, res, Type = 'Spearman', n_boot = 1000, ci = 0.95, seed = None):
+
+    LHS, res = _check_input(LHS, res, Type)
+    rows = ~(np.isnan(LHS).any(axis=1) | np.isnan(res).any(axis=1))
+    LHS = LHS[rows]
+    res = res[rows]
+    n, k = LHS.shape
+    m = res.shape[1]
+
+    rng = np.random.default_rng(seed)
+    Rho_boot = np.zeros((n_boot, k, m))
+    for b in range(n_boot):
+        idx = rng.integers(0, n, n)
+        X, Y = _transform(LHS[idx], res[idx], Type)
+        Rho_boot[b] = _partial_corr(X, Y)
+
+    q = 100 * (1 - ci) / 2
+    Rho_low, Rho_high = np.nanpercentile(Rho_boot, [q, 100 - q], axis=0)
+    return Rho_low, Rho_high
 #%%
 
-# example: using matlab hospital data
+# example: outputs depending on a subset of parameters
 if (__name__ == '__main__'):
-    
-    # "hospital" dataset from matlab
-    eng = matlab.engine.start_matlab()
-    hospital  = eng.load('hospital')['hospital']
-    sexID = np.array(eng.grp2idx(eng.getfield(hospital, 'Sex')))
-    age = np.array(eng.getfield(hospital, 'Age'))
-    smoker = np.array(eng.getfield(hospital, 'Smoker'))
-    weight = np.array(eng.getfield(hospital, 'Weight'))
-    bloodpressure = np.array(eng.getfield(hospital, 'BloodPressure'))
-    eng.quit()
-    
+
+    rng = np.random.default_rng(0)
+    n = 500
+    # parameters: 4 uniform samples
+    Y = rng.uniform(size=(n, 4))
+    # results: monotone in parameter 0 and 1, independent of 2 and 3
+    X = np.column_stack((np.exp(3*Y[:, 0]) - 5*Y[:, 1],
+                         Y[:, 1]**3)) + 0.1*rng.normal(size=(n, 2))
+
     # PRCC
-    X = bloodpressure
-    Y = np.concatenate((weight, age, sexID, smoker), axis = 1)
-    Rho, Pval, Sig, Pval_correct = partial_corr(Y, X, 1e-14, MTC='Bonferroni')
+    Rho, Pval, Sig, Pval_correct = partial_corr(Y, X, 1e-3, MTC='Bonferroni')
     print(np.array(Rho))
-    
-    
\ No newline at end of file
+    print(Sig)
+    Rho_low, Rho_high = bootstrap_ci(Y, X, n_boot=200, seed=0)
+    print(np.array(Rho_low))
+    print(np.array(Rho_high))
+
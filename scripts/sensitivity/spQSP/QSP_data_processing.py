@@ -8,9 +8,11 @@ Created on Wed Jul 29 09:07:38 2020
 """
 
 import numpy as np
+import pandas as pd
 
 import re
 import lxml.etree as ET
+from multiprocessing import Pool
 
 import QSP_analysis as qa
 import QSP_db as qdb
@@ -20,6 +22,8 @@ import matplotlib.pyplot as plt
 TAG_QSP_IC_SUCCESS = 'QSP_IC_SUCCESS'
 TAG_QSP_IC_FAILURE = 'QSP_IC_FAILURE'
 TAG_ABM_SIM_SUCCESS = 'SIMULATION_SUCCESS'
+# solver statistics of the QSP module (sidecar of the QSP output, optional)
+SOLVER_STATS_PATTERN = 'solver_stats*.csv'
 
 SEC_PER_DAY = 24*3600
 MIN_ABM_CC = 1000
@@ -42,10 +46,10 @@ def get_param_id(db, group, sample):
     return None if not param_id_list else param_id_list[0][0]
 
 def get_sim_id(db, group, sample, treatment, rep):
-    param_id = get_param_id(db, group, sample)
-    condition = 'WHERE parameter_id = {} AND treatment_id = {} AND replication_id = {}'\
-        .format(param_id, treatment, rep)
-    sim_id_list = db.fetch(qdb.TABLE_NAME_SIM, ['UID'], condition)
+    cmd = 'SELECT s.UID FROM {} AS s JOIN {} AS p ON s.parameter_id = p.UID '\
+        'WHERE p.group_id = ? AND p.sample_id = ? AND s.treatment_id = ? AND s.replication_id = ?'\
+        .format(qdb.TABLE_NAME_SIM, qdb.TABLE_NAME_PARAM)
+    sim_id_list = db.query(cmd, (group, sample, treatment, rep))
     return None if not sim_id_list else sim_id_list[0][0]
 
 # save LHS parameter values to database
@@ -55,62 +59,187 @@ def archive_param(param_dir, db, group):
     header, data = qa.read_csv(filename_lhs)
     cols_param = db.get_colnames(qdb.TABLE_NAME_PARAM)[1:]
     
-    for i, row in enumerate(data):
-        if get_param_id(db, group, row[0]) is None:
-            values = [str(group)] + list(row)
-            db.add_entry(qdb.TABLE_NAME_PARAM, cols_param, values)
-    db.commit()
+    # samples of this group already archived
+    condition = 'WHERE group_id = {}'.format(group)
+    archived = set(r[0] for r in db.fetch(qdb.TABLE_NAME_PARAM, ['sample_id'], condition))
+    rows = [[group, int(row[0])] + data[i, 1:].astype(float).tolist()
+            for i, row in enumerate(data) if int(row[0]) not in archived]
+    with db.transaction():
+        db.add_entries(qdb.TABLE_NAME_PARAM, cols_param, rows)
     return
 
+# read solver statistics of one simulation directory
+# return: column names (first: time) and rows; None if not collected
+def read_solver_stats(sim_dir):
+    stats_files = list(sim_dir.glob(SOLVER_STATS_PATTERN))
+    if not stats_files:
+        return None
+    header, data = qa.read_csv(str(stats_files[0]))
+    data = np.nan_to_num(data.astype(float)).reshape(-1, len(header))
+    return ['time'] + header[1:], data.tolist()
+
+# create the solver statistics table from the columns of a statistics file:
+# sim_id, time, wall time and counters; columns of events not yet in the table are added
+def create_solver_table(db, header):
+    col_type = [qdb.TYPE_INT] + [qdb.TYPE_FLOAT]*2 + [qdb.TYPE_INT]*(len(header)-2)
+    db.create_table(qdb.TABLE_NAME_SOLVER, ['sim_id'] + header, col_type)
+    cols = db.get_colnames(qdb.TABLE_NAME_SOLVER)
+    for c in header:
+        if c not in cols:
+            db.c.execute('ALTER TABLE {} ADD COLUMN [{}] {}'.format(qdb.TABLE_NAME_SOLVER, c, qdb.TYPE_INT))
+    return
+
+# read QSP and ABM stats files of one simulation directory
+# return: QSP rows, ABM rows per window (lists of float lists),
+# and solver statistics (read_solver_stats)
+def read_sim_result(sim_dir, windows=['margin','core']):
+    # QSP
+    qsp_files = list(sim_dir.glob('QSP*.csv'))
+    assert len(qsp_files)==1, 'QSP stats file not found in {}'.format(str(sim_dir))
+        
+    filename_qsp = str(qsp_files[0])
+    
+    header, data = qa.read_csv(filename_qsp)
+    data_qsp = np.nan_to_num(data.astype(float)).tolist()
+        
+    # ABM core/margin
+    data_abm = {}
+    for window in windows:
+        stats_file_pattern='stats_{}*.csv'.format(window)
+        filename_core_abm = [str(f) for f in sim_dir.glob(stats_file_pattern)][0]
+        header, data = qa.read_csv(filename_core_abm)
+        data_abm[window] = np.nan_to_num(data.astype(float)).tolist()
+    return data_qsp, data_abm, read_solver_stats(sim_dir)
+
+# write one simulation and its QSP/ABM rows (and solver statistics, if any)
+# in a single transaction
+# return: simulation id
+def write_sim_result(db, param_id, treat, rep, data_qsp, data_abm, data_solver=None):
+    cols_sim = db.get_colnames(qdb.TABLE_NAME_SIM)[1:]
+    cols_qsp = db.get_colnames(qdb.TABLE_NAME_QSP)[1:]
+    cols_abm = db.get_colnames(qdb.TABLE_NAME_ABM)[1:]
+    with db.transaction():
+        sim_id = db.add_entry(qdb.TABLE_NAME_SIM, cols_sim, [str(param_id), str(treat), str(rep)])
+        db.add_entries(qdb.TABLE_NAME_QSP, cols_qsp,
+                       ([sim_id] + row for row in data_qsp))
+        for window, rows in data_abm.items():
+            db.add_entries(qdb.TABLE_NAME_ABM, cols_abm,
+                           ([sim_id, window] + row for row in rows))
+        if data_solver is not None:
+            header, rows = data_solver
+            create_solver_table(db, header)
+            db.add_entries(qdb.TABLE_NAME_SOLVER, ['sim_id'] + header,
+                           ([sim_id] + row for row in rows))
+    return sim_id
+
 # save simulation results to database
 def archive_result(working_dir, db, group, sample, treat, rep, windows=['margin','core']):
                 
     sim_dir = get_sim_dir(working_dir, group, sample, treat, rep)
     
     # only archive result when initialization is successful
-    if not list(sim_dir.glob(TAG_QSP_IC_SUCCESS)):
+    if not (sim_dir/TAG_QSP_IC_SUCCESS).exists():
         print('Failed initialization in:', sim_dir)
         return sim_dir
     
-    if not list(sim_dir.glob(TAG_ABM_SIM_SUCCESS)):
+    if not (sim_dir/TAG_ABM_SIM_SUCCESS).exists():
         print('Failed abm in:', sim_dir)
         return sim_dir
     
-    # Parameter combindation
-    param_id = get_param_id(db, group, sample)
-
-    cols_sim = db.get_colnames(qdb.TABLE_NAME_SIM)[1:]
-    cols_qsp = db.get_colnames(qdb.TABLE_NAME_QSP)[1:]
-    cols_abm = db.get_colnames(qdb.TABLE_NAME_ABM)[1:]
-    
     # Simulation    
     sim_id = get_sim_id(db, group, sample, treat, rep)
     if sim_id is None:
-        sim_id = db.add_entry(qdb.TABLE_NAME_SIM, cols_sim, [str(param_id), str(treat), str(rep)])
-        
-        # QSP
-        qsp_files = list(sim_dir.glob('QSP*.csv'))
-        assert len(qsp_files)==1, 'QSP stats file not found in {}'.format(str(sim_dir))
-            
-        filename_qsp = str(qsp_files[0])
-        
-        header, data = qa.read_csv(filename_qsp)
-        for row in data:
-            values = [str(sim_id)] + list(np.nan_to_num(row.astype(np.float)).astype(str))
-            db.add_entry(qdb.TABLE_NAME_QSP, cols_qsp, values)
-            
-        # ABM core/margin
-        for window in windows:
-            stats_file_pattern='stats_{}*.csv'.format(window)
-            filename_core_abm = [str(f) for f in sim_dir.glob(stats_file_pattern)][0]
-            header, data = qa.read_csv(filename_core_abm)
-            for row in data:
-                values = [str(sim_id), '"{}"'.format(window)] + list(np.nan_to_num(row.astype(np.float)).astype(str))
-                db.add_entry(qdb.TABLE_NAME_ABM, cols_abm, values)
-                
-        db.commit()
+        # Parameter combindation
+        param_id = get_param_id(db, group, sample)
+        # parse all files before writing, so that a failure leaves nothing behind
+        data_qsp, data_abm, data_solver = read_sim_result(sim_dir, windows)
+        write_sim_result(db, param_id, treat, rep, data_qsp, data_abm, data_solver)
     return sim_dir
 
+#%% parallel archiving
+######################################################################
+# discover all runs of a sweep, parse them in a process pool and write
+# them to the database from this (single writer) process
+######################################################################
+
+SIM_DIR_PATTERN = re.compile(r'group_(\d+)/sample_(\d+)/treatment_(\d+)/rep_(\d+)$')
+
+# all simulation directories under working_dir
+# return: list of ((group, sample, treat, rep), sim_dir), sorted by ids
+def find_sim_dirs(working_dir):
+    runs = []
+    for sim_dir in working_dir.glob('group_*/sample_*/treatment_*/rep_*'):
+        m = SIM_DIR_PATTERN.search(sim_dir.as_posix())
+        if m and sim_dir.is_dir():
+            runs.append((tuple(int(x) for x in m.groups()), sim_dir))
+    return sorted(runs)
+
+# (group, sample, treat, rep) of all archived simulations, in one query
+def get_archived_runs(db):
+    cmd = 'SELECT p.group_id, p.sample_id, s.treatment_id, s.replication_id '\
+        'FROM {} AS s JOIN {} AS p ON s.parameter_id = p.UID'\
+        .format(qdb.TABLE_NAME_SIM, qdb.TABLE_NAME_PARAM)
+    return set(tuple(int(x) for x in r) for r in db.query(cmd))
+
+# {(group, sample): parameter id}, in one query
+def get_param_ids(db):
+    rows = db.fetch(qdb.TABLE_NAME_PARAM, ['group_id', 'sample_id', 'UID'])
+    return {(int(g), int(s)): uid for g, s, uid in rows}
+
+# worker: parse one completed run; errors are returned, not raised
+def _read_run(job):
+    key, sim_dir, windows = job
+    try:
+        return key, sim_dir, read_sim_result(sim_dir, windows), None
+    except Exception as e:
+        return key, sim_dir, None, repr(e)
+
+# archive every completed run under working_dir.
+# Runs already in the database are skipped, so an interrupted archive
+# resumes where it stopped; each run is committed on its own.
+# param_dir: if given, LHS parameters of all discovered groups are archived first
+# processes: number of parsing processes (None: all cores)
+# bulk: switch db to the bulk archiving settings (qdb.PRAGMAS_BULK)
+# return: list of (sim_dir, reason) for runs that were not archived
+def archive_all(working_dir, db, param_dir=None, windows=['margin','core'],
+                processes=None, report_every=100, bulk=False):
+    if bulk:
+        db.set_pragmas(qdb.PRAGMAS_BULK)
+    runs = find_sim_dirs(working_dir)
+    if param_dir is not None:
+        for group in sorted(set(key[0] for key, _ in runs)):
+            archive_param(param_dir, db, group)
+    param_ids = get_param_ids(db)
+    archived = get_archived_runs(db)
+
+    skipped = []
+    jobs = []
+    for key, sim_dir in runs:
+        if key in archived:
+            continue
+        if not (sim_dir/TAG_QSP_IC_SUCCESS).exists():
+            skipped.append((sim_dir, 'Failed initialization'))
+        elif not (sim_dir/TAG_ABM_SIM_SUCCESS).exists():
+            skipped.append((sim_dir, 'Failed abm'))
+        elif key[:2] not in param_ids:
+            skipped.append((sim_dir, 'Parameters not archived'))
+        else:
+            jobs.append((key, sim_dir, windows))
+    print('Runs found: {}, archived: {}, to archive: {}, skipped: {}'\
+          .format(len(runs), len(archived), len(jobs), len(skipped)))
+
+    with Pool(processes) as pool:
+        for i, (key, sim_dir, res, err) in enumerate(pool.imap_unordered(_read_run, jobs)):
+            if err is None:
+                write_sim_result(db, param_ids[key[:2]], key[2], key[3], *res)
+            else:
+                skipped.append((sim_dir, err))
+            if (i+1) % report_every == 0 or i+1 == len(jobs):
+                print('Archived {}/{}'.format(i+1, len(jobs)))
+    for sim_dir, reason in skipped:
+        print('{}: {}'.format(reason, sim_dir))
+    return skipped
+
 #%% data pre-processing
 ######################################################################
 # retrieve readouts and preprocess for analysis
@@ -342,6 +471,199 @@ def get_readout(db, sub_id, sample_id, treat_id, rep_id, t_sim_start, weight_qsp
         
     return data, d_chg, d1, v1
 
+#%% batched readouts
+######################################################################
+# readouts of a whole cohort: QSP and ABM rows of all selected runs are
+# pulled with one query per table and window, and READOUT_NAMES are
+# computed with grouped array operations (same definitions as get_readout)
+######################################################################
+
+READOUT_KEYS = ['group', 'sample', 'treatment', 'rep']
+
+QSP_READOUT_COLS = ['Tum.C1', 'Tum.Teff_1_0', 'Tum.Teff_exhausted', 'Tum.Treg',
+                    'Tum.APC', 'Tum.mAPC', 'Cent.Teff_1_0', 'Cent.Treg']
+
+ABM_READOUT_COLS = ['agentCount.cancerCell.Stem',
+                    'agentCount.cancerCell.Progenitor',
+                    'agentCount.cancerCell.Senescent',
+                    'agentCount.CD8.effector',
+                    'agentCount.CD8.cytotoxic',
+                    'agentCount.CD8.suppressed',
+                    'agentCount.Treg.default',
+                    'PDL1_pos']
+
+# WHERE clause selecting runs by group and treatment ids (None: all)
+def _run_condition(groups, treatments):
+    clauses, params = [], []
+    for col, ids in [('p.group_id', groups), ('s.treatment_id', treatments)]:
+        if ids is not None:
+            ids = [int(x) for x in ids]
+            clauses.append('{} IN ({})'.format(col, ','.join('?'*len(ids))))
+            params += ids
+    return ('WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+# selected runs, ordered by sim_id
+# return: sim_id (n_run,); keys (n_run, 4): group, sample, treatment, rep
+def get_runs(db, groups=None, treatments=None):
+    condition, params = _run_condition(groups, treatments)
+    cmd = 'SELECT s.UID, p.group_id, p.sample_id, s.treatment_id, s.replication_id '\
+        'FROM {} AS s JOIN {} AS p ON s.parameter_id = p.UID {} ORDER BY s.UID'\
+        .format(qdb.TABLE_NAME_SIM, qdb.TABLE_NAME_PARAM, condition)
+    rows = np.array(db.query(cmd, params), dtype=np.int64).reshape(-1, 5)
+    return rows[:, 0], rows[:, 1:]
+
+# rows of a result table for the selected runs, ordered by sim_id and time
+# return: run (index into sim_id of each row), time, data (n_row, len(cols))
+def fetch_runs(db, table_name, cols, sim_id, groups=None, treatments=None, window=None):
+    condition, params = _run_condition(groups, treatments)
+    if window is not None:
+        condition += (' AND ' if condition else 'WHERE ') + 't.window = ?'
+        params.append(window)
+    cmd = 'SELECT t.sim_id, t.time, {} FROM {} AS t '\
+        'JOIN {} AS s ON t.sim_id = s.UID JOIN {} AS p ON s.parameter_id = p.UID '\
+        '{} ORDER BY t.sim_id, t.time'\
+        .format(', '.join(['t.[{}]'.format(c) for c in cols]), table_name,
+                qdb.TABLE_NAME_SIM, qdb.TABLE_NAME_PARAM, condition)
+    rows = np.array(db.query(cmd, params), dtype=float).reshape(-1, len(cols)+2)
+    run = np.searchsorted(sim_id, rows[:, 0].astype(np.int64))
+    return run, rows[:, 1], rows[:, 2:]
+
+# solver statistics summed over the output intervals of each selected run,
+# slowest first; events: total firings of all events (TOTAL: event columns
+# added for later models are NULL for earlier runs)
+# return: keys (n_run, 4): group, sample, treatment, rep; DataFrame of totals
+def get_solver_summary(db, groups=None, treatments=None):
+    cols = db.get_colnames(qdb.TABLE_NAME_SOLVER)
+    counters = [c for c in cols if c.startswith('n_')]
+    events = [c for c in cols if c.startswith('fired_')]
+    condition, params = _run_condition(groups, treatments)
+    cmd = 'SELECT p.group_id, p.sample_id, s.treatment_id, s.replication_id, '\
+        'SUM(t.wall_time), {}, {} FROM {} AS t '\
+        'JOIN {} AS s ON t.sim_id = s.UID JOIN {} AS p ON s.parameter_id = p.UID '\
+        '{} GROUP BY t.sim_id ORDER BY SUM(t.wall_time) DESC'\
+        .format(', '.join(['TOTAL(t.[{}])'.format(c) for c in counters]),
+                ' + '.join(['TOTAL(t.[{}])'.format(c) for c in events]) or '0',
+                qdb.TABLE_NAME_SOLVER, qdb.TABLE_NAME_SIM, qdb.TABLE_NAME_PARAM, condition)
+    rows = np.array(db.query(cmd, params), dtype=float).reshape(-1, len(counters)+6)
+    summary = pd.DataFrame(rows[:, 4:], columns=['wall_time'] + counters + ['events'])
+    return rows[:, :4].astype(np.int64), summary
+
+# first row of each run where mask holds; -1 for runs without one
+def _first_row(run, mask, n_run):
+    first = np.full(n_run, -1)
+    idx = np.flatnonzero(mask)
+    r, pos = np.unique(run[idx], return_index=True)
+    first[r] = idx[pos]
+    return first
+
+# last row of each run; -1 for runs without rows
+def _last_row(run, n_run):
+    last = np.full(n_run, -1)
+    r, pos = np.unique(run[::-1], return_index=True)
+    last[r] = len(run) - 1 - pos
+    return last
+
+# x[idx] with nan where idx < 0
+def _take(x, idx):
+    if len(x) == 0:
+        return np.full(len(idx), np.nan)
+    return np.where(idx >= 0, x[np.maximum(idx, 0)], np.nan)
+
+# ABM rows at the same position in each run as the QSP start row
+# (ABM and QSP share the recording time points, as in get_readout)
+# return: cc, tc, treg, PDL1 at start, nan where missing
+def _abm_cells_at(db, window, sim_id, groups, treatments, offset):
+    n_run = len(sim_id)
+    run, _, data = fetch_runs(db, qdb.TABLE_NAME_ABM, ABM_READOUT_COLS,
+                              sim_id, groups, treatments, window)
+    first = _first_row(run, np.ones(len(run), bool), n_run)
+    last = _last_row(run, n_run)
+    row = np.where((first >= 0) & (offset >= 0) & (first + offset <= last), first + offset, -1)
+    cc = _take(data[:, 0:3].sum(axis=1), row)
+    tc = _take(data[:, 3:6].sum(axis=1), row)
+    treg = _take(data[:, 6], row)
+    PDL1 = _take(data[:, 7], row)
+    return cc, tc, treg, PDL1
+
+# READOUT_NAMES of all runs in the selected groups and treatments
+# runs without data at t_sim_start have nan readouts; ratios of runs with
+# zero tcyt are inf/nan (get_readout raises for these)
+# return: DataFrame indexed by (group, sample, treatment, rep)
+def get_readout_cohort(db, t_sim_start, weight_qsp, groups=None, treatments=None, SLICE_PER_DAY=4):
+    sim_id, keys = get_runs(db, groups, treatments)
+    n_run = len(sim_id)
+
+    # QSP readouts
+    run, time_qsp, data_qsp = fetch_runs(db, qdb.TABLE_NAME_QSP, QSP_READOUT_COLS,
+                                         sim_id, groups, treatments)
+    C_qsp = data_qsp[:, 0]
+    t_qsp = data_qsp[:, 1] + data_qsp[:, 2]
+    treg_qsp = data_qsp[:, 3]
+    apc_qsp = data_qsp[:, 4] + data_qsp[:, 5]
+    tcyt_cent = data_qsp[:, 6]
+    treg_cent = data_qsp[:, 7]
+
+    cc = C_qsp/weight_qsp
+    tc = t_qsp/weight_qsp
+    treg = treg_qsp/weight_qsp
+    d1 = qa.get_tum_diameter(tc+treg, cc, apc_qsp)
+
+    row_first = _first_row(run, np.ones(len(run), bool), n_run)
+    row_start = _first_row(run, time_qsp >= t_sim_start, n_run)
+    row_end = _last_row(run, n_run)
+    d0 = _take(d1, row_start)
+    d_chg = d1/d0[run] - 1 if len(run) else d1
+    # first time point where diameter change is larger than 20%
+    row_prog = _first_row(run, d_chg > .2, n_run)
+    time_max_day = _take(time_qsp, row_end) + 1
+
+    # ABM readouts
+    offset = np.where(row_start >= 0, row_start - row_first, -1)
+    cc_core, tc_core, treg_core, PDL1_core = _abm_cells_at(
+        db, 'core', sim_id, groups, treatments, offset)
+    cc_margin, tc_margin, treg_margin, PDL1_margin = _abm_cells_at(
+        db, 'margin', sim_id, groups, treatments, offset)
+    all_core = cc_core + tc_core + treg_core
+    all_margin = cc_margin + tc_margin + treg_margin
+
+    data = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        data['d_chg'] = _take(d_chg, row_end)
+        data['t_to_prog'] = (np.where(row_prog >= 0, _take(time_qsp, row_prog), time_max_day)
+                             - t_sim_start)/SLICE_PER_DAY
+        data['event_prog'] = (row_prog >= 0).astype(float)
+        data['diam_T'] = _take(d1, row_end)
+        data['tumor_C_end'] = _take(cc, row_end)
+        data['cent_tcyt'] = _take(tcyt_cent, row_start)
+        data['cent_treg'] = _take(treg_cent, row_start)
+        data['cent_RC_ratio'] = data['cent_treg']/data['cent_tcyt']
+        data['tumor_tcyt'] = _take(t_qsp, row_start)
+        data['tumor_treg'] = _take(treg_qsp, row_start)
+        data['tumor_RC_ratio'] = data['tumor_treg']/data['tumor_tcyt']
+        data['tumor_C_0'] = _take(cc, row_start)
+        data['diam_T_0'] = d0
+
+        data['margin_tcyt'] = tc_margin
+        data['margin_treg'] = treg_margin
+        data['margin_RC_ratio'] = treg_margin/tc_margin
+        data['margin_PDL1'] = PDL1_margin/all_margin
+        data['margin_cancer'] = cc_margin
+        data['core_tcyt'] = tc_core
+        data['core_treg'] = treg_core
+        data['core_RC_ratio'] = treg_core/tc_core
+        data['core_PDL1'] = PDL1_core/all_core
+        data['core_cancer'] = cc_core
+
+    num_missing = np.sum(row_start < 0)
+    if num_missing:
+        print('No QSP output at t_sim_start for {} runs'.format(num_missing))
+    num_zero = np.sum((tc_margin == 0) | (tc_core == 0))
+    if num_zero:
+        print('0 tcyt in ratio for {} runs'.format(num_zero))
+
+    index = pd.MultiIndex.from_arrays(keys.T, names=READOUT_KEYS)
+    return pd.DataFrame({name: data[name] for name in READOUT_NAMES}, index=index)
+
 # get parameter values as a dictionary
 def get_param_dict(param_file):
     
@@ -7,23 +7,52 @@ Save the result of a set of simulations to a database file
 
 import sqlite3
 from sqlite3 import Error
+from contextlib import contextmanager
 
 TABLE_NAME_PARAM = 'table_param' # 
 TABLE_NAME_SIM = 'table_simulation' # 
 TABLE_NAME_QSP = 'table_qsp'
 TABLE_NAME_ABM = 'table_abm'
+TABLE_NAME_SOLVER = 'table_solver' # solver statistics per output interval
 
 
 TYPE_STR = 'TEXT'
 TYPE_FLOAT = 'REAL'
 TYPE_INT = 'INTEGER'
 
+# connection settings for bulk archiving: write-ahead log, fewer fsyncs,
+# larger page cache (negative: KiB), temporary tables in memory.
+# Opt-in (bulk=True): WAL is stored in the database file and leaves
+# -wal/-shm files next to it while connected.
+PRAGMAS_BULK = {'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'cache_size': -200000,
+                'temp_store': 'MEMORY',
+                'foreign_keys': 'ON'}
+
+# schema: references to parent tables, {table: {column: parent table}}
+FOREIGN_KEYS = {TABLE_NAME_SIM: {'parameter_id': TABLE_NAME_PARAM},
+                TABLE_NAME_QSP: {'sim_id': TABLE_NAME_SIM},
+                TABLE_NAME_ABM: {'sim_id': TABLE_NAME_SIM},
+                TABLE_NAME_SOLVER: {'sim_id': TABLE_NAME_SIM}}
+
+# schema: indexes matching the lookups of QSP_data_processing,
+# {table: [column tuple, ...]}
+INDEXES = {TABLE_NAME_PARAM: [('group_id', 'sample_id')],
+           TABLE_NAME_SIM: [('parameter_id', 'treatment_id', 'replication_id')],
+           TABLE_NAME_QSP: [('sim_id', 'time')],
+           TABLE_NAME_ABM: [('sim_id', 'window', 'time')],
+           TABLE_NAME_SOLVER: [('sim_id', 'time')]}
+
 class sim_result_db():
     # constructor
-    def __init__(self, db_file):
+    # bulk: apply PRAGMAS_BULK after connecting; default sqlite settings otherwise
+    def __init__(self, db_file, bulk=False):
         self.conn = None
         self.c = None
         self._connect(db_file)
+        if bulk:
+            self.set_pragmas(PRAGMAS_BULK)
         return
     # connect to database file; create one if not exist
     def _connect(self, db_file):
@@ -33,6 +62,22 @@ class sim_result_db():
             print(e)
         self.c = self.conn.cursor()
         return
+    # apply PRAGMA settings
+    def set_pragmas(self, pragmas):
+        for key, val in (pragmas or {}).items():
+            self.c.execute('PRAGMA {} = {}'.format(key, val))
+        return
+    # group statements into one transaction: commit on success, roll back on error
+    # usage: with db.transaction(): ...
+    @contextmanager
+    def transaction(self):
+        try:
+            yield self
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        return
     # commit edit
     def commit(self):
         self.conn.commit()
@@ -43,13 +88,57 @@ class sim_result_db():
         self.conn.close()
         return
     # col_name and col_type: list of same length
+    # foreign keys and indexes of known tables (FOREIGN_KEYS, INDEXES) are added
     def create_table(self, table_name, col_name, col_type):
+        self.c.execute(self._create_table_cmd(table_name, table_name, col_name, col_type))
+        self.create_indexes(table_name)
+        return
+    def _create_table_cmd(self, table_name, schema_name, col_name, col_type):
         cmd = 'CREATE TABLE IF NOT EXISTS {} (\n'.format(table_name)
         cmd += 'UID INTEGER PRIMARY KEY AUTOINCREMENT,\n'
         assert len(col_name) == len(col_type)
         cmd += ',\n'.join(['[{}] {}'.format(c, col_type[i]) for i, c in enumerate(col_name)])
+        for c, parent in FOREIGN_KEYS.get(schema_name, {}).items():
+            if c in col_name:
+                cmd += ',\nFOREIGN KEY([{}]) REFERENCES {}(UID)'.format(c, parent)
         cmd += ')'
-        self.c.execute(cmd)
+        return cmd
+    # create the indexes listed in INDEXES for one table
+    def create_indexes(self, table_name):
+        cols = self.get_colnames(table_name)
+        for idx_cols in INDEXES.get(table_name, []):
+            if all(c in cols for c in idx_cols):
+                self.c.execute('CREATE INDEX IF NOT EXISTS idx_{}_{} ON {} ({})'\
+                               .format(table_name, '_'.join(idx_cols), table_name,
+                                       ', '.join(['[' + c + ']' for c in idx_cols])))
+        return
+    # bring an existing database file up to the current schema:
+    # rebuild tables lacking their foreign keys, add indexes, update statistics
+    def migrate(self):
+        tables = [r[0] for r in self.c.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()]
+        self.commit()
+        self.c.execute('PRAGMA foreign_keys = OFF')
+        with self.transaction():
+            for table_name in [TABLE_NAME_PARAM, TABLE_NAME_SIM, TABLE_NAME_QSP, TABLE_NAME_ABM,
+                               TABLE_NAME_SOLVER]:
+                if table_name not in tables:
+                    continue
+                has_fk = self.c.execute('PRAGMA foreign_key_list({})'.format(table_name)).fetchall()
+                if FOREIGN_KEYS.get(table_name) and not has_fk:
+                    print('Adding foreign keys to:', table_name)
+                    info = self.get_table_info(table_name)[1:]
+                    tmp_name = table_name + '_migrate'
+                    self.c.execute(self._create_table_cmd(tmp_name, table_name,
+                                                          [r[1] for r in info], [r[2] for r in info]))
+                    self.c.execute('INSERT INTO {} SELECT * FROM {}'.format(tmp_name, table_name))
+                    self.c.execute('DROP TABLE {}'.format(table_name))
+                    self.c.execute('ALTER TABLE {} RENAME TO {}'.format(tmp_name, table_name))
+                print('Creating indexes for:', table_name)
+                self.create_indexes(table_name)
+        self.c.execute('PRAGMA foreign_keys = ON')
+        self.c.execute('ANALYZE')
+        self.commit()
         return
     # table info: cid, name, type, notnull, default, primary_key
     def get_table_info(self, table_name):
@@ -64,6 +153,18 @@ class sim_result_db():
         self.c.execute("INSERT OR IGNORE INTO {tn} ({col}) VALUES ({val})"\
                   .format(tn=table_name, col=col_name, val=val_str))
         return self.c.lastrowid
+    # add many entries with one parameterized statement.
+    # rows: iterable of value sequences (python numbers/strings, no SQL quoting)
+    # Does not commit; wrap in transaction() or call commit().
+    def add_entries(self, table_name, cols, rows):
+        col_name = ", ".join(['[' + c + ']' for c in cols])
+        placeholder = ", ".join(['?'] * len(cols))
+        self.c.executemany("INSERT OR IGNORE INTO {tn} ({col}) VALUES ({val})"\
+                  .format(tn=table_name, col=col_name, val=placeholder), rows)
+        return self.c.rowcount
+    # run a query with bound parameters and return all rows
+    def query(self, cmd, params=()):
+        return self.c.execute(cmd, params).fetchall()
     # fetch results. colnames: list of column names (even if only one column); condition: string
     def fetch(self, table_name, col_names='*', condition=''):
         cols = '*'
@@ -75,3 +176,16 @@ class sim_result_db():
         self.c.execute(cmd)
         res = self.c.fetchall()
         return res
+
+#%%
+if (__name__ == '__main__'):
+    import sys
+    # usage: python QSP_db.py migrate <db_file> [<db_file> ...]
+    if len(sys.argv) > 2 and sys.argv[1] == 'migrate':
+        for db_file in sys.argv[2:]:
+            print('Migrating:', db_file)
+            db = sim_result_db(db_file)
+            db.migrate()
+            db.close()
+    else:
+        print('usage: python QSP_db.py migrate <db_file> [<db_file> ...]')
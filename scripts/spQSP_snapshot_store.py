@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Binary columnar store for ABM snapshot output
+
+convert_snapshots packs the csv files of a snapShots directory
+(cell_<t>.csv, score_<t>.csv, cyto_<t>.csv, grid_core_<t>.csv) into one store
+directory with one group per file. Each column is saved as a .npy file so
+that snapshot_store can memory-map it instead of re-parsing text.
+
+Layout:
+    <store>/<prefix><t>/_meta.json      columns and row count
+    <store>/<prefix><t>/<column>.npy    one array per column
+    <store>/<prefix><t>/_y_offsets.npy  cell files only: rows are sorted by y,
+                                        rows of plane y are [off[y], off[y+1])
+"""
+
+import json
+import re
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+STORE_DIR = 'snapShots_store'
+FILE_META = '_meta.json'
+FILE_Y_OFFSETS = '_y_offsets.npy'
+
+PREFIX_CELL = 'cell_'
+PREFIX_SCORE = 'score_'
+PREFIX_CYTO = 'cyto_'
+PREFIX_GRID_CORE = 'grid_core_'
+
+# files with one row per cell (sorted by y in the store)
+CELL_PREFIXES = [PREFIX_CELL, PREFIX_SCORE]
+# files with one row per voxel, x index running fastest
+GRID_PREFIXES = [PREFIX_CYTO, PREFIX_GRID_CORE]
+SNAPSHOT_PREFIXES = CELL_PREFIXES + GRID_PREFIXES
+
+# columns kept as text
+TEXT_COLUMNS = ['extra']
+
+COL_Y = 'y'
+
+#%% conversion
+
+# default store location: next to the snapShots directory
+def get_store_dir(snap_dir):
+    return Path(snap_dir).parent/STORE_DIR
+
+# snapshot csv files of one prefix; return: dict time -> path
+def list_snapshot_files(snap_dir, prefix):
+    pattern = re.compile(r'^{}(\d+)\.csv$'.format(re.escape(prefix)))
+    files = {}
+    for f in Path(snap_dir).glob('{}*.csv'.format(prefix)):
+        m = pattern.match(f.name)
+        if m:
+            files[int(m.group(1))] = f
+    return files
+
+# parse one csv file into a dict of column arrays
+def read_snapshot_csv(filename, prefix):
+    df = pd.read_csv(filename, dtype={c: str for c in TEXT_COLUMNS})
+    # cell_ header ends with a trailing delimiter in older outputs
+    df = df.loc[:, [c for c in df.columns if not c.startswith('Unnamed:')]]
+    columns = {}
+    for c in df.columns:
+        if c in TEXT_COLUMNS or not pd.api.types.is_numeric_dtype(df[c]):
+            columns[c] = df[c].fillna('').str.replace('"', '').to_numpy(dtype=str)
+        else:
+            columns[c] = df[c].to_numpy()
+    return list(df.columns), columns
+
+# convert one csv file into a store group
+def convert_file(filename, group_dir, prefix):
+    names, columns = read_snapshot_csv(filename, prefix)
+    nrow = len(next(iter(columns.values()))) if columns else 0
+    group_dir = Path(group_dir)
+    group_dir.mkdir(parents=True, exist_ok=True)
+
+    if prefix in CELL_PREFIXES and COL_Y in columns and nrow:
+        y = np.clip(np.floor(columns[COL_Y]), 0, None).astype(np.int64)
+        order = np.argsort(y, kind='stable')
+        columns = {c: v[order] for c, v in columns.items()}
+        counts = np.bincount(y)
+        np.save(group_dir/FILE_Y_OFFSETS, np.concatenate([[0], np.cumsum(counts)]))
+
+    for i, c in enumerate(names):
+        np.save(group_dir/'{}.npy'.format(i), columns[c])
+    # meta file is written last; its presence marks a complete group
+    with open(group_dir/FILE_META, 'w') as f:
+        json.dump({'columns': names, 'rows': int(nrow),
+                   'source': Path(filename).name}, f)
+    return group_dir
+
+# pack a snapShots directory into a columnar store
+# groups that are already complete are skipped unless overwrite is set
+# processes: number of worker processes (1: convert in this process)
+# return: store directory
+def convert_snapshots(snap_dir, store_dir=None, prefixes=SNAPSHOT_PREFIXES,
+                      overwrite=False, processes=1):
+    store_dir = get_store_dir(snap_dir) if store_dir is None else Path(store_dir)
+    jobs = []
+    for prefix in prefixes:
+        for t, f in sorted(list_snapshot_files(snap_dir, prefix).items()):
+            group_dir = store_dir/'{}{}'.format(prefix, t)
+            if overwrite or not (group_dir/FILE_META).exists():
+                jobs.append((f, group_dir, prefix))
+    if processes > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(processes) as pool:
+            list(pool.map(convert_file, *zip(*jobs)))
+    else:
+        for job in jobs:
+            convert_file(*job)
+    return store_dir
+
+#%% reader
+
+# True if path is a store, or a snapShots directory with a converted store
+def has_store(path):
+    path = Path(path)
+    return any(path.glob('*/' + FILE_META)) \
+        or any(get_store_dir(path).glob('*/' + FILE_META))
+
+class snapshot_store():
+    # store_dir: store directory, or the snapShots directory it was built from
+    def __init__(self, store_dir):
+        store_dir = Path(store_dir)
+        if not any(store_dir.glob('*/' + FILE_META)):
+            store_dir = get_store_dir(store_dir)
+        self.store_dir = store_dir
+        self._meta = {}
+        return
+
+    # available time points for a prefix
+    def times(self, prefix=PREFIX_SCORE):
+        pattern = re.compile(r'^{}(\d+)$'.format(re.escape(prefix)))
+        times = []
+        for meta in self.store_dir.glob('{}*/{}'.format(prefix, FILE_META)):
+            m = pattern.match(meta.parent.name)
+            if m:
+                times.append(int(m.group(1)))
+        return sorted(times)
+
+    def _group(self, prefix, t):
+        return self.store_dir/'{}{}'.format(prefix, t)
+
+    # columns and row count of one group
+    def meta(self, prefix, t):
+        key = (prefix, t)
+        if key not in self._meta:
+            with open(self._group(prefix, t)/FILE_META) as f:
+                self._meta[key] = json.load(f)
+        return self._meta[key]
+
+    # column names of one group
+    def columns(self, prefix, t):
+        return self.meta(prefix, t)['columns']
+
+    # memory-mapped column array, by name or position
+    def column(self, prefix, t, col):
+        names = self.columns(prefix, t)
+        i = col if isinstance(col, int) else names.index(col)
+        return np.load(self._group(prefix, t)/'{}.npy'.format(i), mmap_mode='r')
+
+    # dict of memory-mapped columns; rows optionally restricted to a slice
+    def get(self, prefix, t, columns=None, rows=slice(None)):
+        names = self.columns(prefix, t) if columns is None else columns
+        return {c: self.column(prefix, t, c)[rows] for c in names}
+
+    # one time slice as a DataFrame
+    def get_frame(self, prefix, t, columns=None):
+        data = self.get(prefix, t, columns)
+        return pd.DataFrame({c: np.asarray(v) for c, v in data.items()})
+
+    # row range of plane y in a cell file group
+    def plane_rows(self, prefix, t, y):
+        off = np.load(self._group(prefix, t)/FILE_Y_OFFSETS, mmap_mode='r')
+        if y < 0 or y >= len(off) - 1:
+            return slice(0, 0)
+        return slice(int(off[y]), int(off[y+1]))
+
+    # cells of plane y as a dict of columns (cell_/score_ groups only)
+    def get_plane(self, prefix, t, y, columns=None):
+        return self.get(prefix, t, columns, self.plane_rows(prefix, t, y))
+
+    # voxel values of a grid file as array (nx, ny, nz) per column.
+    # shape: (nx, ny, nz); a cubic grid is assumed when not given
+    def get_grid(self, prefix, t, col=0, shape=None):
+        v = self.column(prefix, t, col)
+        if shape is None:
+            n = int(round(len(v) ** (1/3)))
+            assert n**3 == len(v), 'grid shape required for {} rows'.format(len(v))
+            shape = (n, n, n)
+        nx, ny, nz = shape
+        return v.reshape(nz, ny, nx).transpose(2, 1, 0)
+
+    # same return value as spQSP_histpath_visual.getCellData:
+    # crd: x, y, z, type, state, numeric; extra: cell specific text
+    def get_cell_data(self, t):
+        names = self.columns(PREFIX_CELL, t)
+        crd = np.column_stack([self.column(PREFIX_CELL, t, i) for i in range(5)]).astype(float)
+        extra = np.asarray(self.column(PREFIX_CELL, t, names[-1])).astype(str)
+        return crd, extra
+
+#%%
+if (__name__ == '__main__'):
+    import sys
+    # usage: python spQSP_snapshot_store.py <snapShots dir> [<snapShots dir> ...]
+    for snap_dir in sys.argv[1:]:
+        print('Converting:', snap_dir)
+        print('Store:', convert_snapshots(snap_dir))
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial metrics computed from ABM snapshot output (score_<t>.csv)
+
+Each snapshot is rasterized once into dense voxel arrays; neighborhood
+relations are then evaluated with array shifts and gathers for all y-slices
+together, instead of issuing one DataFrame lookup per cell.
+"""
+
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import spQSP_snapshot_store as sss
+
+#%%
+# snapshot output columns (score_<t>.csv: x,y,z,Type,State)
+COL_X = 'x'
+COL_Y = 'y'
+COL_Z = 'z'
+COL_TYPE = 'Type'
+COL_STATE = 'State'
+
+CELLTYPE_CANCER = 1
+
+# cell groups used as focal/target populations
+CELL_GROUPS = {'cancer': lambda t: t == CELLTYPE_CANCER,
+               'immune': lambda t: t != CELLTYPE_CANCER}
+
+SNAPSHOT_DIR = 'snapShots'
+PREFIX_SCORE = 'score_'
+FILE_NEIGHBORHOOD_STATS = 'neighborhood_stats.csv'
+
+# 4-neighborhood within a y-slice, as (dx, dz)
+NEIGHBOR_VON_NEUMANN = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+
+#%% snapshot access
+
+# time points of snapshot files with given prefix in a snapShots directory
+def get_snapshot_times(snap_dir, prefix=PREFIX_SCORE):
+    pattern = re.compile(r'^{}(\d+)\.csv$'.format(re.escape(prefix)))
+    times = []
+    for f in Path(snap_dir).glob('{}*.csv'.format(prefix)):
+        m = pattern.match(f.name)
+        if m:
+            times.append(int(m.group(1)))
+    return sorted(times)
+
+# time points of score snapshots, from the columnar store when available
+def get_score_times(snap_dir):
+    if sss.has_store(snap_dir):
+        return sss.snapshot_store(snap_dir).times(PREFIX_SCORE)
+    return get_snapshot_times(snap_dir, PREFIX_SCORE)
+
+# path to one snapshot file
+def get_snapshot_path(snap_dir, t, prefix=PREFIX_SCORE):
+    return Path(snap_dir)/'{}{}.csv'.format(prefix, t)
+
+# all snapShots directories below root (e.g. group_/sample_/treatment_/rep_ tree)
+def find_snapshot_dirs(root):
+    root = Path(root)
+    if root.name == SNAPSHOT_DIR:
+        return [root]
+    return sorted(p for p in root.rglob(SNAPSHOT_DIR) if p.is_dir())
+
+# read cell positions and types from a score_<t>.csv file
+# return: integer array (n, 3) of x, y, z and integer array (n,) of cell types
+def read_score_snapshot(filename):
+    df = pd.read_csv(filename, usecols=[COL_X, COL_Y, COL_Z, COL_TYPE])
+    crd = df[[COL_X, COL_Y, COL_Z]].to_numpy(dtype=np.int64)
+    cell_type = df[COL_TYPE].to_numpy(dtype=np.int64)
+    return crd, cell_type
+
+# score snapshot at time t of a snapShots directory; reads the columnar store
+# (spQSP_snapshot_store) when one has been converted, else the csv file
+def load_score_snapshot(snap_dir, t):
+    if sss.has_store(snap_dir):
+        store = sss.snapshot_store(snap_dir)
+        if t in store.times(PREFIX_SCORE):
+            data = store.get(PREFIX_SCORE, t, [COL_X, COL_Y, COL_Z, COL_TYPE])
+            crd = np.column_stack([data[COL_X], data[COL_Y], data[COL_Z]]).astype(np.int64)
+            return crd, np.asarray(data[COL_TYPE], dtype=np.int64)
+    return read_score_snapshot(get_snapshot_path(snap_dir, t))
+
+#%% rasterization
+
+# count cells per voxel; grid is padded by `pad` voxels in x and z so that
+# shifted neighbor lookups never wrap around.
+# crd: (n, 3) integer voxel coordinates
+# mask: cells to count
+# return: array of shape (X+2*pad, Y, Z+2*pad), and the coordinate offset
+def rasterize(crd, mask=None, shape=None, pad=1):
+    if shape is None:
+        shape = crd.max(axis=0) + 1 if len(crd) else np.zeros(3, dtype=int)
+    shape = np.asarray(shape, dtype=int)
+    offset = np.array([pad, 0, pad])
+    grid = np.zeros(shape + 2*offset, dtype=np.int32)
+    sel = crd if mask is None else crd[mask]
+    np.add.at(grid, tuple((sel + offset).T), 1)
+    return grid, offset
+
+# sum of a padded grid over x/z displacements, evaluated on the unpadded domain
+def neighbor_sum(grid, offsets, pad=1):
+    nx = grid.shape[0] - 2*pad
+    nz = grid.shape[2] - 2*pad
+    total = np.zeros((nx, grid.shape[1], nz), dtype=grid.dtype)
+    for dx, dz in offsets:
+        total += grid[pad+dx:pad+dx+nx, :, pad+dz:pad+dz+nz]
+    return total
+
+#%% mixing score
+
+# immune/cancer mixing score for every y-slice of one snapshot.
+# An immune cell (any type other than cancer) is "mixed" when at least one of
+# its four in-slice neighbors holds a cancer cell.
+# score = mixed immune cells / (immune cells + 1)
+# return: DataFrame with columns y, immune, mixed, score
+def mixing_score_slices(crd, cell_type, y_range=None):
+    is_cancer = cell_type == CELLTYPE_CANCER
+    shape = crd.max(axis=0) + 1 if len(crd) else np.ones(3, dtype=int)
+    cancer, _ = rasterize(crd, is_cancer, shape)
+    cancer_near = neighbor_sum(cancer, NEIGHBOR_VON_NEUMANN) > 0
+
+    immune_crd = crd[~is_cancer]
+    mixed = cancer_near[immune_crd[:, 0], immune_crd[:, 1], immune_crd[:, 2]]
+    n_immune = np.bincount(immune_crd[:, 1], minlength=shape[1])
+    n_mixed = np.bincount(immune_crd[mixed, 1], minlength=shape[1])
+
+    y = np.arange(shape[1]) if y_range is None else np.asarray(list(y_range))
+    y_in = np.clip(y, 0, shape[1]-1)
+    inside = (y >= 0) & (y < shape[1])
+    n_immune = np.where(inside, n_immune[y_in], 0)
+    n_mixed = np.where(inside, n_mixed[y_in], 0)
+    return pd.DataFrame({'y': y,
+                         'immune': n_immune,
+                         'mixed': n_mixed,
+                         'score': n_mixed/(n_immune + 1)})
+
+# mixing score for one score_<t>.csv file
+def mixing_score_file(filename, y_range=None):
+    crd, cell_type = read_score_snapshot(filename)
+    return mixing_score_slices(crd, cell_type, y_range)
+
+# mixing score for all time points in one snapShots directory
+# return: DataFrame with columns t, y, immune, mixed, score
+def mixing_score_series(snap_dir, y_range=None, times=None):
+    if times is None:
+        times = get_score_times(snap_dir)
+    frames = []
+    for t in times:
+        df = mixing_score_slices(*load_score_snapshot(snap_dir, t), y_range)
+        df.insert(0, 't', t)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=['t', 'y', 'immune', 'mixed', 'score'])
+    return pd.concat(frames, ignore_index=True)
+
+# apply a per-directory series function to every snapShots directory below
+# root (sweep of replicates)
+# return: DataFrame with an extra column "sim" holding the simulation
+# directory relative to root
+def snapshot_sweep(root, series, *args, **kwargs):
+    root = Path(root)
+    frames = []
+    for snap_dir in find_snapshot_dirs(root):
+        df = series(snap_dir, *args, **kwargs)
+        df.insert(0, 'sim', str(snap_dir.parent.relative_to(root)) if snap_dir != root else '.')
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=['sim'])
+    return pd.concat(frames, ignore_index=True)
+
+# mixing score for every snapShots directory below root
+def mixing_score_sweep(root, y_range=None):
+    return snapshot_sweep(root, mixing_score_series, y_range)
+
+#%% neighborhood statistics
+
+# in-slice offsets (dx, dz) within distance r (voxels) of the origin
+# metric: 'euclidean' or 'chebyshev'
+def disk_offsets(r, metric='euclidean'):
+    k = int(np.floor(r))
+    d = np.arange(-k, k+1)
+    dx, dz = np.meshgrid(d, d, indexing='ij')
+    if metric == 'euclidean':
+        dist = np.sqrt(dx**2 + dz**2)
+    elif metric == 'chebyshev':
+        dist = np.maximum(np.abs(dx), np.abs(dz))
+    else:
+        raise ValueError('Unknown metric: {}'.format(metric))
+    sel = dist <= r
+    return list(zip(dx[sel].tolist(), dz[sel].tolist()))
+
+# number of target cells in each neighborhood of every focal cell.
+# The target population is rasterized once; counts are gathered at the focal
+# voxels, one offset at a time, so cost is O(n_focal * n_offset).
+# neighborhoods: list of offset lists; nested neighborhoods (growing radii)
+# reuse the running sum of the previous one.
+# return: array (n_focal, len(neighborhoods))
+def count_neighbors(crd, focal_mask, target_mask, neighborhoods):
+    focal = crd[focal_mask]
+    counts = np.zeros((len(focal), len(neighborhoods)), dtype=np.int64)
+    if not len(focal) or not neighborhoods:
+        return counts
+    pad = max((max(abs(dx), abs(dz)) for nb in neighborhoods for dx, dz in nb), default=0)
+    shape = crd.max(axis=0) + 1
+    target, offset = rasterize(crd, target_mask, shape, pad)
+    fx, fy, fz = (focal + offset).T
+
+    running = np.zeros(len(focal), dtype=np.int64)
+    done = set()
+    for i, nb in enumerate(neighborhoods):
+        nb = set(nb)
+        if not done <= nb:
+            running[:] = 0
+            done = set()
+        for dx, dz in nb - done:
+            running += target[fx+dx, fy, fz+dz]
+        done = nb
+        counts[:, i] = running
+    # a cell in both populations does not count itself
+    self_count = target_mask[focal_mask].astype(np.int64)
+    has_origin = np.array([(0, 0) in nb for nb in neighborhoods])
+    counts -= self_count[:, None] * has_origin[None, :]
+    return counts
+
+# focal cells inside an x/z window: x0 < x < x0+l and z0 < z < z0+l
+def window_mask(crd, window):
+    if window is None:
+        return np.ones(len(crd), dtype=bool)
+    x0, z0, l = window
+    return ((crd[:, 0] > x0) & (crd[:, 0] < x0+l)
+            & (crd[:, 2] > z0) & (crd[:, 2] < z0+l))
+
+# neighborhood statistics for every y-slice of one snapshot:
+#   mean: mean number of target cells within r of a focal cell
+#   G: fraction of focal cells with at least one target cell within r
+#      (cross-type nearest neighbor distribution on the voxel lattice)
+#   K: cross-type Ripley's K, mean / target density of the slice
+#   L: sqrt(K/pi)
+# radii in voxels; no edge correction is applied.
+# neighborhoods: optional offset lists used instead of disks, one per radius
+# return: tidy DataFrame with columns y, r, n_focal, n_target, mean, G, K, L
+def neighborhood_stats_slices(crd, cell_type, radii, focal='cancer', target='immune',
+                              metric='euclidean', window=None, y_range=None,
+                              neighborhoods=None):
+    focal_mask = CELL_GROUPS[focal](cell_type) & window_mask(crd, window)
+    target_mask = CELL_GROUPS[target](cell_type)
+    if neighborhoods is None:
+        neighborhoods = [disk_offsets(r, metric) for r in radii]
+    assert len(neighborhoods) == len(radii)
+    counts = count_neighbors(crd, focal_mask, target_mask, neighborhoods)
+
+    shape = crd.max(axis=0) + 1 if len(crd) else np.ones(3, dtype=int)
+    ny = shape[1]
+    fy = crd[focal_mask, 1]
+    n_focal = np.bincount(fy, minlength=ny)
+    n_target = np.bincount(crd[target_mask, 1], minlength=ny)
+    area = shape[0] * shape[2]
+
+    y = np.arange(ny) if y_range is None else np.asarray(list(y_range))
+    inside = (y >= 0) & (y < ny)
+    y_in = np.clip(y, 0, ny-1)
+    frames = []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i, r in enumerate(radii):
+            total = np.bincount(fy, weights=counts[:, i], minlength=ny)
+            hit = np.bincount(fy, weights=counts[:, i] > 0, minlength=ny)
+            nf = np.where(inside, n_focal[y_in], 0)
+            nt = np.where(inside, n_target[y_in], 0)
+            mean = np.where(inside, total[y_in], 0) / nf
+            K = mean * area / nt
+            frames.append(pd.DataFrame({'y': y, 'r': r,
+                                        'n_focal': nf, 'n_target': nt,
+                                        'mean': mean,
+                                        'G': np.where(inside, hit[y_in], 0) / nf,
+                                        'K': K,
+                                        'L': np.sqrt(K/np.pi)}))
+    return pd.concat(frames, ignore_index=True).sort_values(['y', 'r'], kind='stable')\
+        .reset_index(drop=True)
+
+# neighborhood statistics for all time points in one snapShots directory
+# return: tidy DataFrame with columns t, y, r, n_focal, n_target, mean, G, K, L
+def neighborhood_stats_series(snap_dir, radii, times=None, **kwargs):
+    if times is None:
+        times = get_score_times(snap_dir)
+    frames = []
+    for t in times:
+        crd, cell_type = load_score_snapshot(snap_dir, t)
+        df = neighborhood_stats_slices(crd, cell_type, radii, **kwargs)
+        df.insert(0, 't', t)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=['t', 'y', 'r', 'n_focal', 'n_target',
+                                     'mean', 'G', 'K', 'L'])
+    return pd.concat(frames, ignore_index=True)
+
+# write one neighborhood statistics table per simulation below root,
+# next to its snapShots directory
+# return: list of files written
+def write_neighborhood_stats(root, radii, filename=FILE_NEIGHBORHOOD_STATS, **kwargs):
+    written = []
+    for snap_dir in find_snapshot_dirs(root):
+        df = neighborhood_stats_series(snap_dir, radii, **kwargs)
+        out = snap_dir.parent/filename
+        df.to_csv(out, index=False)
+        written.append(out)
+    return written
+
+#%% spatial entropy
+
+# sum of Euclidean distances over all pairs (i in a, j in b) of two count
+# grids on the same 2D lattice. Pair counts per displacement are obtained by
+# FFT cross-correlation, so cost is O(G log G) in the number of voxels G
+# instead of O(N^2) in the number of cells.
+def lattice_distance_sum(grid_a, grid_b):
+    nx, nz = grid_a.shape
+    fx, fz = 2*nx - 1, 2*nz - 1
+    fa = np.fft.rfft2(grid_a, s=(fx, fz))
+    fb = np.fft.rfft2(grid_b[::-1, ::-1], s=(fx, fz))
+    pairs = np.fft.irfft2(fa*fb, s=(fx, fz))
+    dx = np.arange(fx) - (nx - 1)
+    dz = np.arange(fz) - (nz - 1)
+    dist = np.sqrt(dx[:, None]**2 + dz[None, :]**2)
+    return float(np.sum(np.rint(pairs) * dist))
+
+# spatial entropy of cancer cells for every y-slice of one snapshot:
+#   E = -(d_intra/d_inter) * p * log(p)
+# d_intra: summed distances between cancer cells
+# d_inter: summed distances between cancer and immune cells
+# p: fraction of cancer cells in the slice
+# return: DataFrame with columns y, cancer, immune, p, d_intra, d_inter, entropy
+def spatial_entropy_slices(crd, cell_type, y_range=None):
+    is_cancer = cell_type == CELLTYPE_CANCER
+    shape = crd.max(axis=0) + 1 if len(crd) else np.ones(3, dtype=int)
+    cancer, _ = rasterize(crd, is_cancer, shape, pad=0)
+    immune, _ = rasterize(crd, ~is_cancer, shape, pad=0)
+
+    y = np.arange(shape[1]) if y_range is None else np.asarray(list(y_range))
+    rows = []
+    for yy in y:
+        if 0 <= yy < shape[1]:
+            c = cancer[:, yy, :]
+            m = immune[:, yy, :]
+            nc, ni = int(c.sum()), int(m.sum())
+        else:
+            nc = ni = 0
+        d_intra = lattice_distance_sum(c, c) if nc else 0.0
+        d_inter = lattice_distance_sum(c, m) if nc and ni else 0.0
+        p = nc/(nc + ni) if nc + ni else np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            e = -(d_intra/d_inter)*p*np.log(p) if d_inter else np.nan
+        rows.append((yy, nc, ni, p, d_intra, d_inter, e))
+    return pd.DataFrame(rows, columns=['y', 'cancer', 'immune', 'p',
+                                       'd_intra', 'd_inter', 'entropy'])
+
+# spatial entropy for one score_<t>.csv file
+def spatial_entropy_file(filename, y_range=None):
+    crd, cell_type = read_score_snapshot(filename)
+    return spatial_entropy_slices(crd, cell_type, y_range)
+
+# spatial entropy for all time points in one snapShots directory
+# return: DataFrame with columns t, y, cancer, immune, p, d_intra, d_inter, entropy
+def spatial_entropy_series(snap_dir, y_range=None, times=None):
+    if times is None:
+        times = get_score_times(snap_dir)
+    frames = []
+    for t in times:
+        df = spatial_entropy_slices(*load_score_snapshot(snap_dir, t), y_range)
+        df.insert(0, 't', t)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=['t', 'y', 'cancer', 'immune', 'p',
+                                     'd_intra', 'd_inter', 'entropy'])
+    return pd.concat(frames, ignore_index=True)
+
+# spatial entropy for every snapShots directory below root
+def spatial_entropy_sweep(root, y_range=None):
+    return snapshot_sweep(root, spatial_entropy_series, y_range)